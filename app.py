@@ -1,21 +1,51 @@
+import io
 import os
 import time
-import requests
-from collections import defaultdict, deque
-from flask import Flask, request, Response, send_file, send_from_directory
+import atexit
+import hmac
+from urllib.parse import urlencode
+from flask import Flask, request, Response, jsonify, send_file, send_from_directory, g
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client as TwilioClient
-from openai import OpenAI
-from google import genai
 import logging
-from murf import Murf
-from threading import Thread
-from gtts import gTTS
+from jobs import JobQueue, Mailbox, ProviderLimits, RecentKeys
+from tts_cache import AudioCache
+from audio_store import AudioStore
+from streaming import concat_mp3, iter_sentences, split_text, synthesize_in_order
+from router import ProviderRouter
+from context import build_prompt
+from store import create_store
+from http_client import HttpClient
+from transcripts import TranscriptPoller
+from llm_cache import ResponseCache
+from fakes import FakeProviders
+from providers import ProviderRegistry
+from metrics import Metrics, TraceFilter, current_trace, reset_trace, set_trace, trace
+from intents import (CONTINUE_NO, CONTINUE_YES, FAREWELL, FAREWELL_WORDS, GREETING, GREETINGS, NO, YES,
+                     IntentMatcher, load_canned_intents)
 
 # -----------------------------
 # Logging setup
 # -----------------------------
-logging.basicConfig(level=logging.DEBUG, format='[%(levelname)s] %(message)s')
+# DEBUG logging costs real time per message; opt in with LOG_LEVEL=DEBUG
+logging.basicConfig(
+    level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+    format='[%(levelname)s]%(trace)s %(message)s',
+)
+for _handler in logging.getLogger().handlers:
+    # Tag every line with the MessageSid (or transcript id) being processed
+    _handler.addFilter(TraceFilter())
+
+# Per-stage latency histograms and error/fallback counters, served at /metrics
+METRICS = Metrics()
+METRICS.histogram("bot_stage_seconds", "Latency of each pipeline stage (queue wait, STT, TTS, delivery, ...)")
+METRICS.histogram("bot_llm_seconds", "LLM call latency per provider")
+METRICS.histogram("bot_llm_first_token_seconds", "Time to the first streamed LLM token")
+METRICS.histogram("bot_http_request_seconds", "Inbound request handling time per endpoint")
+METRICS.counter("bot_errors_total", "Provider/API errors per component")
+METRICS.counter("bot_fallbacks_total", "Degraded paths taken (Murf->gTTS, audio->text, ...)")
+
+def stage_observer(pipeline):
+    return lambda stage, seconds: METRICS.observe("bot_stage_seconds", seconds, pipeline=pipeline, stage=stage)
 
 # -----------------------------
 # Secrets loader
@@ -47,46 +77,231 @@ TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
 TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER", "")
 
-GPT_CLIENT = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv("OPENROUTER_API_KEY", "")
-)
+# SDK clients are imported and built on first use (see providers.py), so a
+# worker never loads an SDK it doesn't call or has no API key for
+PROVIDERS = ProviderRegistry()
+
+# LLM clients give up after LLM_TIMEOUT_SECONDS without retrying: the router does
+# the failover, and an abandoned hedge loser must not hold a router thread for minutes
+def _openrouter_client():
+    from openai import OpenAI
+    return OpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=os.getenv("OPENROUTER_API_KEY", ""),
+        timeout=LLM_TIMEOUT_SECONDS,
+        max_retries=0
+    )
 
-GEMINI_CLIENT = genai.Client(api_key=os.getenv("GEMINI_API_KEY", ""))
+def _gemini_client():
+    from google import genai
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY", ""),
+                        http_options={"timeout": int(LLM_TIMEOUT_SECONDS * 1000)})
 
 # Prefer environment variable only (no hardcoded fallback)
 ASSEMBLYAI_API_KEY = os.getenv("ASSEMBLYAI_API_KEY", "")
 ASSEMBLYAI_BASE_URL = "https://api.assemblyai.com/v2"
+STT_TIMEOUT_SECONDS = float(os.getenv("STT_TIMEOUT_SECONDS", "60"))
+# With ASYNC_WEBHOOK, AssemblyAI can push completion to /assemblyai-callback
+# instead of being polled (needs PUBLIC_BASE_URL and a shared secret).
+ASSEMBLYAI_WEBHOOK = os.getenv("ASSEMBLYAI_WEBHOOK", "false").lower() in ("1", "true", "yes")
+ASSEMBLYAI_WEBHOOK_SECRET = os.getenv("ASSEMBLYAI_WEBHOOK_SECRET", "")
+ASSEMBLYAI_WEBHOOK_HEADER = "X-Bot-Webhook-Secret"
+# Safety-net poll interval for webhook-mode transcripts whose callback never arrives
+ASSEMBLYAI_WEBHOOK_FALLBACK_SECONDS = float(os.getenv("ASSEMBLYAI_WEBHOOK_FALLBACK_SECONDS", "15"))
+# Rough WhatsApp voice-note bitrate (Opus, ~32 kbps) used to estimate clip length for polling
+VOICE_NOTE_BYTES_PER_SECOND = 4000
+VOICE_NOTE_ERROR = "Sorry, I couldn’t transcribe your voice note. Please try again."
 
 MURF_API_KEY = os.getenv("MURF_API_KEY", "")
-MURF_SDK_CLIENT = Murf(api_key=os.getenv("MURF_SDK_API_KEY", MURF_API_KEY))
+MURF_SDK_API_KEY = os.getenv("MURF_SDK_API_KEY", MURF_API_KEY)
+
+def _murf_client():
+    from murf import Murf
+    return Murf(api_key=MURF_SDK_API_KEY)
+
+def _gtts_class():
+    from gtts import gTTS
+    return gTTS
 
 BOT_PERSONA = "You are a friendly WhatsApp assistant. Answer clearly and briefly."
 MAX_HISTORY = 6
-THANK_YOU_SUFFIX = " — Thanks for chatting!"
-CONTINUE_YES = {"y", "yes", "yeah", "yep"}
-CONTINUE_NO = {"n", "no", "nope"}
-FAREWELL_WORDS = {
-    "bye", "goodbye", "thanks", "thank you", "thx", "bye bye",
-    "see you", "see ya", "end", "stop", "exit", "good night",
-    "goodnight", "take care"
+
+OPENROUTER_MODEL = "openai/gpt-oss-20b:free"
+GEMINI_MODEL = "gemini-2.5-flash"
+# Prompt token budget per model; the prompt is trimmed to fit every configured
+# provider since the router may send the same prompt to either one.
+MODEL_TOKEN_BUDGETS = {
+    OPENROUTER_MODEL: int(os.getenv("OPENROUTER_TOKEN_BUDGET", "6000")),
+    GEMINI_MODEL: int(os.getenv("GEMINI_TOKEN_BUDGET", "8000")),
 }
+PROMPT_TOKEN_BUDGET = min(MODEL_TOKEN_BUDGETS.values())
+GREETING_REPLY = "Hey there! 👋 How are you doing today?"
+LLM_FALLBACK_REPLY = "Sorry, I'm having trouble answering right now."
+# Appended when a streamed answer breaks off after part of it was already spoken
+LLM_CUT_OFF_NOTICE = " … Sorry, my answer got cut off. Please ask again."
+THANK_YOU_SUFFIX = " — Thanks for chatting!"
+CONTINUE_PROMPT = "\n\nWould you like to continue? (yes/no)"
+# Greeting/farewell/yes-no (and optional canned replies) are matched by one
+# precompiled matcher; canned replies skip the LLM and TTS entirely
+INTENTS = IntentMatcher(
+    GREETINGS, FAREWELL_WORDS, CONTINUE_YES, CONTINUE_NO,
+    canned=load_canned_intents(os.getenv("CANNED_REPLIES_FILE", "")),
+)
 
 app = Flask(__name__)
 
-# In-memory conversation storage
-conversations = defaultdict(lambda: deque(maxlen=MAX_HISTORY))
-user_states = {}
+# Conversation history + state store. "memory" is per-process; "sqlite" (WAL)
+# can be shared by several gunicorn workers on one host.
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "memory").lower()
+CONVERSATION_DB = os.getenv("CONVERSATION_DB", "conversations.db")
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "86400"))
+STATE_TTL = float(os.getenv("STATE_TTL", "1800"))
+MAX_ACTIVE_USERS = int(os.getenv("MAX_ACTIVE_USERS", "100000"))
+STORE = create_store(CONVERSATION_STORE, MAX_HISTORY, CONVERSATION_TTL, STATE_TTL, MAX_ACTIVE_USERS, CONVERSATION_DB)
 
 # Ensure audio output directory exists and filenames are safe
 AUDIO_OUTPUT_DIR = "audio"
 os.makedirs(AUDIO_OUTPUT_DIR, exist_ok=True)
 
+# Generated replies are deleted once Twilio has fetched them (plus a grace
+# period for retries) or after a TTL; the directory has a hard size quota.
+# Audio names are unique per clip, so Twilio/CDN fetches may cache them forever
+AUDIO_CACHE_MAX_AGE = int(os.getenv("AUDIO_CACHE_MAX_AGE", "31536000"))
+# Behind Apache/lighttpd (or nginx with an X-Sendfile module) let the proxy send cold files
+app.config["USE_X_SENDFILE"] = os.getenv("AUDIO_X_SENDFILE", "false").lower() in ("1", "true", "yes")
+AUDIO_STORE = AudioStore(
+    AUDIO_OUTPUT_DIR,
+    ttl=float(os.getenv("AUDIO_TTL_SECONDS", "3600")),
+    fetched_grace=float(os.getenv("AUDIO_FETCHED_GRACE_SECONDS", "300")),
+    max_bytes=int(os.getenv("AUDIO_MAX_MB", "500")) * 1024 * 1024,
+    sweep_interval=float(os.getenv("AUDIO_SWEEP_SECONDS", "60")),
+    hot_max_bytes=int(os.getenv("AUDIO_HOT_CACHE_MB", "16")) * 1024 * 1024,
+    # Names we generate; anything else is a 404 without a disk lookup
+    name_pattern=r"^(tts_[0-9a-f]{64}|.+_response_\d+_[0-9a-f]{6}(_part\d+)?)\.mp3$",
+    # Cache entries are owned (and evicted) by the TTS cache, not by the janitor,
+    # but still count toward the quota
+    is_pinned=lambda path: TTS_CACHE.owns(path),
+    on_pinned_evicted=lambda path: TTS_CACHE.forget(path),
+)
+
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")  # e.g., https://<your-subdomain>.ngrok-free.app
-TWILIO_CLIENT = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+
+# Shared outbound HTTP layer (keep-alive pool per host, timeouts, jittered retries)
+HTTP = HttpClient(
+    connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05")),
+    read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+    retries=int(os.getenv("HTTP_RETRIES", "2")),
+    pool_size=int(os.getenv("HTTP_POOL_SIZE", "20")),
+)
+
+def _twilio_client():
+    from twilio.rest import Client as TwilioClient
+    from twilio.http.http_client import TwilioHttpClient
+    # Twilio REST goes through the same pooled session for api.twilio.com
+    twilio_http = TwilioHttpClient()
+    twilio_http.session = HTTP.session_for("api.twilio.com")
+    twilio_http.timeout = HTTP.timeout
+    return TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=twilio_http)
+
+# warm: one cheap call per client at prewarm time (imports, connection pool, TLS)
+PROVIDERS.register("openrouter", _openrouter_client, configured=bool(os.getenv("OPENROUTER_API_KEY")),
+                   warm=lambda client: client.with_options(timeout=10.0).models.list())
+PROVIDERS.register("gemini", _gemini_client, configured=bool(os.getenv("GEMINI_API_KEY")),
+                   warm=lambda client: client.models.get(model=GEMINI_MODEL))
+PROVIDERS.register("murf", _murf_client, configured=bool(MURF_SDK_API_KEY))
+PROVIDERS.register("gtts", _gtts_class)
+PROVIDERS.register("twilio", _twilio_client, configured=bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN),
+                   warm=lambda client: HTTP.session_for("api.twilio.com").head("https://api.twilio.com/",
+                                                                                timeout=HTTP.timeout))
+
+# Offline mode for benchmarks/load tests: every provider becomes a local stub
+# with configurable latency and error rate (see fakes.py)
+FAKE_PROVIDERS = os.getenv("FAKE_PROVIDERS", "false").lower() in ("1", "true", "yes")
+FAKES = None
+if FAKE_PROVIDERS:
+    FAKES = FakeProviders.from_env()
+    PROVIDERS.override("openrouter", FAKES.openai)
+    PROVIDERS.override("gemini", FAKES.gemini)
+    PROVIDERS.override("murf", FAKES.murf)
+    PROVIDERS.override("twilio", FAKES.twilio)
+    PROVIDERS.override("gtts", FAKES.gtts)
+    FAKES.mount(HTTP, ["api.assemblyai.com", "api.twilio.com"])
 USE_SIMPLE_TTS = os.getenv("USE_SIMPLE_TTS", "true").lower() in ("1", "true", "yes")
 DELIVER_MEDIA_ASYNC = True
 
+# Acknowledge-fast mode: /webhook returns empty TwiML immediately and the
+# transcribe -> generate -> TTS -> deliver pipeline runs as a queued job.
+ASYNC_WEBHOOK = os.getenv("ASYNC_WEBHOOK", "false").lower() in ("1", "true", "yes")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_QUEUE = JobQueue("webhook", workers=JOB_WORKERS, maxsize=JOB_QUEUE_SIZE, observer=stage_observer("webhook"))
+
+# Twilio retries a webhook it timed out on; MessageSids (and AssemblyAI
+# transcript ids) seen within the TTL are acknowledged without reprocessing.
+DEDUPE = RecentKeys(
+    ttl=float(os.getenv("DEDUPE_TTL_SECONDS", "600")),
+    maxsize=int(os.getenv("DEDUPE_MAX_KEYS", "10000")),
+)
+
+# Bounded pool for background TTS + media delivery; when it is full the reply
+# degrades to a text-only message instead of piling up threads.
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "8"))
+MEDIA_QUEUE_SIZE = int(os.getenv("MEDIA_QUEUE_SIZE", "200"))
+MEDIA_POOL = JobQueue("media", workers=MEDIA_WORKERS, maxsize=MEDIA_QUEUE_SIZE, observer=stage_observer("media"))
+PROVIDER_LIMITS = ProviderLimits({
+    "gtts": int(os.getenv("GTTS_CONCURRENCY", "4")),
+    "murf": int(os.getenv("MURF_CONCURRENCY", "2")),
+    "twilio": int(os.getenv("TWILIO_CONCURRENCY", "8")),
+}, observer=stage_observer("providers"))
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))
+
+# TTS voice settings (also part of the audio cache key)
+GTTS_LANG = "en"
+MURF_VOICE_ID = "ta-IN-iniya"
+MURF_STYLE = "Narration"
+MURF_SAMPLE_RATE = 24000.0
+# Longest text sent to Murf in one request (~20s of speech); longer replies are chunked
+MURF_MAX_CHARS = 500
+
+# Streaming mode: consume the completion as a token stream and send one audio
+# clip per sentence as soon as it is synthesized.
+STREAM_TTS = os.getenv("STREAM_TTS", "false").lower() in ("1", "true", "yes")
+STREAM_TTS_PARALLEL = int(os.getenv("STREAM_TTS_PARALLEL", "3"))
+
+# LLM provider router: fastest healthy provider first, hedge to the next one
+# when no answer arrives within the primary's observed latency percentile.
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "0.5"))
+LLM_HEDGE_MAX_SECONDS = float(os.getenv("LLM_HEDGE_MAX_SECONDS", "10"))
+LLM_HEDGE_DEFAULT_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Router threads: a primary plus a hedge for every job and media worker that can be waiting on an LLM
+LLM_ROUTER_WORKERS = int(os.getenv("LLM_ROUTER_WORKERS", str(2 * (JOB_WORKERS + MEDIA_WORKERS))))
+
+# Opt-in cache of replies to first questions (no history beyond the greeting);
+# concurrent identical questions share one upstream call
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "false").lower() in ("1", "true", "yes")
+LLM_CACHE = ResponseCache(
+    ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+    db_path=os.getenv("LLM_CACHE_DB") or None,
+    wait_timeout=LLM_TIMEOUT_SECONDS + 30,
+) if LLM_CACHE_ENABLED else None
+
+# Content-addressed cache of synthesized replies, keyed on (text, engine, voice)
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE", "true").lower() in ("1", "true", "yes")
+TTS_CACHE = AudioCache(
+    AUDIO_OUTPUT_DIR,
+    max_entries=int(os.getenv("TTS_CACHE_MAX_ENTRIES", "500")),
+    max_bytes=int(os.getenv("TTS_CACHE_MAX_MB", "200")) * 1024 * 1024,
+    on_evict=AUDIO_STORE.forget,
+    # A clip is cached when its text is synthesized again; one-off replies stay ordinary files
+    promote_after=int(os.getenv("TTS_CACHE_PROMOTE_AFTER", "2")),
+)
+AUDIO_STORE.start_janitor()
+
 def build_public_url_from_base(base: str, path_segment: str):
     base_clean = (base or "").strip()
     if base_clean and not base_clean.endswith('/'):
@@ -94,17 +309,13 @@ def build_public_url_from_base(base: str, path_segment: str):
     return base_clean + path_segment.lstrip('/')
 
 def set_state(user_id: str, state: str):
-    user_states[user_id] = state
+    STORE.set_state(user_id, state)
 
 def get_state(user_id: str):
-    return user_states.get(user_id, "idle")
+    return STORE.get_state(user_id)
 
 def clear_state(user_id: str):
-    if user_id in user_states:
-        del user_states[user_id]
-
-def normalize(text: str):
-    return (text or "").strip().lower()
+    STORE.clear_state(user_id)
 
 
 def sanitize_filename(name):
@@ -130,16 +341,33 @@ def is_publicly_reachable(url: str):
 
 def send_whatsapp_media(to_number: str, media_url: str, body: str = None):
     try:
-        msg = TWILIO_CLIENT.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            to=to_number,
-            body=body,
-            media_url=[media_url]
-        )
+        with PROVIDER_LIMITS.slot("twilio"):
+            msg = PROVIDERS.get("twilio").messages.create(
+                from_=TWILIO_WHATSAPP_NUMBER,
+                to=to_number,
+                body=body,
+                media_url=[media_url]
+            )
         logging.info(f"Queued WhatsApp media message sid={msg.sid} to={to_number}")
         return True
     except Exception as e:
         logging.error(f"Failed to send WhatsApp media: {e}")
+        METRICS.inc("bot_errors_total", component="twilio_media")
+        return False
+
+def send_whatsapp_text(to_number: str, body: str):
+    try:
+        with PROVIDER_LIMITS.slot("twilio"):
+            msg = PROVIDERS.get("twilio").messages.create(
+                from_=TWILIO_WHATSAPP_NUMBER,
+                to=to_number,
+                body=body
+            )
+        logging.info(f"Queued WhatsApp text message sid={msg.sid} to={to_number}")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to send WhatsApp text: {e}")
+        METRICS.inc("bot_errors_total", component="twilio_text")
         return False
 
 def _send_media_background(to_number: str, media_path_or_url: str, body: str = None, precomputed_base_url: str = ""):
@@ -156,159 +384,402 @@ def _send_media_background(to_number: str, media_path_or_url: str, body: str = N
 # -----------------------------
 # AssemblyAI STT
 # -----------------------------
-def transcribe_with_assemblyai(audio_url):
-    """Download Twilio audio, upload to AssemblyAI, and get transcription."""
-    local_file = "temp_audio.mp3"
-    try:
-        logging.info(f"Downloading audio from Twilio: {audio_url}")
-        response = requests.get(audio_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
-        if response.status_code != 200:
-            logging.error(f"Failed to download Twilio audio: {response.text}")
-            return None
+ASSEMBLYAI_UPLOAD_CHUNK_SIZE = 64 * 1024
 
-        content_type = response.headers.get("Content-Type", "")
-        ext = ".mp3"
-        if "ogg" in content_type:
-            ext = ".ogg"
-        elif "mpeg" in content_type or "mp3" in content_type:
-            ext = ".mp3"
-        elif "wav" in content_type:
-            ext = ".wav"
+def upload_to_assemblyai(audio_url):
+    """Stream the Twilio media download straight into an AssemblyAI upload.
 
-        local_file = f"temp_audio{ext}"
-        audio_bytes = response.content
-        logging.debug(f"Twilio media Content-Type={content_type}, bytes={len(audio_bytes)}")
+    Nothing touches the disk and only one chunk is held in memory at a time;
+    a failed upload re-streams from Twilio instead of keeping a copy.
+    Returns (upload_url, streamed_bytes); upload_url is None on failure.
+    """
+    for attempt in (1, 2):
+        logging.info(f"Streaming audio from Twilio to AssemblyAI (attempt {attempt}): {audio_url}")
+        t0 = time.time()
+        with HTTP.get(audio_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN), stream=True) as response:
+            JOB_QUEUE.record("media_download", time.time() - t0)
+            if response.status_code != 200:
+                logging.error(f"Failed to download Twilio audio: {response.text}")
+                return None, 0
+            content_type = response.headers.get("Content-Type", "")
+            chunks = response.iter_content(chunk_size=ASSEMBLYAI_UPLOAD_CHUNK_SIZE)
 
-        with open(local_file, "wb") as f:
-            f.write(audio_bytes)
+            # Validate we actually got audio bytes before uploading; empty uploads cause 422
+            first_chunk = next((chunk for chunk in chunks if chunk), b"")
+            if not first_chunk:
+                logging.error("Downloaded audio is empty; aborting transcription to avoid 422 upload error")
+                return None, 0
 
-        # Validate we actually downloaded audio bytes; empty uploads can cause 422
-        try:
-            downloaded_size_bytes = os.path.getsize(local_file)
-        except OSError:
-            downloaded_size_bytes = 0
-        if downloaded_size_bytes == 0:
-            logging.error("Downloaded audio file is empty; aborting transcription to avoid 422 upload error")
-            return None
+            streamed_bytes = [0]
+            def _body():
+                streamed_bytes[0] += len(first_chunk)
+                yield first_chunk
+                for chunk in chunks:
+                    if chunk:
+                        streamed_bytes[0] += len(chunk)
+                        yield chunk
 
-        logging.info("Uploading audio to AssemblyAI...")
-        def _chunked_reader(path, chunk_size=5 * 1024 * 1024):
-            with open(path, "rb") as fh:
-                while True:
-                    data = fh.read(chunk_size)
-                    if not data:
-                        break
-                    yield data
-
-        # First attempt: standard upload (set explicit octet-stream content type)
-        with open(local_file, "rb") as fbin:
-            upload_response = requests.post(
+            upload_response = HTTP.post(
                 f"{ASSEMBLYAI_BASE_URL}/upload",
                 headers={
                     "authorization": ASSEMBLYAI_API_KEY,
                     "content-type": "application/octet-stream"
                 },
-                data=fbin
+                data=_body()
             )
+            logging.debug(f"Twilio media Content-Type={content_type}, streamed bytes={streamed_bytes[0]}")
 
-        # Retry with chunked transfer if 422 or non-200
-        if upload_response.status_code != 200:
-            logging.warning(
-                f"Upload attempt 1 failed ({upload_response.status_code}): {upload_response.text}. Retrying chunked..."
-            )
-            upload_response = requests.post(
-                f"{ASSEMBLYAI_BASE_URL}/upload",
-                headers={
-                    "authorization": ASSEMBLYAI_API_KEY,
-                    "content-type": "application/octet-stream"
-                },
-                data=_chunked_reader(local_file)
-            )
+        if upload_response.status_code == 200:
+            return upload_response.json().get("upload_url"), streamed_bytes[0]
+        logging.warning(f"Upload attempt {attempt} failed ({upload_response.status_code}): {upload_response.text}")
+    logging.error("AssemblyAI upload failed")
+    METRICS.inc("bot_errors_total", component="assemblyai_upload")
+    return None, 0
 
-        if upload_response.status_code != 200:
-            logging.error(f"Upload failed ({upload_response.status_code}): {upload_response.text}")
-            return None
+def create_transcript(upload_url, webhook_url=None):
+    """Start an AssemblyAI transcription job; return its id or None."""
+    data = {"audio_url": upload_url, "speech_model": "universal"}
+    if webhook_url:
+        data["webhook_url"] = webhook_url
+        data["webhook_auth_header_name"] = ASSEMBLYAI_WEBHOOK_HEADER
+        data["webhook_auth_header_value"] = ASSEMBLYAI_WEBHOOK_SECRET
+    transcript_response = HTTP.post(
+        f"{ASSEMBLYAI_BASE_URL}/transcript",
+        json=data,
+        headers={"authorization": ASSEMBLYAI_API_KEY}
+    )
+    transcript_id = transcript_response.json().get("id")
+    if not transcript_id:
+        METRICS.inc("bot_errors_total", component="assemblyai_transcript")
+        logging.error(f"AssemblyAI transcript request failed ({transcript_response.status_code}): {transcript_response.text}")
+    return transcript_id
 
-        uploaded_url = upload_response.json().get("upload_url")
-        data = {"audio_url": uploaded_url, "speech_model": "universal"}
-        transcript_response = requests.post(
-            f"{ASSEMBLYAI_BASE_URL}/transcript",
-            json=data,
-            headers={"authorization": ASSEMBLYAI_API_KEY}
-        )
-        transcript_id = transcript_response.json().get("id")
-        polling_endpoint = f"{ASSEMBLYAI_BASE_URL}/transcript/{transcript_id}"
-
-        # Poll with a reasonable cap to avoid long loops
-        max_wait_seconds = 60
-        start_time = time.time()
-        while time.time() - start_time < max_wait_seconds:
-            result = requests.get(polling_endpoint, headers={"authorization": ASSEMBLYAI_API_KEY}).json()
-            if result.get("status") == "completed":
-                logging.info(f"AssemblyAI transcription complete: {result.get('text')}")
-                return result.get("text")
-            if result.get("status") == "error":
-                logging.error(f"AssemblyAI transcription error: {result.get('error')}")
-                return None
-            time.sleep(2)
-        logging.error("AssemblyAI transcription timed out")
+def fetch_transcript(transcript_id):
+    return HTTP.get(
+        f"{ASSEMBLYAI_BASE_URL}/transcript/{transcript_id}",
+        headers={"authorization": ASSEMBLYAI_API_KEY}
+    ).json()
+
+# One thread polls every pending transcript with adaptive intervals
+TRANSCRIPT_POLLER = TranscriptPoller(fetch_transcript, timeout=STT_TIMEOUT_SECONDS)
+
+def use_assemblyai_webhook():
+    return ASYNC_WEBHOOK and ASSEMBLYAI_WEBHOOK and bool(PUBLIC_BASE_URL) and bool(ASSEMBLYAI_WEBHOOK_SECRET)
+
+def transcribe_with_assemblyai(audio_url):
+    """Stream Twilio audio to AssemblyAI and wait for the transcription."""
+    with JOB_QUEUE.timed("stt_upload"):
+        uploaded_url, size = upload_to_assemblyai(audio_url)
+    if not uploaded_url:
+        return None
+    transcript_id = create_transcript(uploaded_url)
+    if not transcript_id:
         return None
+    with JOB_QUEUE.timed("stt_poll"):
+        result = TRANSCRIPT_POLLER.wait(transcript_id, audio_seconds=size / VOICE_NOTE_BYTES_PER_SECOND)
+    if not result:
+        return None
+    logging.info(f"AssemblyAI transcription complete: {result.get('text')}")
+    return result.get("text")
 
-    finally:
-        if os.path.exists(local_file):
-            os.remove(local_file)
+def start_transcription(from_number, audio_url, base_url):
+    """Non-blocking STT for queued jobs; the conversation resumes once the transcript is ready.
+
+    Completion arrives through /assemblyai-callback when the webhook is
+    configured, otherwise through the shared transcript poller. Webhook-mode
+    transcripts are still watched by the poller at a long interval, so a lost
+    callback ends in a reply (or VOICE_NOTE_ERROR) rather than silence.
+    """
+    started = time.time()
+    uploaded_url, size = upload_to_assemblyai(audio_url)
+    if not uploaded_url:
+        return False
+    webhook_url = None
+    if use_assemblyai_webhook():
+        webhook_url = build_public_url_from_base(PUBLIC_BASE_URL, "assemblyai-callback?" + urlencode({"from": from_number}))
+    transcript_id = create_transcript(uploaded_url, webhook_url)
+    if not transcript_id:
+        return False
+    created = time.time()
+    trace_id = current_trace()
+
+    def _on_done(result):
+        # Runs on the poller thread (or the callback's job): time AssemblyAI's queue +
+        # processing, keep the trace id
+        JOB_QUEUE.record("stt_poll", time.time() - created)
+        JOB_QUEUE.record("stt", time.time() - started)
+        with trace(trace_id):
+            resume_after_transcript(from_number, (result or {}).get("text"), base_url)
+
+    if webhook_url:
+        logging.info(f"Transcript {transcript_id} queued; waiting for AssemblyAI webhook")
+        TRANSCRIPT_POLLER.watch(transcript_id, _on_done, interval=ASSEMBLYAI_WEBHOOK_FALLBACK_SECONDS)
+        return True
+    TRANSCRIPT_POLLER.watch(transcript_id, _on_done, audio_seconds=size / VOICE_NOTE_BYTES_PER_SECOND)
+    return True
+
+def resume_after_transcript(from_number, text, base_url):
+    """Continue the user's mailbox with the transcribed voice note, ahead of anything sent meanwhile."""
+    if text:
+        logging.info(f"AssemblyAI transcription complete: {text}")
+    # A failed transcript (no text) still goes through the mailbox, so the error
+    # reply comes before the answers to anything the user sent meanwhile
+    MAILBOX.resume(from_number, (text or None, None, base_url, current_trace(), None))
+
+def finish_webhook_transcript(transcript_id, from_number, base_url):
+    """Complete a transcript from its AssemblyAI callback; any failure sends VOICE_NOTE_ERROR."""
+    try:
+        result = fetch_transcript(transcript_id)
+    except Exception as e:
+        logging.error(f"Fetching transcript {transcript_id} failed: {e}")
+        result = {"status": "error", "error": str(e)}
+    if result.get("status") != "completed":
+        logging.error(f"AssemblyAI transcription error: {result.get('error')}")
+        result = None
+    # Watched here (the usual case): the poller's callback resumes the conversation once.
+    # Started by another worker: resume directly.
+    if not TRANSCRIPT_POLLER.resolve(transcript_id, result):
+        resume_after_transcript(from_number, (result or {}).get("text"), base_url)
 
 # -----------------------------
 # AI Response Generation
 # -----------------------------
 def generate_with_openrouter(messages):
-    prompt_text = messages[-1]["content"] if messages else "Hello"
+    messages = messages or [{"role": "user", "content": "Hello"}]
+    try:
+        with METRICS.timed("bot_llm_seconds", provider="openrouter"):
+            completion = PROVIDERS.get("openrouter").chat.completions.create(
+                extra_headers={
+                    "HTTP-Referer": "http://localhost:5000",
+                    "X-Title": "WhatsApp GPT Bot"
+                },
+                model=OPENROUTER_MODEL,
+                messages=messages
+            )
+        return completion.choices[0].message.content
+    except Exception as e:
+        logging.error(f"OpenRouter GPT error: {e}")
+        METRICS.inc("bot_errors_total", component="openrouter")
+        return None
+
+def stream_openrouter(messages):
+    """Yield OpenRouter completion text deltas as they arrive.
+
+    A failure (before or during the stream) is logged and re-raised, so the
+    caller can tell a finished answer from a cut-off one.
+    """
+    messages = messages or [{"role": "user", "content": "Hello"}]
+    started = time.time()
     try:
-        completion = GPT_CLIENT.chat.completions.create(
+        stream = PROVIDERS.get("openrouter").chat.completions.create(
             extra_headers={
                 "HTTP-Referer": "http://localhost:5000",
                 "X-Title": "WhatsApp GPT Bot"
             },
-            model="openai/gpt-oss-20b:free",
-            messages=[{"role": "user", "content": prompt_text}]
+            model=OPENROUTER_MODEL,
+            messages=messages,
+            stream=True
         )
-        return completion.choices[0].message.content
+        first = True
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first:
+                    METRICS.observe("bot_llm_first_token_seconds", time.time() - started, provider="openrouter")
+                    first = False
+                yield chunk.choices[0].delta.content
     except Exception as e:
-        logging.error(f"OpenRouter GPT error: {e}")
-        return None
+        logging.error(f"OpenRouter GPT streaming error: {e}")
+        METRICS.inc("bot_errors_total", component="openrouter_stream")
+        raise
+
+def stream_reply_text(messages):
+    """Yield the reply as text deltas, falling back to a non-streaming answer.
+
+    A cached single-turn reply is yielded whole; on a miss the streamed text
+    is collected and cached for the next identical question, but only if the
+    stream finished normally.
+    """
+    cache_key = llm_cache_key(messages)
+    if cache_key:
+        cached, leader = LLM_CACHE.begin(cache_key)
+        if cached is not None:
+            logging.info("LLM cache hit (streaming)")
+            yield cached
+            return
+        if not leader:
+            cache_key = None
+    parts = []
+    complete = False
+    # Stream only when OpenRouter has a key, is the router's first choice and its breaker
+    # lets the call through; otherwise the hedged router answers straight away
+    streaming = PROVIDERS.configured("openrouter") and LLM_ROUTER.claim("openrouter")
+    recorded = not streaming
+    try:
+        if streaming:
+            started = time.time()
+            try:
+                for delta in stream_openrouter(messages):
+                    parts.append(delta)
+                    yield delta
+                complete = bool(parts)
+            except Exception:
+                LLM_ROUTER.record("openrouter", time.time() - started, False)
+                recorded = True
+                if parts:
+                    # Cut off mid-answer: earlier sentences may already be spoken, so say so
+                    # (the notice also lands in the history); the partial text is never cached
+                    logging.warning(f"OpenRouter stream cut off after {len(parts)} deltas")
+                    METRICS.inc("bot_fallbacks_total", kind="llm_stream_cut_off")
+                    yield LLM_CUT_OFF_NOTICE
+                    return
+            else:
+                LLM_ROUTER.record("openrouter", time.time() - started, complete)
+                recorded = True
+        if not parts:
+            if streaming:
+                METRICS.inc("bot_fallbacks_total", kind="llm_stream_to_router")
+            text = LLM_ROUTER.generate(messages, exclude=("openrouter",) if streaming else ())
+            if text:
+                parts.append(text)
+                complete = True
+            yield text or LLM_FALLBACK_REPLY
+    finally:
+        if not recorded:
+            # Consumer stopped early (GeneratorExit): give back a half-open trial
+            LLM_ROUTER.release("openrouter")
+        # Waiters on an incomplete reply compute for themselves
+        if cache_key:
+            LLM_CACHE.complete(cache_key, "".join(parts) if complete else None)
+
+def to_gemini_contents(messages):
+    """Split chat messages into a Gemini system instruction and contents."""
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+    contents = [
+        {"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+        for m in messages if m["role"] != "system"
+    ]
+    # Gemini expects the conversation to open with a user turn
+    while contents and contents[0]["role"] == "model":
+        contents.pop(0)
+    return system, contents or [{"role": "user", "parts": [{"text": "Hello"}]}]
 
 def generate_with_gemini(messages):
-    prompt_text = messages[-1]["content"] if messages else "Hello"
+    system, contents = to_gemini_contents(messages or [])
     try:
-        response = GEMINI_CLIENT.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt_text
-        )
+        with METRICS.timed("bot_llm_seconds", provider="gemini"):
+            response = PROVIDERS.get("gemini").models.generate_content(
+                model=GEMINI_MODEL,
+                contents=contents,
+                config={"system_instruction": system} if system else None
+            )
         return response.text
     except Exception as e:
         logging.error(f"Gemini API error: {e}")
-        return "Sorry, Gemini service is unavailable."
+        METRICS.inc("bot_errors_total", component="gemini")
+        return None
+
+# Only providers with an API key are routed to (and ever imported)
+LLM_PROVIDERS = [
+    (name, fn) for name, fn in (("openrouter", generate_with_openrouter), ("gemini", generate_with_gemini))
+    if PROVIDERS.configured(name)
+]
+if not LLM_PROVIDERS:
+    logging.warning("Neither OPENROUTER_API_KEY nor GEMINI_API_KEY is set; LLM replies will fall back to an apology")
+
+LLM_ROUTER = ProviderRouter(
+    LLM_PROVIDERS,
+    hedge_percentile=LLM_HEDGE_PERCENTILE,
+    hedge_min_delay=LLM_HEDGE_MIN_SECONDS,
+    hedge_max_delay=LLM_HEDGE_MAX_SECONDS,
+    default_delay=LLM_HEDGE_DEFAULT_SECONDS,
+    timeout=LLM_TIMEOUT_SECONDS,
+    failure_threshold=LLM_BREAKER_FAILURES,
+    cooldown=LLM_BREAKER_COOLDOWN,
+    max_workers=LLM_ROUTER_WORKERS,
+    observer=stage_observer("llm_router"),
+)
+
+def llm_cache_key(messages):
+    """Cache key for a single-turn prompt (persona, optional greeting, one user message), else None."""
+    if LLM_CACHE is None:
+        return None
+    question = None
+    for m in messages:
+        if m["role"] == "user":
+            if question is not None:
+                return None
+            question = m["content"]
+        elif m["content"] != (BOT_PERSONA if m["role"] == "system" else GREETING_REPLY):
+            # Real history (or a summary of it): the answer depends on more than the question
+            return None
+    if not question:
+        return None
+    return ResponseCache.make_key(question, f"{OPENROUTER_MODEL}|{GEMINI_MODEL}", BOT_PERSONA)
+
+def generate_reply(messages, exclude=()):
+    """Route the prompt through the hedged provider router; always returns text.
+
+    Single-turn prompts go through the LLM response cache when it is enabled.
+    """
+    cache_key = llm_cache_key(messages)
+    if cache_key:
+        text = LLM_CACHE.get_or_compute(cache_key, lambda: LLM_ROUTER.generate(messages, exclude=exclude))
+    else:
+        text = LLM_ROUTER.generate(messages, exclude=exclude)
+    if not text:
+        METRICS.inc("bot_fallbacks_total", kind="llm_apology")
+    return text or LLM_FALLBACK_REPLY
 
 # -----------------------------
 # Murf.ai TTS
 # -----------------------------
+def tts_cache_key(text, engine):
+    if not TTS_CACHE_ENABLED:
+        return None
+    if engine == "murf":
+        return AudioCache.make_key(text, "murf", MURF_VOICE_ID, MURF_STYLE, MURF_SAMPLE_RATE)
+    return AudioCache.make_key(text, "gtts", GTTS_LANG)
+
+def cache_tts_output(cache_key, path):
+    """Store a synthesized file under its cache key; return the path to deliver."""
+    if cache_key:
+        path = TTS_CACHE.put(cache_key, path)
+    AUDIO_STORE.register(path)
+    return path
+
 def text_to_speech_murf(text, filename, prefer_url=False):
-    """Generate TTS using Murf SDK; save/copy to requested filename and return its path."""
+    """Generate TTS using Murf SDK; save/copy to requested filename and return its path.
+
+    Identical utterances are served from the TTS cache without synthesis.
+    """
     try:
+        gtts_key = tts_cache_key(text, "gtts")
         if USE_SIMPLE_TTS:
+            cached = gtts_key and TTS_CACHE.get(gtts_key)
+            if cached:
+                logging.info(f"TTS cache hit (gTTS) -> {cached}")
+                return cached
             # Simple, fast TTS using gTTS, saved locally
             safe_name = sanitize_filename(filename)
             target_path = os.path.join(AUDIO_OUTPUT_DIR, safe_name)
             t0 = time.time()
-            gTTS(text=text, lang="en").save(target_path)
+            with PROVIDER_LIMITS.slot("gtts"):
+                PROVIDERS.get("gtts")(text=text, lang=GTTS_LANG).save(target_path)
+            JOB_QUEUE.record("tts_gtts", time.time() - t0)
             logging.info(f"gTTS synthesis took {time.time() - t0:.2f}s -> {target_path}")
-            return target_path
+            return cache_tts_output(gtts_key, target_path)
+
+        murf_key = tts_cache_key(text, "murf")
+        cached = murf_key and TTS_CACHE.get(murf_key)
+        if cached:
+            logging.info(f"TTS cache hit (Murf) -> {cached}")
+            return cached
 
-        # Cap text to roughly ~20s of speech for faster generation/delivery
-        max_chars = 500
-        tts_text = text if len(text) <= max_chars else text[:max_chars]
-        if len(text) > max_chars:
-            logging.warning(f"Murf TTS text exceeded {max_chars} chars; truncating.")
+        # Keep each Murf request to roughly ~20s of speech; longer replies are
+        # synthesized chunk by chunk and stitched instead of being truncated.
+        if len(text) > MURF_MAX_CHARS:
+            return text_to_speech_murf_long(text, filename, murf_key)
+        tts_text = text
 
         # Build output path in audio directory with a safe filename
         safe_name = sanitize_filename(filename)
@@ -316,14 +787,16 @@ def text_to_speech_murf(text, filename, prefer_url=False):
 
         # Use Murf SDK to generate speech
         t0 = time.time()
-        sdk_response = MURF_SDK_CLIENT.text_to_speech.generate(
-            text=tts_text,
-            voice_id="ta-IN-iniya",
-            style="Narration",
-            multi_native_locale="en-IN",
-            format="MP3",
-            sample_rate=24000.0
-        )
+        with PROVIDER_LIMITS.slot("murf"):
+            sdk_response = PROVIDERS.get("murf").text_to_speech.generate(
+                text=tts_text,
+                voice_id=MURF_VOICE_ID,
+                style=MURF_STYLE,
+                multi_native_locale="en-IN",
+                format="MP3",
+                sample_rate=MURF_SAMPLE_RATE
+            )
+        JOB_QUEUE.record("tts_murf", time.time() - t0)
         logging.info(f"Murf TTS generation took {time.time() - t0:.2f}s")
 
         generated_file = getattr(sdk_response, "audio_file", None)
@@ -339,30 +812,20 @@ def text_to_speech_murf(text, filename, prefer_url=False):
         # Download the returned URL to the requested filename if it's a URL
         if target_path and isinstance(generated_file, str):
             if generated_file.startswith("http://") or generated_file.startswith("https://"):
-                def _download_with_retries(url, retries=3, timeout=15):
-                    last_err = None
-                    for attempt in range(1, retries + 1):
-                        try:
-                            tdl = time.time()
-                            r = requests.get(url, stream=True, timeout=timeout)
-                            if r.status_code == 200:
-                                with open(target_path, "wb") as out:
-                                    for chunk in r.iter_content(chunk_size=8192):
-                                        if chunk:
-                                            out.write(chunk)
-                                logging.info(f"Downloaded Murf audio in {time.time() - tdl:.2f}s -> {target_path}")
-                                return True
-                            last_err = f"status={r.status_code}"
-                            logging.warning(f"Attempt {attempt} to download Murf audio failed: {last_err}")
-                        except Exception as e:
-                            last_err = str(e)
-                            logging.warning(f"Attempt {attempt} to download Murf audio errored: {last_err}")
-                            time.sleep(min(2 * attempt, 5))
-                    logging.error(f"All attempts to download Murf audio failed: {last_err}")
-                    return False
-
-                if _download_with_retries(generated_file):
-                    return target_path
+                try:
+                    tdl = time.time()
+                    # Retries with jittered backoff are handled by the shared HTTP layer
+                    with HTTP.get(generated_file, stream=True) as r:
+                        if r.status_code == 200:
+                            with open(target_path, "wb") as out:
+                                for chunk in r.iter_content(chunk_size=65536):
+                                    if chunk:
+                                        out.write(chunk)
+                            logging.info(f"Downloaded Murf audio in {time.time() - tdl:.2f}s -> {target_path}")
+                            return cache_tts_output(murf_key, target_path)
+                        logging.error(f"Failed to download Murf audio: status={r.status_code}")
+                except Exception as e:
+                    logging.error(f"Failed to download Murf audio: {e}")
                 # fall through to gTTS fallback below
             else:
                 # If SDK returns a local file path, copy to requested filename
@@ -370,64 +833,153 @@ def text_to_speech_murf(text, filename, prefer_url=False):
                     with open(generated_file, "rb") as src, open(target_path, "wb") as dst:
                         dst.write(src.read())
                     logging.info(f"Murf TTS generated: {target_path}")
-                    return target_path
+                    return cache_tts_output(murf_key, target_path)
                 except Exception as copy_err:
                     logging.error(f"Failed to copy Murf audio to target filename: {copy_err}")
                     # fall through to gTTS fallback below
 
         # If we reached here without returning, try a fast local gTTS fallback
+        METRICS.inc("bot_fallbacks_total", kind="murf_to_gtts")
         try:
             t_fallback = time.time()
-            gTTS(text=text, lang="en").save(target_path)
+            with PROVIDER_LIMITS.slot("gtts"):
+                PROVIDERS.get("gtts")(text=text, lang=GTTS_LANG).save(target_path)
+            JOB_QUEUE.record("tts_gtts", time.time() - t_fallback)
             logging.info(f"Fallback gTTS synthesis took {time.time() - t_fallback:.2f}s -> {target_path}")
-            return target_path
+            return cache_tts_output(gtts_key, target_path)
         except Exception as gtts_err:
             logging.error(f"gTTS fallback failed: {gtts_err}")
+            METRICS.inc("bot_errors_total", component="gtts")
             return None
     except Exception as e:
         logging.error(f"Murf TTS failed: {e}")
+        METRICS.inc("bot_errors_total", component="tts")
+        return None
+
+def text_to_speech_murf_long(text, filename, cache_key=None):
+    """Synthesize text over MURF_MAX_CHARS in sentence-aligned chunks and stitch the mp3s."""
+    base = os.path.splitext(sanitize_filename(filename))[0]
+    chunks = split_text(text, MURF_MAX_CHARS)
+    logging.info(f"Murf TTS text is {len(text)} chars; synthesizing {len(chunks)} chunks")
+    parts = []
+    synthesize_in_order(
+        enumerate(chunks),
+        lambda item: text_to_speech_murf(item[1], f"{base}_part{item[0]}.mp3"),
+        parts.append,
+        max_parallel=STREAM_TTS_PARALLEL,
+    )
+    if not parts:
         return None
+    if len(parts) < len(chunks):
+        logging.warning(f"Only {len(parts)}/{len(chunks)} Murf chunks synthesized; sending partial audio")
+    target_path = os.path.join(AUDIO_OUTPUT_DIR, sanitize_filename(filename))
+    concat_mp3(parts, target_path)
+    for part in parts:
+        if not TTS_CACHE.owns(part):
+            AUDIO_STORE.discard(part)
+    return cache_tts_output(cache_key if len(parts) == len(chunks) else None, target_path)
 
 # -----------------------------
 # Flask Routes
 # -----------------------------
+@app.before_request
+def start_request_trace():
+    g.started = time.perf_counter()
+    trace_id = request.values.get("MessageSid") or (request.get_json(silent=True) or {}).get("transcript_id")
+    g.trace_token = set_trace(trace_id) if trace_id else None
+
+@app.after_request
+def record_request_latency(response):
+    if request.endpoint not in ("metrics", "serve_audio", None):
+        METRICS.observe("bot_http_request_seconds", time.perf_counter() - g.started,
+                        endpoint=request.endpoint, status=response.status_code)
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    if g.get("trace_token") is not None:
+        reset_trace(g.trace_token)
+
 @app.route("/")
 def index():
     return "WhatsApp AI bot with AssemblyAI STT & Murf.ai TTS is running!"
 
-@app.route("/webhook", methods=["POST"])
-def webhook():
-    incoming_msg = request.values.get("Body", "").strip()
-    from_number = request.values.get("From", "unknown")
-    media_url = request.values.get("MediaUrl0")
-    
-    resp = MessagingResponse()
+def reply_with_audio(from_number: str, speech_text: str, base_url: str):
+    """Synthesize the reply and deliver it as a WhatsApp media message."""
+    audio_basename = unique_audio_basename(from_number, "response")
+    with JOB_QUEUE.timed("tts"):
+        audio_path = text_to_speech_murf(speech_text, audio_basename)
+    if audio_path:
+        with JOB_QUEUE.timed("delivery"):
+            _send_media_background(from_number, audio_path, precomputed_base_url=base_url)
 
-    # Greeting
-    nmsg = normalize(incoming_msg)
-    if nmsg in ("hi", "hello", "hey", "start", "menu", "good morning", "i need help"):
+def stream_reply_with_audio(from_number: str, messages, base_url: str):
+    """Stream the LLM reply and deliver its audio sentence by sentence, in order."""
+    chunks = []
+    started = time.time()
+    first_clip = []
+
+    def _reply_text():
+        for delta in stream_reply_text(messages):
+            chunks.append(delta)
+            yield delta
+
+    def _segments():
+        # Hold each sentence until the next one arrives, so the thank-you suffix is
+        # spoken as part of the final clip instead of as a clip of its own
+        last = None
+        for sentence in iter_sentences(_reply_text(), max_chars=MURF_MAX_CHARS):
+            if last is not None:
+                yield last
+            last = sentence
+        assistant_text = "".join(chunks).strip()
+        if THANK_YOU_SUFFIX not in assistant_text:
+            assistant_text = assistant_text + THANK_YOU_SUFFIX
+            last = last + THANK_YOU_SUFFIX if last is not None else THANK_YOU_SUFFIX.strip()
+        if last is not None:
+            yield last
+        STORE.append(from_number, {"role": "assistant", "content": assistant_text + CONTINUE_PROMPT})
+
+    def _synthesize(sentence):
+        with JOB_QUEUE.timed("tts"):
+            return text_to_speech_murf(sentence, unique_audio_basename(from_number, "response"))
+
+    def _deliver(audio_path):
+        if not first_clip:
+            first_clip.append(audio_path)
+            JOB_QUEUE.record("time_to_first_audio", time.time() - started)
+        with JOB_QUEUE.timed("delivery"):
+            _send_media_background(from_number, audio_path, precomputed_base_url=base_url)
+
+    synthesize_in_order(_segments(), _synthesize, _deliver, max_parallel=STREAM_TTS_PARALLEL)
+
+def instant_reply(from_number: str, incoming_msg: str):
+    """Reply text for messages answered without the pipeline (greeting, canned), else None."""
+    intent, canned_reply = INTENTS.classify(incoming_msg)
+    if intent == GREETING:
         # Simple flow: greet and immediately start
-        greeting = "Hey there! 👋 How are you doing today?"
-        conversations[from_number].append({"role": "assistant", "content": greeting})
-        resp.message(greeting)
+        STORE.append(from_number, {"role": "assistant", "content": GREETING_REPLY})
         clear_state(from_number)
-        return Response(str(resp), mimetype="application/xml")
+        return GREETING_REPLY
+    # Canned replies are answered inline: no LLM, no TTS, no queued job
+    return canned_reply
 
-    # Voice note handling
-    if media_url:
-        incoming_msg = transcribe_with_assemblyai(media_url)
-        if not incoming_msg:
-            resp.message("Sorry, I couldn’t transcribe your voice note. Please try again.")
-            return Response(str(resp), mimetype="application/xml")
+def start_turn(from_number: str, incoming_msg: str):
+    """Apply intents and the state machine to one (text or transcribed) message.
 
+    Returns ``(replies, messages)``: either fixed text replies that end the
+    turn (``messages`` is None), or the LLM prompt, with the user message
+    already recorded in the history.
+    """
     # Farewell handling: end chat with a final text greeting, clear state/history
-    nmsg = normalize(incoming_msg)
-    if any(word in nmsg for word in FAREWELL_WORDS):
-        goodbye_text = "Thanks for chatting! Goodbye 👋"
-        conversations[from_number].clear()
+    intent, canned_reply = INTENTS.classify(incoming_msg)
+    if intent == FAREWELL:
+        STORE.clear_history(from_number)
         clear_state(from_number)
-        resp.message(goodbye_text)
-        return Response(str(resp), mimetype="application/xml")
+        return ["Thanks for chatting! Goodbye 👋"], None
+    if canned_reply:
+        # e.g. a transcribed voice note asking a canned question
+        return [canned_reply], None
 
     # State machine
     state = get_state(from_number)
@@ -436,46 +988,262 @@ def webhook():
         clear_state(from_number)
 
     if state == "continue":
-        if nmsg in CONTINUE_NO:
-            resp.message("Thanks for chatting! Have a great day 👋")
-            conversations[from_number].clear()
+        if intent == NO:
+            STORE.clear_history(from_number)
             clear_state(from_number)
-            return Response(str(resp), mimetype="application/xml")
-        elif nmsg in CONTINUE_YES:
+            return ["Thanks for chatting! Have a great day 👋"], None
+        elif intent == YES:
             clear_state(from_number)
         # otherwise, proceed as free text
 
-    conversations[from_number].append({"role": "user", "content": incoming_msg})
-    messages = [{"role": "system", "content": BOT_PERSONA}] + list(conversations[from_number])
+    STORE.append(from_number, {"role": "user", "content": incoming_msg})
+    return [], build_prompt(BOT_PERSONA, STORE.history(from_number), PROMPT_TOKEN_BUDGET)
 
-    assistant_text = (generate_with_openrouter(messages) or generate_with_gemini(messages)) or "Sorry, I'm having trouble answering right now."
-    continue_prompt = "\n\nWould you like to continue? (yes/no)"
+def finish_turn(from_number: str, assistant_text: str):
+    """Record the LLM reply; return ``(speech_text, text_with_continue_prompt)``."""
     if THANK_YOU_SUFFIX not in assistant_text:
         assistant_text = assistant_text + THANK_YOU_SUFFIX
     # Keep a speech-only version without the continue prompt
     speech_text = assistant_text
     # Append continue prompt to the message we send as text
-    assistant_text = assistant_text + continue_prompt
-    conversations[from_number].append({"role": "assistant", "content": assistant_text})
+    assistant_text = assistant_text + CONTINUE_PROMPT
+    STORE.append(from_number, {"role": "assistant", "content": assistant_text})
+    set_state(from_number, "continue")
+    return speech_text, assistant_text
+
+def handle_message(from_number: str, incoming_msg: str, media_url: str, base_url: str, in_job: bool = False):
+    """Run the conversation flow for one inbound message.
+
+    Returns the text replies to send back; the audio reply is delivered
+    separately (inline when running as a queued job, otherwise in the background).
+    """
+    # Voice note handling
+    if media_url:
+        if in_job:
+            # Don't hold a worker while AssemblyAI processes the clip; the user's
+            # later messages wait in their mailbox until the transcript resumes it
+            MAILBOX.hold(from_number, STT_TIMEOUT_SECONDS + 30)
+            try:
+                with JOB_QUEUE.timed("stt_upload"):
+                    started = start_transcription(from_number, media_url, base_url)
+            except Exception as e:
+                logging.error(f"Starting transcription failed: {e}")
+                started = False
+            if started:
+                return []
+            MAILBOX.resume(from_number)
+            return [VOICE_NOTE_ERROR]
+        with JOB_QUEUE.timed("stt"):
+            incoming_msg = transcribe_with_assemblyai(media_url)
+        if not incoming_msg:
+            return [VOICE_NOTE_ERROR]
+
+    replies, messages = start_turn(from_number, incoming_msg)
+    if messages is None:
+        return replies
+
+    if STREAM_TTS:
+        # Stream the reply and send audio per sentence; off the request thread when possible
+        if in_job or not DELIVER_MEDIA_ASYNC:
+            set_state(from_number, "continue")
+            stream_reply_with_audio(from_number, messages, base_url)
+            return []
+        if MEDIA_POOL.submit(stream_reply_with_audio, from_number, messages, base_url):
+            set_state(from_number, "continue")
+            return []
+        # Media pool saturated: fall through to a text-only reply
+        METRICS.inc("bot_fallbacks_total", kind="media_pool_to_text")
+
+    with JOB_QUEUE.timed("llm"):
+        assistant_text = generate_reply(messages)
+    speech_text, assistant_text = finish_turn(from_number, assistant_text)
 
-    audio_basename = unique_audio_basename(from_number, "response")
     # Always synthesize TTS for the main reply (exclude continue prompt)
-    def _task(pre_base):
-        audio_path = text_to_speech_murf(speech_text, audio_basename)
-        if audio_path:
-            _send_media_background(from_number, audio_path, precomputed_base_url=pre_base)
-    if DELIVER_MEDIA_ASYNC:
-        Thread(target=_task, args=(request.host_url,), daemon=True).start()
-    else:
-        _task(request.host_url)
-    set_state(from_number, "continue")
+    if in_job or not DELIVER_MEDIA_ASYNC:
+        reply_with_audio(from_number, speech_text, base_url)
+    elif not MEDIA_POOL.submit(reply_with_audio, from_number, speech_text, base_url):
+        # Media pool saturated: degrade to a text-only reply
+        METRICS.inc("bot_fallbacks_total", kind="media_pool_to_text")
+        return [assistant_text]
+
+    # No text reply; audio will arrive separately
+    return []
+
+def process_message_job(from_number: str, incoming_msg: str, media_url: str, base_url: str):
+    """Queued pipeline job: everything after the webhook acknowledgment."""
+    replies = handle_message(from_number, incoming_msg, media_url, base_url, in_job=True)
+    for reply in replies:
+        with JOB_QUEUE.timed("delivery"):
+            send_whatsapp_text(from_number, reply)
+
+def process_mailbox_batch(from_number: str, batch: list):
+    """Mailbox handler: one message, or several quick texts coalesced into one turn.
 
-    # Return empty TwiML so Twilio doesn't send a text; audio will arrive separately
+    Messages are ``(text, media_url, base_url, trace_id, received_at)``; a
+    ``None`` text is a voice note whose transcription failed.
+    """
+    incoming_msg, media_url, base_url, trace_id, received_at = batch[0]
+    if len(batch) > 1:
+        logging.info(f"Coalesced {len(batch)} messages from {from_number} into one turn")
+        incoming_msg = "\n".join(m[0] for m in batch)
+        base_url = batch[-1][2]
+    with trace(trace_id):
+        reply = None
+        if incoming_msg is None:
+            reply = VOICE_NOTE_ERROR
+        elif len(batch) == 1 and not media_url and received_at:
+            # Straight from the webhook, which defers greetings and canned replies
+            # while earlier messages from this user are still in their mailbox
+            reply = instant_reply(from_number, incoming_msg)
+        if reply:
+            with JOB_QUEUE.timed("delivery"):
+                send_whatsapp_text(from_number, reply)
+        else:
+            process_message_job(from_number, incoming_msg, media_url, base_url)
+    if received_at:
+        # Webhook receipt -> last reply handed to Twilio
+        JOB_QUEUE.record("reply_e2e", time.time() - received_at)
+
+# One mailbox per user: different users run in parallel on the job queue, one
+# user's messages strictly in order (optionally coalesced within a short window)
+MAILBOX = Mailbox(
+    JOB_QUEUE,
+    process_mailbox_batch,
+    coalesce_window=float(os.getenv("COALESCE_SECONDS", "0")),
+    max_pending=int(os.getenv("MAILBOX_MAX_PENDING", "20")),
+)
+
+@app.route("/webhook", methods=["POST"])
+def webhook():
+    incoming_msg = request.values.get("Body", "").strip()
+    from_number = request.values.get("From", "unknown")
+    media_url = request.values.get("MediaUrl0")
+    message_sid = request.values.get("MessageSid")
+
+    resp = MessagingResponse()
+
+    # Twilio retry of a message we already have: acknowledge without redoing the work
+    if message_sid and not DEDUPE.add(message_sid):
+        logging.info(f"Duplicate webhook for {message_sid}; ignoring")
+        return Response(str(resp), mimetype="application/xml")
+
+    # Greeting and canned replies; queued behind the user's pending messages, if any
+    if not (ASYNC_WEBHOOK and MAILBOX.busy(from_number)):
+        reply = instant_reply(from_number, incoming_msg)
+        if reply:
+            resp.message(reply)
+            return Response(str(resp), mimetype="application/xml")
+
+    if ASYNC_WEBHOOK:
+        # Acknowledge immediately; replies go out through the Twilio REST API
+        message = (incoming_msg, media_url, request.host_url, message_sid, time.time())
+        # A deferred greeting or canned reply is answered on its own, not merged into a turn
+        intent, canned_reply = INTENTS.classify(incoming_msg)
+        coalescible = not media_url and intent != GREETING and not canned_reply
+        if not MAILBOX.post(from_number, message, coalescible=coalescible):
+            resp.message("Sorry, I'm a bit busy right now. Please try again in a moment.")
+            if message_sid:
+                # Not taken: let a Twilio retry of this message through
+                DEDUPE.discard(message_sid)
+        return Response(str(resp), mimetype="application/xml")
+
+    try:
+        replies = handle_message(from_number, incoming_msg, media_url, request.host_url)
+    except Exception:
+        if message_sid:
+            # The 500 makes Twilio retry; that retry must not be dropped as a duplicate
+            DEDUPE.discard(message_sid)
+        raise
+    for reply in replies:
+        resp.message(reply)
+
+    # Empty TwiML for the main reply so Twilio doesn't send a text; audio will arrive separately
     return Response(str(resp), mimetype="application/xml")
 
+@app.route("/assemblyai-callback", methods=["POST"])
+def assemblyai_callback():
+    """AssemblyAI webhook: resume the pending voice-note conversation."""
+    supplied = request.headers.get(ASSEMBLYAI_WEBHOOK_HEADER, "")
+    if not ASSEMBLYAI_WEBHOOK_SECRET or not hmac.compare_digest(supplied, ASSEMBLYAI_WEBHOOK_SECRET):
+        return Response(status=403)
+    payload = request.get_json(silent=True) or {}
+    transcript_id = payload.get("transcript_id")
+    from_number = request.args.get("from")
+    if not transcript_id or not from_number:
+        return Response(status=400)
+    if not DEDUPE.add(f"transcript:{transcript_id}"):
+        return Response(status=204)
+    # Fetch the transcript text off the request thread
+    if not JOB_QUEUE.submit(finish_webhook_transcript, transcript_id, from_number, request.host_url):
+        # Ask AssemblyAI to retry later
+        DEDUPE.discard(f"transcript:{transcript_id}")
+        return Response(status=503)
+    return Response(status=204)
+
+@app.route("/jobs")
+def job_stats():
+    return jsonify({
+        "webhook": JOB_QUEUE.stats(),
+        "media": MEDIA_POOL.stats(),
+        "mailbox": MAILBOX.stats(),
+        "dedupe": DEDUPE.stats(),
+        "providers": PROVIDER_LIMITS.stats(),
+        "tts_cache": TTS_CACHE.stats(),
+        "audio_store": AUDIO_STORE.stats(),
+        "llm_router": LLM_ROUTER.snapshot(),
+        "llm_cache": LLM_CACHE.stats() if LLM_CACHE else None,
+        "store": STORE.stats(),
+        "http": HTTP.stats(),
+        "transcripts": TRANSCRIPT_POLLER.stats(),
+        "fakes": FAKES.stats() if FAKES else None,
+        "clients": PROVIDERS.stats(),
+    })
+
+def _register_metric_callbacks():
+    """Expose numbers the components already track, read at scrape time."""
+    queues = (JOB_QUEUE, MEDIA_POOL)
+    METRICS.callback("bot_queue_depth", "Jobs waiting per queue",
+                     lambda: [({"queue": q.name}, q.depth()) for q in queues])
+    METRICS.callback("bot_jobs_rejected_total", "Jobs shed because a queue was full",
+                     lambda: [({"queue": q.name}, q.rejected) for q in queues], kind="counter")
+    METRICS.callback("bot_jobs_failed_total", "Jobs that raised",
+                     lambda: [({"queue": q.name}, q.failed) for q in queues], kind="counter")
+    METRICS.callback("bot_mailbox_pending", "Messages waiting in user mailboxes",
+                     lambda: MAILBOX.stats()["pending"])
+    METRICS.callback("bot_duplicates_total", "Duplicate webhooks/callbacks dropped",
+                     lambda: DEDUPE.stats()["duplicates"], kind="counter")
+    METRICS.callback("bot_llm_hedges_total", "Hedged LLM requests",
+                     lambda: LLM_ROUTER.snapshot()["hedges"], kind="counter")
+    METRICS.callback("bot_llm_circuit_open", "1 while a provider's circuit breaker is open",
+                     lambda: [({"provider": name}, int(p["circuit"] == "open"))
+                              for name, p in LLM_ROUTER.snapshot()["providers"].items()])
+    METRICS.callback("bot_tts_cache_hits_total", "TTS cache hits",
+                     lambda: TTS_CACHE.stats()["hits"], kind="counter")
+    METRICS.callback("bot_audio_bytes", "Bytes of generated audio on disk",
+                     lambda: AUDIO_STORE.stats()["bytes"])
+    METRICS.callback("bot_transcripts_pending", "Voice notes waiting for AssemblyAI",
+                     lambda: TRANSCRIPT_POLLER.stats()["pending"])
+
+_register_metric_callbacks()
+
+# Optionally load the SDK clients (and open their connections) in the background
+# at boot, so the first message doesn't pay for it; startup is not delayed
+PROVIDER_PREWARM = os.getenv("PROVIDER_PREWARM", "false").lower() in ("1", "true", "yes")
+if PROVIDER_PREWARM:
+    PROVIDERS.prewarm([name for name in ("openrouter", "gemini", "twilio", "gtts", "murf")
+                       if not (name == "murf" and USE_SIMPLE_TTS)])
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/audio/<filename>")
 def serve_audio(filename):
     safe_name = sanitize_filename(filename)
+    # Unknown or already-evicted files are rejected from the in-memory index
+    if not AUDIO_STORE.has(safe_name):
+        return Response(status=404)
     # Set mimetype based on extension so WhatsApp/Twilio can fetch/play
     ext = os.path.splitext(safe_name)[1].lower()
     mimetype = "audio/mpeg"
@@ -483,11 +1251,35 @@ def serve_audio(filename):
         mimetype = "audio/wav"
     elif ext in (".ogg", ".oga"):
         mimetype = "audio/ogg"
-    return send_from_directory(AUDIO_OUTPUT_DIR, safe_name, mimetype=mimetype)
+    etag, data = AUDIO_STORE.clip(safe_name)
+    if etag is None:
+        return Response(status=404)
+    if data is not None:
+        # Hot clip: answered from memory, Range and If-None-Match included
+        response = send_file(io.BytesIO(data), mimetype=mimetype, download_name=safe_name,
+                             etag=etag, conditional=True, max_age=AUDIO_CACHE_MAX_AGE)
+    else:
+        # Cold clip: a path-based send uses the server's wsgi.file_wrapper
+        # (sendfile under gunicorn) or X-Sendfile instead of copying through Python
+        response = send_from_directory(os.path.abspath(AUDIO_OUTPUT_DIR), safe_name, mimetype=mimetype,
+                                       etag=etag, max_age=AUDIO_CACHE_MAX_AGE)
+    response.cache_control.immutable = True
+    response.accept_ranges = "bytes"
+    if response.status_code in (200, 206):
+        AUDIO_STORE.mark_served(safe_name, response.content_length or 0)
+    return response
+
+@atexit.register
+def drain_queues():
+    """Let queued replies and in-flight audio finish before the process exits."""
+    deadline = time.time() + SHUTDOWN_DRAIN_SECONDS
+    JOB_QUEUE.drain(max(0.0, deadline - time.time()))
+    MEDIA_POOL.drain(max(0.0, deadline - time.time()))
 
 # -----------------------------
 # Run Server
 # -----------------------------
 if __name__ == "__main__":
     logging.info("Flask server running on port 5000 with AssemblyAI STT & Murf.ai TTS support...")
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # The debugger/reloader is for local development only: FLASK_DEBUG=true
+    app.run(host="0.0.0.0", port=5000, debug=os.getenv("FLASK_DEBUG", "false").lower() in ("1", "true", "yes"))
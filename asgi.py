@@ -0,0 +1,599 @@
+"""ASGI entry point: the webhook and audio routes on one event loop.
+
+    pip install uvicorn httpx
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+A conversation waiting on Twilio, AssemblyAI or an LLM is a suspended
+coroutine rather than a blocked thread, so thousands can be in flight on a
+few cores. OpenRouter, Gemini, AssemblyAI and the Twilio REST API are
+called through async clients sharing one ``httpx.AsyncClient``; the SDKs
+without an async API (Murf, gTTS) run in a bounded thread pool.
+
+Conversation state, intents, caches, the provider router and metrics are
+the ones ``app`` builds, so both entry points behave the same. The Flask
+entry point (``python app.py``) keeps working for simple deployments.
+"""
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote
+
+import httpx
+from twilio.twiml.messaging_response import MessagingResponse
+
+import app as bot
+from metrics import trace
+
+ASGI_BLOCKING_THREADS = int(os.getenv("ASGI_BLOCKING_THREADS", "16"))
+ASGI_MAX_INFLIGHT = int(os.getenv("ASGI_MAX_INFLIGHT", "5000"))
+ASGI_HTTP_CONNECTIONS = int(os.getenv("ASGI_HTTP_CONNECTIONS", "200"))
+MAX_BODY_BYTES = 64 * 1024
+AUDIO_READ_CHUNK = 256 * 1024
+BUSY_REPLY = "Sorry, I'm a bit busy right now. Please try again in a moment."
+TWILIO_API_BASE = "https://api.twilio.com/2010-04-01"
+
+record = bot.stage_observer("asgi")
+
+
+class AsyncBot:
+    """Async conversation pipeline; one instance per process."""
+
+    def __init__(self, blocking_threads: int = ASGI_BLOCKING_THREADS, max_inflight: int = ASGI_MAX_INFLIGHT):
+        self.blocking = ThreadPoolExecutor(max_workers=blocking_threads, thread_name_prefix="asgi-blocking")
+        self.max_inflight = max_inflight
+        self.http = None
+        self.openai = None
+        self.gemini = None
+        self.tasks = set()
+        self.rejected = 0
+        # user -> [lock, holders]; a user's turns run in arrival order (asyncio.Lock is FIFO)
+        self._user_locks = {}
+        # LLM cache key -> future of the one upstream call answering it
+        self._llm_flights = {}
+
+    async def startup(self):
+        if self.http is not None:
+            return
+        connect, read = bot.HTTP.timeout
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=ASGI_HTTP_CONNECTIONS,
+                                max_keepalive_connections=ASGI_HTTP_CONNECTIONS // 4),
+        )
+        if bot.FAKES is None and bot.PROVIDERS.configured("openrouter"):
+            from openai import AsyncOpenAI
+            self.openai = AsyncOpenAI(
+                base_url="https://openrouter.ai/api/v1",
+                api_key=os.getenv("OPENROUTER_API_KEY", ""),
+                http_client=self.http,
+                timeout=bot.LLM_TIMEOUT_SECONDS,
+                max_retries=0,
+            )
+        if bot.FAKES is None and bot.PROVIDERS.configured("gemini"):
+            # Importing google.genai and building the client takes about a second; not on the loop
+            self.gemini = await self.run_blocking(bot.PROVIDERS.get, "gemini")
+        logging.info(f"ASGI bot ready: {ASGI_BLOCKING_THREADS} blocking threads, "
+                     f"up to {self.max_inflight} conversations in flight")
+
+    async def shutdown(self):
+        """Let in-flight conversations finish (up to SHUTDOWN_DRAIN_SECONDS), then close the clients."""
+        if self.tasks:
+            logging.info(f"Draining {len(self.tasks)} in-flight conversation(s)")
+            await asyncio.wait(list(self.tasks), timeout=bot.SHUTDOWN_DRAIN_SECONDS)
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+        self.blocking.shutdown(wait=False)
+
+    def run_blocking(self, fn, *args):
+        """Run a blocking call in the bounded pool, keeping the trace id."""
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(self.blocking, context.run, fn, *args)
+
+    def stats(self):
+        return {"in_flight": len(self.tasks), "rejected": self.rejected, "users": len(self._user_locks),
+                "llm_flights": len(self._llm_flights)}
+
+    @contextlib.asynccontextmanager
+    async def _user_turn(self, user: str):
+        entry = self._user_locks.get(user)
+        if entry is None:
+            entry = self._user_locks[user] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user]
+
+    # -----------------------------
+    # Webhook
+    # -----------------------------
+    async def webhook(self, form: dict, base_url: str):
+        """Answer Twilio with TwiML; the pipeline continues in a task."""
+        incoming_msg = form.get("Body", "").strip()
+        from_number = form.get("From", "unknown")
+        media_url = form.get("MediaUrl0")
+        message_sid = form.get("MessageSid")
+
+        resp = MessagingResponse()
+        if message_sid and not bot.DEDUPE.add(message_sid):
+            logging.info(f"Duplicate webhook for {message_sid}; ignoring")
+            return str(resp)
+
+        # Greeting and canned replies; behind the user's running turn, if any
+        if from_number not in self._user_locks:
+            reply = await self.run_blocking(bot.instant_reply, from_number, incoming_msg)
+            if reply:
+                resp.message(reply)
+                return str(resp)
+
+        if len(self.tasks) >= self.max_inflight:
+            self.rejected += 1
+            resp.message(BUSY_REPLY)
+            return str(resp)
+        task = asyncio.ensure_future(
+            self._conversation(from_number, incoming_msg, media_url, base_url, message_sid, time.time()))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return str(resp)
+
+    async def _conversation(self, from_number, incoming_msg, media_url, base_url, trace_id, received_at):
+        with trace(trace_id):
+            try:
+                async with self._user_turn(from_number):
+                    record("queue_wait", time.time() - received_at)
+                    await self.handle_message(from_number, incoming_msg, media_url, base_url)
+                record("reply_e2e", time.time() - received_at)
+            except Exception as e:
+                logging.exception(f"Conversation task failed: {e}")
+                bot.METRICS.inc("bot_errors_total", component="asgi_conversation")
+
+    async def handle_message(self, from_number: str, incoming_msg: str, media_url: str, base_url: str):
+        """``app.handle_message`` for the event loop: STT, LLM, TTS, delivery."""
+        if media_url:
+            t0 = time.time()
+            incoming_msg = await self.transcribe(media_url)
+            record("stt", time.time() - t0)
+            if not incoming_msg:
+                await self.send_text(from_number, bot.VOICE_NOTE_ERROR)
+                return
+        else:
+            reply = await self.run_blocking(bot.instant_reply, from_number, incoming_msg)
+            if reply:
+                # Deferred by the webhook until the user's earlier turn finished
+                await self.send_text(from_number, reply)
+                return
+
+        # The store may be SQLite; keep its I/O off the loop
+        replies, messages = await self.run_blocking(bot.start_turn, from_number, incoming_msg)
+        for reply in replies:
+            await self.send_text(from_number, reply)
+        if messages is None:
+            return
+
+        t0 = time.time()
+        assistant_text = await self.generate_reply(messages)
+        record("llm", time.time() - t0)
+        speech_text, _ = await self.run_blocking(bot.finish_turn, from_number, assistant_text)
+
+        t0 = time.time()
+        audio_path = await self.run_blocking(
+            bot.text_to_speech_murf, speech_text, bot.unique_audio_basename(from_number, "response"))
+        record("tts", time.time() - t0)
+        if audio_path:
+            media = audio_path
+            if not audio_path.startswith(("http://", "https://")):
+                media = bot.build_public_url_from_base(base_url, f"audio/{os.path.basename(audio_path)}")
+            t0 = time.time()
+            await self.send_media(from_number, media)
+            record("delivery", time.time() - t0)
+
+    # -----------------------------
+    # LLM
+    # -----------------------------
+    async def _openrouter(self, messages):
+        if self.openai is None:
+            return await self.run_blocking(bot.generate_with_openrouter, messages)
+        try:
+            with bot.METRICS.timed("bot_llm_seconds", provider="openrouter"):
+                completion = await self.openai.chat.completions.create(
+                    extra_headers={
+                        "HTTP-Referer": "http://localhost:5000",
+                        "X-Title": "WhatsApp GPT Bot"
+                    },
+                    model=bot.OPENROUTER_MODEL,
+                    messages=messages or [{"role": "user", "content": "Hello"}]
+                )
+            return completion.choices[0].message.content
+        except Exception as e:
+            logging.error(f"OpenRouter GPT error: {e}")
+            bot.METRICS.inc("bot_errors_total", component="openrouter")
+            return None
+
+    async def _gemini(self, messages):
+        if bot.FAKES is not None:
+            return await self.run_blocking(bot.generate_with_gemini, messages)
+        system, contents = bot.to_gemini_contents(messages or [])
+        try:
+            client = self.gemini or await self.run_blocking(bot.PROVIDERS.get, "gemini")
+            with bot.METRICS.timed("bot_llm_seconds", provider="gemini"):
+                response = await client.aio.models.generate_content(
+                    model=bot.GEMINI_MODEL,
+                    contents=contents,
+                    config={"system_instruction": system} if system else None
+                )
+            return response.text
+        except Exception as e:
+            logging.error(f"Gemini API error: {e}")
+            bot.METRICS.inc("bot_errors_total", component="gemini")
+            return None
+
+    async def generate_reply(self, messages):
+        """Hedged, cancellable LLM call through the shared router; always returns text.
+
+        Single-turn prompts use the LLM response cache, and concurrent
+        identical misses share one upstream call: later callers await the
+        first one's future instead of blocking a thread on the cache's lock.
+        """
+        cache_key = bot.llm_cache_key(messages)
+        if cache_key:
+            # The cache may read SQLite; keep that off the loop
+            text = await self.run_blocking(bot.LLM_CACHE.get, cache_key)
+            if not text:
+                text = await self._single_flight(cache_key, messages)
+        else:
+            text = await self._route(messages)
+        if not text:
+            bot.METRICS.inc("bot_fallbacks_total", kind="llm_apology")
+        return text or bot.LLM_FALLBACK_REPLY
+
+    async def _route(self, messages):
+        return await bot.LLM_ROUTER.agenerate(messages, {"openrouter": self._openrouter, "gemini": self._gemini})
+
+    async def _single_flight(self, cache_key: str, messages):
+        flight = self._llm_flights.get(cache_key)
+        if flight is not None:
+            try:
+                # shield: a follower timing out must not cancel everyone's result
+                text = await asyncio.wait_for(asyncio.shield(flight), bot.LLM_CACHE.wait_timeout)
+            except asyncio.TimeoutError:
+                text = None
+            # The leader failed or is too slow: compute uncached, like ResponseCache.begin
+            return text or await self._route(messages)
+
+        flight = self._llm_flights[cache_key] = asyncio.get_running_loop().create_future()
+        text = None
+        try:
+            text = await self._route(messages)
+        finally:
+            del self._llm_flights[cache_key]
+            flight.set_result(text)
+        if text:
+            await self.run_blocking(bot.LLM_CACHE.put, cache_key, text)
+        return text
+
+    # -----------------------------
+    # AssemblyAI STT
+    # -----------------------------
+    async def transcribe(self, media_url: str):
+        """Stream the Twilio media into an AssemblyAI upload and poll for the transcript."""
+        if bot.FAKES is not None:
+            # The fakes hook into the requests transport, so take the threaded path
+            return await self.run_blocking(bot.transcribe_with_assemblyai, media_url)
+        headers = {"authorization": bot.ASSEMBLYAI_API_KEY}
+        t0 = time.time()
+        upload_url, size = await self._upload(media_url, headers)
+        record("stt_upload", time.time() - t0)
+        if not upload_url:
+            bot.METRICS.inc("bot_errors_total", component="assemblyai_upload")
+            return None
+        created = await self.http.post(f"{bot.ASSEMBLYAI_BASE_URL}/transcript", headers=headers,
+                                       json={"audio_url": upload_url, "speech_model": "universal"})
+        transcript_id = created.json().get("id")
+        if not transcript_id:
+            logging.error(f"AssemblyAI transcript request failed ({created.status_code}): {created.text}")
+            bot.METRICS.inc("bot_errors_total", component="assemblyai_transcript")
+            return None
+
+        poller = bot.TRANSCRIPT_POLLER
+        interval = poller.first_interval(size / bot.VOICE_NOTE_BYTES_PER_SECOND)
+        t0 = time.time()
+        deadline = t0 + bot.STT_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            await asyncio.sleep(min(interval, max(0.0, deadline - time.time())))
+            try:
+                result = (await self.http.get(f"{bot.ASSEMBLYAI_BASE_URL}/transcript/{transcript_id}",
+                                              headers=headers)).json()
+            except (httpx.HTTPError, ValueError) as e:
+                logging.warning(f"Polling transcript {transcript_id} failed: {e}")
+                result = {}
+            status = result.get("status")
+            if status == "completed":
+                record("stt_poll", time.time() - t0)
+                logging.info(f"AssemblyAI transcription complete: {result.get('text')}")
+                return result.get("text")
+            if status == "error":
+                logging.error(f"AssemblyAI transcription error: {result.get('error')}")
+                return None
+            interval = min(poller.max_interval, interval * poller.backoff)
+        logging.error(f"AssemblyAI transcription {transcript_id} timed out")
+        return None
+
+    async def _upload(self, media_url: str, headers: dict):
+        """Return ``(upload_url, streamed_bytes)``; one chunk in memory at a time."""
+        streamed = [0]
+        t0 = time.time()
+        auth = (bot.TWILIO_ACCOUNT_SID, bot.TWILIO_AUTH_TOKEN)
+        async with self.http.stream("GET", media_url, auth=auth, follow_redirects=True) as response:
+            record("media_download", time.time() - t0)
+            if response.status_code != 200:
+                logging.error(f"Failed to download Twilio audio ({response.status_code})")
+                return None, 0
+
+            chunks = response.aiter_bytes(bot.ASSEMBLYAI_UPLOAD_CHUNK_SIZE)
+
+            # Validate we actually got audio bytes before uploading; empty uploads cause 422
+            first_chunk = b""
+            async for chunk in chunks:
+                if chunk:
+                    first_chunk = chunk
+                    break
+            if not first_chunk:
+                logging.error("Downloaded audio is empty; aborting transcription to avoid 422 upload error")
+                return None, 0
+
+            async def _body():
+                streamed[0] += len(first_chunk)
+                yield first_chunk
+                async for chunk in chunks:
+                    streamed[0] += len(chunk)
+                    yield chunk
+
+            upload = await self.http.post(
+                f"{bot.ASSEMBLYAI_BASE_URL}/upload",
+                headers={**headers, "content-type": "application/octet-stream"},
+                content=_body(),
+            )
+        if upload.status_code != 200:
+            logging.error(f"AssemblyAI upload failed ({upload.status_code}): {upload.text}")
+            return None, 0
+        return upload.json().get("upload_url"), streamed[0]
+
+    # -----------------------------
+    # Twilio delivery
+    # -----------------------------
+    async def _send(self, to_number: str, component: str, **fields):
+        data = {"From": bot.TWILIO_WHATSAPP_NUMBER, "To": to_number}
+        data.update({k: v for k, v in fields.items() if v})
+        try:
+            response = await self.http.post(
+                f"{TWILIO_API_BASE}/Accounts/{bot.TWILIO_ACCOUNT_SID}/Messages.json",
+                data=data,
+                auth=(bot.TWILIO_ACCOUNT_SID, bot.TWILIO_AUTH_TOKEN),
+            )
+        except httpx.HTTPError as e:
+            response = None
+            error = str(e)
+        else:
+            error = response.text
+        if response is None or response.status_code >= 300:
+            logging.error(f"Failed to send WhatsApp {component.split('_')[-1]}: {error}")
+            bot.METRICS.inc("bot_errors_total", component=component)
+            return False
+        logging.info(f"Queued WhatsApp {component.split('_')[-1]} message sid={response.json().get('sid')} to={to_number}")
+        return True
+
+    async def send_text(self, to_number: str, body: str):
+        if bot.FAKES is not None:
+            return await self.run_blocking(bot.send_whatsapp_text, to_number, body)
+        return await self._send(to_number, "twilio_text", Body=body)
+
+    async def send_media(self, to_number: str, media_url: str, body: str = None):
+        if bot.FAKES is not None:
+            return await self.run_blocking(bot.send_whatsapp_media, to_number, media_url, body)
+        return await self._send(to_number, "twilio_media", Body=body, MediaUrl=media_url)
+
+    # -----------------------------
+    # Audio
+    # -----------------------------
+    async def audio(self, name: str, headers: dict, send, zerocopy: bool = False, head: bool = False):
+        """Serve a generated clip: ETag/304, single-range 206, immutable caching."""
+        safe_name = bot.sanitize_filename(name)
+        # A miss may stat the file and a cold clip is hashed once: both off the loop
+        etag, data = await self.run_blocking(_lookup_clip, safe_name)
+        if etag is None:
+            return await send_response(send, 404)
+        quoted = f'"{etag}"'
+        common = [
+            ("etag", quoted),
+            ("cache-control", f"public, max-age={bot.AUDIO_CACHE_MAX_AGE}, immutable"),
+            ("accept-ranges", "bytes"),
+        ]
+        if quoted in headers.get("if-none-match", ""):
+            return await send_response(send, 304, common)
+
+        path = os.path.join(bot.AUDIO_OUTPUT_DIR, safe_name)
+        size = len(data) if data is not None else bot.AUDIO_STORE.size_of(safe_name)
+        if size is None:
+            return await send_response(send, 404)
+        start, end = 0, size - 1
+        status = 200
+        if "range" in headers:
+            byte_range = parse_range(headers["range"], size)
+            if byte_range is None:
+                return await send_response(send, 416, common + [("content-range", f"bytes */{size}")])
+            start, end = byte_range
+            status = 206
+            common.append(("content-range", f"bytes {start}-{end}/{size}"))
+        length = end - start + 1
+        common += [("content-type", audio_mimetype(safe_name)), ("content-length", str(length))]
+
+        if head or data is not None:
+            await send_response(send, status, common, b"" if head else data[start:end + 1])
+        else:
+            try:
+                f = await self.run_blocking(open, path, "rb")
+            except OSError:
+                return await send_response(send, 404)
+            try:
+                await send_start(send, status, common)
+                if zerocopy:
+                    await send({"type": "http.response.zerocopysend", "file": f.fileno(),
+                                "offset": start, "count": length})
+                else:
+                    await self.run_blocking(f.seek, start)
+                    remaining = length
+                    while remaining > 0:
+                        chunk = await self.run_blocking(f.read, min(AUDIO_READ_CHUNK, remaining))
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                        await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                    if remaining > 0:
+                        await send({"type": "http.response.body", "body": b""})
+            finally:
+                f.close()
+        if not head:
+            bot.AUDIO_STORE.mark_served(safe_name, length)
+
+
+def _lookup_clip(name: str):
+    """``AUDIO_STORE.clip`` for a servable name; ``(None, None)`` if unknown."""
+    if not bot.AUDIO_STORE.has(name):
+        return None, None
+    return bot.AUDIO_STORE.clip(name)
+
+
+def audio_mimetype(name: str):
+    ext = os.path.splitext(name)[1].lower()
+    if ext == ".wav":
+        return "audio/wav"
+    if ext in (".ogg", ".oga"):
+        return "audio/ogg"
+    return "audio/mpeg"
+
+
+def parse_range(header: str, size: int):
+    """``(start, end)`` for a single ``bytes=`` range, or None if unsatisfiable/unsupported."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+# -----------------------------
+# ASGI plumbing
+# -----------------------------
+async def send_start(send, status: int, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+
+
+async def send_response(send, status: int, headers=(), body: bytes = b""):
+    headers = list(headers)
+    if not any(k == "content-length" for k, _ in headers):
+        headers.append(("content-length", str(len(body))))
+    await send_start(send, status, headers)
+    await send({"type": "http.response.body", "body": body})
+
+
+async def read_body(receive, limit: int = MAX_BODY_BYTES):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > limit:
+            return None
+        if not message.get("more_body"):
+            return body
+
+
+def request_headers(scope):
+    return {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+
+
+def host_url(scope, headers: dict):
+    """``request.host_url`` equivalent: scheme://host/."""
+    host = headers.get("host")
+    if not host and scope.get("server"):
+        host = "%s:%s" % tuple(scope["server"])
+    return f"{scope.get('scheme', 'http')}://{host or 'localhost'}/"
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await BOT.startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await BOT.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+BOT = AsyncBot()
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    # Servers without lifespan support: create the clients on first use
+    await BOT.startup()
+    started = time.perf_counter()
+    path = unquote(scope["path"])
+    method = scope["method"]
+    headers = request_headers(scope)
+
+    if path == "/webhook" and method == "POST":
+        body = await read_body(receive)
+        if body is None:
+            return await send_response(send, 413)
+        form = {k: v[0] for k, v in parse_qs(body.decode("utf-8", "replace"), keep_blank_values=True).items()}
+        with trace(form.get("MessageSid")):
+            twiml = await BOT.webhook(form, host_url(scope, headers))
+        await send_response(send, 200, [("content-type", "application/xml")], twiml.encode("utf-8"))
+        bot.METRICS.observe("bot_http_request_seconds", time.perf_counter() - started,
+                            endpoint="webhook", status=200)
+    elif path.startswith("/audio/") and method in ("GET", "HEAD"):
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        await BOT.audio(path[len("/audio/"):], headers, send, zerocopy=zerocopy, head=method == "HEAD")
+    elif path == "/metrics" and method == "GET":
+        await send_response(send, 200, [("content-type", "text/plain; version=0.0.4")],
+                            bot.METRICS.render().encode("utf-8"))
+    elif path == "/" and method == "GET":
+        await send_response(send, 200, [("content-type", "text/plain; charset=utf-8")],
+                            b"WhatsApp AI bot (ASGI) with AssemblyAI STT & Murf.ai TTS is running!")
+    else:
+        await send_response(send, 404)
+
+
+bot.METRICS.callback("bot_asgi_in_flight", "Conversations in flight on the event loop",
+                     lambda: len(BOT.tasks))
@@ -0,0 +1,307 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg", ".oga")
+
+
+class AudioFile:
+    __slots__ = ("size", "created", "fetched_at", "pinned", "etag")
+
+    def __init__(self, size: int, created: float, pinned: bool = False):
+        self.size = size
+        self.created = created
+        self.fetched_at = None
+        self.pinned = pinned
+        self.etag = None
+
+
+def content_etag(data: bytes):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class AudioStore:
+    """Lifecycle manager for the generated-audio directory.
+
+    Keeps an in-memory index of live files so ``has`` can reject unknown
+    names without a filesystem lookup, and runs a janitor thread that
+    deletes a file once it has been fetched (plus a grace period for
+    Twilio/WhatsApp retries) or once it is older than ``ttl``. Pinned files
+    (TTS cache entries) are owned by their cache and skip those rules. The
+    ``max_bytes`` quota is hard and counts pinned files too: it is enforced
+    on every ``register`` as well as in each sweep, oldest unpinned files
+    first and pinned ones only after those (``on_pinned_evicted(path)``
+    tells their owner).
+
+    Each janitor pass also rescans the directory, so files written by other
+    worker processes sharing the directory are picked up within one sweep.
+
+    The most recently registered clips (up to ``hot_max_bytes``) are also
+    kept in memory, since Twilio fetches a reply within seconds of it being
+    written. ETags are a hash of the file content, so every worker hands out
+    the same validator for the same clip.
+    """
+
+    def __init__(self, directory: str, ttl: float = 3600.0, fetched_grace: float = 300.0,
+                 max_bytes: int = 500 * 1024 * 1024, sweep_interval: float = 60.0,
+                 name_pattern: str = None, is_pinned=None, hot_max_bytes: int = 16 * 1024 * 1024,
+                 hot_max_clip: int = 2 * 1024 * 1024, on_pinned_evicted=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.fetched_grace = fetched_grace
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.name_pattern = re.compile(name_pattern) if name_pattern else None
+        self.is_pinned = is_pinned or (lambda path: False)
+        self.on_pinned_evicted = on_pinned_evicted
+        self.hot_max_bytes = hot_max_bytes
+        self.hot_max_clip = hot_max_clip
+        self._files = {}
+        self._hot = OrderedDict()
+        self._hot_bytes = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._janitor = None
+        self.bytes_written = 0
+        self.bytes_served = 0
+        self.bytes_evicted = 0
+        self.files_evicted = 0
+        self.hot_hits = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _add(self, name: str, size: int, created: float, pinned: bool):
+        old = self._files.get(name)
+        if old is not None:
+            self._bytes -= old.size
+        self._files[name] = AudioFile(size, created, pinned)
+        self._bytes += size
+
+    def _drop(self, name: str):
+        entry = self._files.pop(name, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        data = self._hot.pop(name, None)
+        if data is not None:
+            self._hot_bytes -= len(data)
+        return entry
+
+    def _keep_hot(self, name: str, data: bytes):
+        old = self._hot.pop(name, None)
+        if old is not None:
+            self._hot_bytes -= len(old)
+        self._hot[name] = data
+        self._hot_bytes += len(data)
+        while self._hot_bytes > self.hot_max_bytes:
+            _, evicted = self._hot.popitem(last=False)
+            self._hot_bytes -= len(evicted)
+
+    def register(self, path: str, pinned: bool = None):
+        """Index a freshly written file (small clips are read back into the hot cache)."""
+        name = os.path.basename(path)
+        data = None
+        try:
+            size = os.path.getsize(path)
+            if 0 < size <= min(self.hot_max_clip, self.hot_max_bytes):
+                # Still in the page cache right after the write, so this is cheap
+                with open(path, "rb") as f:
+                    data = f.read()
+                size = len(data)
+        except OSError as e:
+            logging.error(f"Cannot register audio file {path}: {e}")
+            return
+        if pinned is None:
+            pinned = self.is_pinned(path)
+        with self._lock:
+            self._add(name, size, time.time(), pinned)
+            self.bytes_written += size
+            if data is not None:
+                self._files[name].etag = content_etag(data)
+                self._keep_hot(name, data)
+            evicted_pinned = self._enforce_quota(keep=name)
+        self._notify_pinned(evicted_pinned)
+
+    def forget(self, path: str):
+        """Drop a file from the index after someone else deleted it."""
+        with self._lock:
+            self._drop(os.path.basename(path))
+
+    def discard(self, path: str):
+        """Delete a temporary file and drop it from the index (not counted as an eviction)."""
+        self.forget(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def has(self, name: str):
+        with self._lock:
+            if name in self._files:
+                return True
+        # Not indexed here: only files that look like ours are worth a disk check
+        # (another worker may have written it since our last sweep).
+        if not self.name_pattern or not self.name_pattern.match(name):
+            return False
+        path = os.path.join(self.directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        with self._lock:
+            self._add(name, st.st_size, st.st_mtime, self.is_pinned(path))
+        return True
+
+    def size_of(self, name: str):
+        with self._lock:
+            entry = self._files.get(name)
+            return entry.size if entry else None
+
+    def clip(self, name: str):
+        """Return ``(etag, data)`` for an indexed file; ``data`` is None unless the clip is hot.
+
+        The ETag of a cold file is computed once by hashing it from disk.
+        Returns ``(None, None)`` if the file is gone.
+        """
+        with self._lock:
+            entry = self._files.get(name)
+            if entry is None:
+                return None, None
+            data = self._hot.get(name)
+            if data is not None:
+                self._hot.move_to_end(name)
+                self.hot_hits += 1
+                return entry.etag, data
+            etag = entry.etag
+        if etag is None:
+            digest = hashlib.sha256()
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(block)
+            except OSError:
+                return None, None
+            etag = digest.hexdigest()[:32]
+            with self._lock:
+                if name in self._files:
+                    self._files[name].etag = etag
+        return etag, None
+
+    def mark_served(self, name: str, nbytes: int):
+        with self._lock:
+            entry = self._files.get(name)
+            if entry is not None and entry.fetched_at is None:
+                entry.fetched_at = time.time()
+            self.bytes_served += nbytes
+
+    def rescan(self):
+        """Reconcile the index with the directory contents."""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.lower().endswith(AUDIO_EXTENSIONS)]
+        except OSError as e:
+            logging.error(f"Cannot list audio directory {self.directory}: {e}")
+            return
+        seen = set(names)
+        with self._lock:
+            for name in list(self._files):
+                if name not in seen:
+                    self._drop(name)
+            missing = [n for n in names if n not in self._files]
+        for name in missing:
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            with self._lock:
+                if name not in self._files:
+                    self._add(name, st.st_size, st.st_mtime, self.is_pinned(path))
+
+    def _evict(self, name: str):
+        entry = self._drop(name)
+        if entry is None:
+            return
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Failed to delete audio file {name}: {e}")
+            return
+        self.bytes_evicted += entry.size
+        self.files_evicted += 1
+
+    def _enforce_quota(self, keep: str = None):
+        """Evict files until under ``max_bytes``, unpinned ones first (lock held).
+
+        Returns the paths of evicted pinned files, for ``_notify_pinned`` once
+        the lock is released.
+        """
+        if self._bytes <= self.max_bytes:
+            return []
+        # Unpinned before pinned, oldest first within each
+        candidates = sorted((e.pinned, e.created, n) for n, e in self._files.items() if n != keep)
+        evicted_pinned = []
+        for pinned, _, name in candidates:
+            if self._bytes <= self.max_bytes:
+                break
+            self._evict(name)
+            if pinned:
+                evicted_pinned.append(os.path.join(self.directory, name))
+        return evicted_pinned
+
+    def _notify_pinned(self, paths):
+        if self.on_pinned_evicted:
+            for path in paths:
+                self.on_pinned_evicted(path)
+
+    def sweep(self):
+        """Delete fetched/expired files, then enforce the size quota. Returns files deleted."""
+        self.rescan()
+        now = time.time()
+        before = self.files_evicted
+        with self._lock:
+            for name, entry in list(self._files.items()):
+                if entry.pinned:
+                    continue
+                fetched_done = entry.fetched_at is not None and now - entry.fetched_at >= self.fetched_grace
+                if fetched_done or now - entry.created >= self.ttl:
+                    self._evict(name)
+            evicted_pinned = self._enforce_quota()
+        self._notify_pinned(evicted_pinned)
+        deleted = self.files_evicted - before
+        if deleted:
+            logging.info(f"Audio janitor deleted {deleted} file(s); {len(self._files)} left, {self._bytes} bytes")
+        return deleted
+
+    def start_janitor(self):
+        """Index what is already on disk, then sweep every ``sweep_interval`` seconds."""
+        if self._janitor is not None:
+            return
+        self.rescan()
+        self._janitor = threading.Thread(target=self._janitor_loop, name="audio-janitor", daemon=True)
+        self._janitor.start()
+
+    def _janitor_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Audio janitor sweep failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "bytes": self._bytes,
+                "bytes_written": self.bytes_written,
+                "bytes_served": self.bytes_served,
+                "bytes_evicted": self.bytes_evicted,
+                "files_evicted": self.files_evicted,
+                "hot_clips": len(self._hot),
+                "hot_bytes": self._hot_bytes,
+                "hot_hits": self.hot_hits,
+            }
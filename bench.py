@@ -0,0 +1,281 @@
+"""Local benchmarks for the bot's building blocks (no network access needed).
+
+    python bench.py store --users 100000
+    python bench.py intents --rounds 2000
+    python bench.py load --users 50 --messages 5 --voice 0.2 --mode async
+    python bench.py startup --runs 5 --clients
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from context import build_prompt
+from intents import IntentMatcher
+from jobs import StageRecorder
+from store import MemoryStore, SQLiteStore
+
+
+def rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def _rate(count, seconds):
+    return f"{count / seconds:,.0f}/s" if seconds > 0 else "inf"
+
+
+def bench_store(store, users: int, turns: int):
+    ids = [f"whatsapp:+91{n:010d}" for n in range(users)]
+    t0 = time.perf_counter()
+    for turn in range(turns):
+        role = "user" if turn % 2 == 0 else "assistant"
+        for user_id in ids:
+            store.append(user_id, {"role": role, "content": f"turn {turn} message for {user_id}"})
+    append_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for user_id in ids:
+        store.set_state(user_id, "continue")
+        store.get_state(user_id)
+    state_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for user_id in ids:
+        build_prompt("persona", store.history(user_id), 6000)
+    prompt_s = time.perf_counter() - t0
+
+    appends = users * turns
+    print(f"  append+trim   {appends:>9,} ops  {append_s:7.2f}s  {_rate(appends, append_s)}")
+    print(f"  set+get state {users * 2:>9,} ops  {state_s:7.2f}s  {_rate(users * 2, state_s)}")
+    print(f"  build_prompt  {users:>9,} ops  {prompt_s:7.2f}s  {_rate(users, prompt_s)}")
+    print(f"  peak RSS      {rss_mb():.0f} MB  stats={store.stats()}")
+
+
+def cmd_intents(args):
+    # The labeled set lives with the intent tests, so pytest guards it too
+    from tests.test_intents import LABELED_INTENTS
+
+    matcher = IntentMatcher()
+    wrong = [(text, expected, matcher.classify(text)[0])
+             for text, expected in LABELED_INTENTS if matcher.classify(text)[0] != expected]
+    total = len(LABELED_INTENTS)
+    print(f"accuracy      {total - len(wrong)}/{total} ({(total - len(wrong)) / total:.1%})")
+    for text, expected, got in wrong:
+        print(f"  MISMATCH {text!r}: expected {expected}, got {got}")
+
+    texts = [text for text, _ in LABELED_INTENTS]
+    count = len(texts) * args.rounds
+    t0 = time.perf_counter()
+    for _ in range(args.rounds):
+        for text in texts:
+            matcher.classify(text)
+    elapsed = time.perf_counter() - t0
+    print(f"classify      {count:>9,} msgs  {elapsed:7.2f}s  {_rate(count, elapsed)}")
+    if wrong:
+        raise SystemExit(1)
+
+
+LOAD_TEXTS = [
+    "tell me a fun fact about space",
+    "what should I cook for dinner tonight",
+    "how do I improve my sleep",
+    "explain compound interest simply",
+    "suggest a short book to read",
+]
+
+
+def cmd_load(args):
+    # app.py reads its configuration at import time
+    os.environ["FAKE_PROVIDERS"] = "true"
+    os.environ["ASYNC_WEBHOOK"] = "true" if args.mode == "async" else "false"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("CONVERSATION_STORE", "memory")
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    os.chdir(workdir)  # generated audio goes to a scratch directory
+    import app
+
+    waiters = {}
+    waiters_lock = threading.Lock()
+
+    def _on_send(to, message):
+        with waiters_lock:
+            event = waiters.get(to)
+        if event is not None:
+            event.set()
+
+    app.FAKES.twilio.on_send = _on_send
+    sids = itertools.count()
+    total = args.users * args.messages
+    latency = StageRecorder(window=total)
+    timeouts = []
+    peak_threads = [threading.active_count()]
+    done = threading.Event()
+
+    def _sample_threads():
+        while not done.wait(0.1):
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+    def _user(index):
+        client = app.app.test_client()
+        from_number = f"whatsapp:+1555{index:07d}"
+        for _ in range(args.messages):
+            event = threading.Event()
+            with waiters_lock:
+                waiters[from_number] = event
+            form = {"From": from_number, "MessageSid": f"SMbench{next(sids):010d}"}
+            if random.random() < args.voice:
+                form.update(Body="", NumMedia="1", MediaUrl0=f"https://api.twilio.com/fake-media/{index}.ogg")
+            else:
+                form["Body"] = random.choice(LOAD_TEXTS)
+            t0 = time.perf_counter()
+            client.post("/webhook", data=form)
+            latency.record("webhook ack", time.perf_counter() - t0)
+            if event.wait(args.timeout):
+                latency.record("reply latency", time.perf_counter() - t0)
+            else:
+                timeouts.append(from_number)
+
+    print(f"load: {args.users} users x {args.messages} messages, {args.voice:.0%} voice notes, "
+          f"{args.mode} webhook, fakes={os.getenv('FAKE_LATENCY') or 'default latencies'}")
+    sampler = threading.Thread(target=_sample_threads, daemon=True)
+    sampler.start()
+    users = [threading.Thread(target=_user, args=(i,)) for i in range(args.users)]
+    t0 = time.perf_counter()
+    for t in users:
+        t.start()
+    for t in users:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    done.set()
+
+    replies = latency.stage("reply latency").count
+    print(f"  replies       {replies:>6,}/{total:,}  timeouts={len(timeouts)}  "
+          f"{elapsed:7.2f}s  {_rate(replies, elapsed)}")
+    for label in ("reply latency", "webhook ack"):
+        stats = latency.stage(label)
+        print(f"  {label:<13} p50={stats.percentile(50):.3f}s  p95={stats.percentile(95):.3f}s  "
+              f"p99={stats.percentile(99):.3f}s  max={stats.max:.3f}s")
+    print(f"  threads       peak={peak_threads[0]}  now={threading.active_count()}")
+    print(f"  peak RSS      {rss_mb():.0f} MB")
+    print(f"  fakes         {app.FAKES.stats()}")
+
+
+# Runs in a fresh interpreter per worker boot; prints one JSON line
+STARTUP_PROBE = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+import {module}
+result = {{"import_s": time.perf_counter() - t0}}
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:")) / 1024
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+from app import PROVIDERS
+result["rss_mb"] = rss_mb()
+result["sdks"] = [m for m in {sdks!r} if m in sys.modules]
+if {prewarm!r}:
+    t0 = time.perf_counter()
+    PROVIDERS.prewarm().join()
+    result["prewarm_s"] = time.perf_counter() - t0
+if {clients!r}:
+    t0 = time.perf_counter()
+    for name, info in PROVIDERS.stats().items():
+        if info["configured"]:
+            PROVIDERS.get(name)
+    result["clients_s"] = time.perf_counter() - t0
+    result["clients_rss_mb"] = rss_mb()
+    result["clients_sdks"] = [m for m in {sdks!r} if m in sys.modules]
+print(json.dumps(result))
+"""
+STARTUP_SDKS = ("openai", "google.genai", "murf", "gtts", "twilio.rest")
+
+
+def cmd_startup(args):
+    repo = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=repo, LOG_LEVEL="WARNING", PROVIDER_PREWARM="false")
+    env.pop("FAKE_PROVIDERS", None)
+    probe = STARTUP_PROBE.format(module=args.module, sdks=STARTUP_SDKS, prewarm=args.prewarm, clients=args.clients)
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as workdir:
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, "-c", probe], cwd=workdir, env=env,
+                                 capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    def _median(key):
+        return statistics.median(r[key] for r in runs)
+
+    print(f"startup: import {args.module}, {args.runs} fresh interpreter(s), medians")
+    print(f"  import        {_median('import_s'):.3f}s  RSS {_median('rss_mb'):.0f} MB  "
+          f"SDKs loaded: {', '.join(runs[-1]['sdks']) or 'none'}")
+    if args.prewarm:
+        print(f"  prewarm       {_median('prewarm_s'):.3f}s in the background (readiness not delayed)")
+    if args.clients:
+        print(f"  + all clients {_median('clients_s'):.3f}s  RSS {_median('clients_rss_mb'):.0f} MB  "
+              f"SDKs loaded: {', '.join(runs[-1]['clients_sdks']) or 'none'}")
+
+
+def cmd_store(args):
+    backends = ["memory", "sqlite"] if args.backend == "all" else [args.backend]
+    for backend in backends:
+        print(f"{backend}: {args.users:,} users x {args.turns} turns (max_history={args.max_history})")
+        if backend == "memory":
+            bench_store(MemoryStore(args.max_history, max_users=args.users), args.users, args.turns)
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                store = SQLiteStore(os.path.join(tmp, "bench.db"), args.max_history)
+                bench_store(store, args.users, args.turns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_store = sub.add_parser("store", help="ConversationStore append/state/prompt throughput and memory")
+    p_store.add_argument("--backend", choices=["memory", "sqlite", "all"], default="all")
+    p_store.add_argument("--users", type=int, default=100000)
+    p_store.add_argument("--turns", type=int, default=8)
+    p_store.add_argument("--max-history", type=int, default=6)
+    p_store.set_defaults(func=cmd_store)
+
+    p_intents = sub.add_parser("intents", help="Intent matcher accuracy on a labeled set and messages/second")
+    p_intents.add_argument("--rounds", type=int, default=2000)
+    p_intents.set_defaults(func=cmd_intents)
+
+    p_load = sub.add_parser("load", help="Replay webhooks against app.py with fake providers; latency/threads/memory")
+    p_load.add_argument("--users", type=int, default=50, help="concurrent users (one closed-loop thread each)")
+    p_load.add_argument("--messages", type=int, default=5, help="messages per user")
+    p_load.add_argument("--voice", type=float, default=0.2, help="fraction of messages sent as voice notes")
+    p_load.add_argument("--mode", choices=["async", "sync"], default="async")
+    p_load.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for each reply")
+    p_load.set_defaults(func=cmd_load)
+
+    p_startup = sub.add_parser("startup", help="Worker boot: import time, RSS and which provider SDKs get loaded")
+    p_startup.add_argument("--runs", type=int, default=5)
+    p_startup.add_argument("--module", choices=["app", "asgi"], default="app")
+    p_startup.add_argument("--prewarm", action="store_true", help="also time the background provider prewarm")
+    p_startup.add_argument("--clients", action="store_true",
+                           help="then build every configured client (the cost of eager construction)")
+    p_startup.set_defaults(func=cmd_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
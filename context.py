@@ -0,0 +1,134 @@
+from collections import deque
+
+# Rough per-message overhead for role/formatting tokens in chat APIs
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_TURN_CHARS = 120
+SUMMARY_MAX_TURNS = 20
+
+
+def estimate_tokens(text: str):
+    """Cheap token estimate (~4 characters per token) without a tokenizer."""
+    return (len(text or "") + 3) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+def summarize_turns(messages, max_chars: int = SUMMARY_TURN_CHARS):
+    """Extractive summary of older turns: one clipped line per message."""
+    lines = []
+    for msg in messages:
+        text = " ".join((msg.get("content") or "").split())
+        if len(text) > max_chars:
+            text = text[:max_chars].rsplit(" ", 1)[0] + "…"
+        speaker = "User" if msg.get("role") == "user" else "Assistant"
+        lines.append(f"{speaker}: {text}")
+    return "Summary of earlier conversation:\n" + "\n".join(lines)
+
+
+class ConversationContext:
+    """Per-user chat history with a running token count.
+
+    Token estimates are computed once when a message is appended and kept
+    alongside it, so the total is maintained incrementally as messages are
+    appended or evicted (``maxlen``) rather than recounted every turn.
+    Evicted turns are remembered (bounded) so they can be folded into a
+    summary when the prompt is built. Slotted, with the eviction/summary
+    containers created lazily, to keep idle per-user records small.
+    """
+
+    __slots__ = ("maxlen", "tokens", "_entries", "_evicted", "_evicted_version", "_summary_cache")
+
+    def __init__(self, maxlen: int = None):
+        self.maxlen = maxlen
+        self.tokens = 0
+        self._entries = deque()
+        self._evicted = None
+        self._evicted_version = 0
+        self._summary_cache = None
+
+    @classmethod
+    def from_entries(cls, maxlen: int, entries, evicted=()):
+        """Rebuild a context from stored (message, tokens) pairs without re-estimating."""
+        context = cls(maxlen)
+        context._entries.extend(entries)
+        context.tokens = sum(tokens for _, tokens in context._entries)
+        if evicted:
+            context._evicted = deque(evicted, maxlen=SUMMARY_MAX_TURNS)
+        return context
+
+    def _evict_oldest(self):
+        old_message, old_tokens = self._entries.popleft()
+        self.tokens -= old_tokens
+        if self._evicted is None:
+            self._evicted = deque(maxlen=SUMMARY_MAX_TURNS)
+        self._evicted.append(old_message)
+        self._evicted_version += 1
+        self._summary_cache = None
+        return old_message
+
+    def append(self, message: dict, tokens: int = None):
+        """Append a message; return the messages evicted to respect ``maxlen``."""
+        if tokens is None:
+            tokens = estimate_tokens(message.get("content"))
+        evicted = []
+        while self.maxlen and len(self._entries) >= self.maxlen:
+            evicted.append(self._evict_oldest())
+        self._entries.append((message, tokens))
+        self.tokens += tokens
+        return evicted
+
+    def clear(self):
+        self._entries.clear()
+        self._evicted = None
+        self._evicted_version += 1
+        self._summary_cache = None
+        self.tokens = 0
+
+    def entries(self):
+        """(message, tokens) pairs, oldest first."""
+        return list(self._entries)
+
+    def __iter__(self):
+        return (message for message, _ in list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def summary_for(self, dropped: int):
+        """Cached summary of evicted turns plus the ``dropped`` oldest live turns."""
+        key = (self._evicted_version, dropped)
+        if self._summary_cache and key in self._summary_cache:
+            return self._summary_cache[key]
+        older = list(self._evicted or ()) + [message for message, _ in list(self._entries)[:dropped]]
+        if not older:
+            return None
+        text = summarize_turns(older)
+        self._summary_cache = {key: (text, estimate_tokens(text))}
+        return self._summary_cache[key]
+
+
+def build_prompt(persona: str, context: ConversationContext, budget: int):
+    """Build the chat messages for one turn within a token budget.
+
+    The newest turns are kept verbatim; older turns (including ones already
+    evicted from the history) are replaced by a cached summary when it fits.
+    """
+    used = estimate_tokens(persona)
+    entries = context.entries()
+    if used + context.tokens <= budget:
+        # Fast path: the running total says everything fits
+        kept = [message for message, _ in entries]
+        used += context.tokens
+    else:
+        kept = []
+        for message, tokens in reversed(entries):
+            # Always keep the latest message, even if it alone exceeds the budget
+            if kept and used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+
+    prompt = [{"role": "system", "content": persona}]
+    summary = context.summary_for(len(entries) - len(kept))
+    if summary and used + summary[1] <= budget:
+        prompt.append({"role": "system", "content": summary[0]})
+    return prompt + kept
@@ -0,0 +1,289 @@
+"""Local stand-ins for every external service, for benchmarks and offline runs.
+
+Enabled with ``FAKE_PROVIDERS=true``. Each fake sleeps for a log-normally
+distributed latency and fails at a configurable rate, per provider:
+
+    FAKE_LATENCY="openrouter=0.8~0.4,gemini=0.6,murf=0.7,gtts=0.2,twilio=0.05,assemblyai=1.5,media=0.05"
+    FAKE_ERROR_RATE="openrouter=0.05,twilio=0.01"
+
+``name=median`` or ``name=median~sigma`` (seconds; sigma of the log, default 0.25).
+"""
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_LATENCY = {
+    "openrouter": (0.8, 0.25),
+    "gemini": (0.6, 0.25),
+    "murf": (0.7, 0.25),
+    "gtts": (0.2, 0.25),
+    "twilio": (0.05, 0.25),
+    "assemblyai": (1.5, 0.25),
+    "media": (0.05, 0.25),
+}
+FAKE_REPLY = ("Here is a short answer from the local stand-in model. "
+              "It has two sentences so streaming and TTS chunking are exercised.")
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz); repeated to make a clip
+_MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+class FakeProviderError(Exception):
+    pass
+
+
+class FakeProfile:
+    __slots__ = ("name", "median", "sigma", "error_rate", "calls", "errors")
+
+    def __init__(self, name: str, median: float, sigma: float = 0.25, error_rate: float = 0.0):
+        self.name = name
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+    def call(self, scale: float = 1.0):
+        """Sleep for one sampled latency, then maybe raise ``FakeProviderError``."""
+        self.calls += 1
+        time.sleep(self.sample() * scale)
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            raise FakeProviderError(f"fake {self.name} error")
+
+
+def parse_profiles(latency_spec: str = "", error_spec: str = ""):
+    profiles = {name: FakeProfile(name, median, sigma) for name, (median, sigma) in DEFAULT_LATENCY.items()}
+    for item in filter(None, (part.strip() for part in (latency_spec or "").split(","))):
+        name, _, value = item.partition("=")
+        median, _, sigma = value.partition("~")
+        profile = profiles.setdefault(name.strip(), FakeProfile(name.strip(), 0.0))
+        profile.median = float(median)
+        if sigma:
+            profile.sigma = float(sigma)
+    for item in filter(None, (part.strip() for part in (error_spec or "").split(","))):
+        name, _, rate = item.partition("=")
+        profiles.setdefault(name.strip(), FakeProfile(name.strip(), 0.0)).error_rate = float(rate)
+    return profiles
+
+
+def _words(text: str):
+    return [word + " " for word in text.split(" ")]
+
+
+class FakeOpenAI:
+    """``chat.completions.create`` (plain and ``stream=True``) like the OpenAI client."""
+
+    def __init__(self, profile: FakeProfile, reply: str = FAKE_REPLY):
+        self.profile = profile
+        self.reply = reply
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model=None, messages=None, stream=False, **kwargs):
+        if not stream:
+            self.profile.call()
+            message = SimpleNamespace(content=self.reply)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        # Time to first token is a third of a full answer; the rest trickles in
+        self.profile.call(scale=1 / 3)
+        return self._stream()
+
+    def _stream(self):
+        words = _words(self.reply)
+        per_word = self.profile.median * (2 / 3) / max(1, len(words))
+        for word in words:
+            time.sleep(per_word)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))])
+
+
+class FakeGemini:
+    """``models.generate_content`` like ``google.genai.Client``."""
+
+    def __init__(self, profile: FakeProfile, reply: str = FAKE_REPLY):
+        self.profile = profile
+        self.reply = reply
+        self.models = SimpleNamespace(generate_content=self._generate)
+
+    def _generate(self, model=None, contents=None, config=None):
+        self.profile.call()
+        return SimpleNamespace(text=self.reply)
+
+
+def fake_mp3(seconds: float):
+    # ~38 frames per second of audio
+    return _MP3_FRAME * max(1, int(seconds * 38))
+
+
+FAKE_MURF_HOST = "murf.fake.local"
+
+
+class FakeMurf:
+    """``text_to_speech.generate`` returning an audio URL, like the Murf SDK.
+
+    The URL points at ``FAKE_MURF_HOST``, served by ``FakeHTTPAdapter``, so
+    the app's real download path is exercised.
+    """
+
+    def __init__(self, profile: FakeProfile):
+        self.profile = profile
+        self._seq = itertools.count()
+        self.text_to_speech = SimpleNamespace(generate=self._generate)
+
+    def _generate(self, text=None, **kwargs):
+        self.profile.call()
+        seconds = len(text or "") / 15
+        return SimpleNamespace(audio_file=f"https://{FAKE_MURF_HOST}/audio/{next(self._seq)}.mp3?seconds={seconds:.1f}")
+
+
+def fake_gtts(profile: FakeProfile):
+    """A drop-in for the ``gTTS`` class: ``gTTS(text=..., lang=...).save(path)``."""
+
+    class FakeGTTS:
+        def __init__(self, text="", lang="en", **kwargs):
+            self.text = text
+
+        def save(self, path):
+            profile.call()
+            with open(path, "wb") as f:
+                f.write(fake_mp3(len(self.text) / 15))
+
+    return FakeGTTS
+
+
+class FakeTwilio:
+    """``messages.create`` like the Twilio REST client; ``on_send(to, message)`` observes deliveries."""
+
+    def __init__(self, profile: FakeProfile):
+        self.profile = profile
+        self.on_send = None
+        self._seq = itertools.count()
+        self.sent = 0
+        self.messages = SimpleNamespace(create=self._create)
+
+    def _create(self, from_=None, to=None, body=None, media_url=None, **kwargs):
+        self.profile.call()
+        message = SimpleNamespace(sid=f"SMfake{next(self._seq):08d}", to=to, body=body, media_url=media_url)
+        self.sent += 1
+        if self.on_send:
+            self.on_send(to, message)
+        return message
+
+
+class FakeHTTPAdapter(BaseAdapter):
+    """requests transport answering Twilio media and Murf audio downloads and the AssemblyAI REST API.
+
+    Mounted on the shared HTTP client's sessions, so the app's real
+    streaming upload/poll code runs unchanged, just without a network.
+    """
+
+    def __init__(self, media: FakeProfile, assemblyai: FakeProfile, media_bytes: int = 40000,
+                 transcript_text: str = "what is the weather like today"):
+        super().__init__()
+        self.media = media
+        self.assemblyai = assemblyai
+        self.media_bytes = media_bytes
+        self.transcript_text = transcript_text
+        self._transcripts = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _response(self, request, status: int, body, content_type: str = "application/json"):
+        response = requests.Response()
+        response.status_code = status
+        response.reason = "OK" if status < 400 else "Error"
+        response.headers = CaseInsensitiveDict({"Content-Type": content_type})
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        path, _, query = request.path_url.partition("?")
+        if FAKE_MURF_HOST in request.url:
+            self.media.call()
+            return self._response(request, 200, fake_mp3(float(query.partition("=")[2] or 1)), "audio/mpeg")
+        if "assemblyai" not in request.url:
+            # Twilio media download
+            try:
+                self.media.call()
+            except FakeProviderError:
+                return self._response(request, 503, {"message": "fake media error"})
+            return self._response(request, 200, b"\x00" * self.media_bytes, "audio/ogg")
+        if path.endswith("/upload"):
+            body = request.body
+            size = len(body) if isinstance(body, (bytes, str)) else sum(len(chunk) for chunk in (body or ()))
+            return self._response(request, 200, {"upload_url": f"https://cdn.assemblyai.com/upload/fake-{size}"})
+        if path.endswith("/transcript") and request.method == "POST":
+            transcript_id = f"fake-{next(self._seq)}"
+            try:
+                # Processing time is decided up front; polls before then see "processing"
+                ready_at = time.time() + self.assemblyai.sample()
+                if self.assemblyai.error_rate and random.random() < self.assemblyai.error_rate:
+                    self.assemblyai.errors += 1
+                    ready_at = -ready_at
+            finally:
+                self.assemblyai.calls += 1
+            with self._lock:
+                self._transcripts[transcript_id] = ready_at
+            return self._response(request, 200, {"id": transcript_id, "status": "queued"})
+        transcript_id = path.rsplit("/", 1)[-1]
+        with self._lock:
+            ready_at = self._transcripts.get(transcript_id)
+        if ready_at is None:
+            return self._response(request, 404, {"error": "unknown transcript"})
+        if time.time() < abs(ready_at):
+            return self._response(request, 200, {"id": transcript_id, "status": "processing"})
+        with self._lock:
+            self._transcripts.pop(transcript_id, None)
+        if ready_at < 0:
+            return self._response(request, 200, {"id": transcript_id, "status": "error", "error": "fake error"})
+        return self._response(request, 200, {"id": transcript_id, "status": "completed", "text": self.transcript_text})
+
+    def close(self):
+        pass
+
+
+class FakeProviders:
+    """Every fake, built from the FAKE_LATENCY / FAKE_ERROR_RATE settings."""
+
+    def __init__(self, latency_spec: str = "", error_spec: str = ""):
+        self.profiles = parse_profiles(latency_spec, error_spec)
+        self.openai = FakeOpenAI(self.profiles["openrouter"])
+        self.gemini = FakeGemini(self.profiles["gemini"])
+        self.murf = FakeMurf(self.profiles["murf"])
+        self.gtts = fake_gtts(self.profiles["gtts"])
+        self.twilio = FakeTwilio(self.profiles["twilio"])
+        self.http = FakeHTTPAdapter(self.profiles["media"], self.profiles["assemblyai"])
+        logging.warning("FAKE_PROVIDERS enabled: no external service will be called")
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv("FAKE_LATENCY", ""), os.getenv("FAKE_ERROR_RATE", ""))
+
+    def mount(self, http_client, hosts=()):
+        """Route the shared HTTP client's sessions for ``hosts`` (and fake Murf audio) to the fake adapter."""
+        for host in tuple(hosts) + (FAKE_MURF_HOST,):
+            session = http_client.session_for(host)
+            session.mount("https://", self.http)
+            session.mount("http://", self.http)
+
+    def stats(self):
+        return {name: {"calls": p.calls, "errors": p.errors} for name, p in self.profiles.items()}
@@ -0,0 +1,157 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class HostStats:
+    __slots__ = ("requests", "errors", "retries", "total_seconds", "max_seconds", "statuses")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.statuses = {}
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_seconds": round(self.total_seconds / self.requests, 4) if self.requests else 0.0,
+            "max_seconds": round(self.max_seconds, 4),
+            "statuses": dict(self.statuses),
+        }
+
+
+class HttpClient:
+    """Shared outbound HTTP layer: one keep-alive connection pool per host.
+
+    Every call gets explicit (connect, read) timeouts. Failed calls are
+    retried a bounded number of times with full-jitter exponential backoff,
+    but only when that is safe: idempotent methods, or bodies that can be
+    replayed (bytes/dicts, not generators or file objects). Per-host
+    counters are collected through a response hook on each pooled session,
+    so sessions handed to third-party SDKs (Twilio) are measured too; they
+    are keyed by the host that actually answered, so a redirect (Twilio
+    media -> its CDN) is counted against the redirect target. Each session
+    keeps pools for up to ``pool_hosts`` hosts, so following such a redirect
+    doesn't evict the keep-alive pool of the session's own host.
+    """
+
+    def __init__(self, connect_timeout: float = 3.05, read_timeout: float = 30.0, retries: int = 2,
+                 backoff: float = 0.5, backoff_max: float = 5.0, pool_size: int = 20, pool_hosts: int = 4):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.pool_hosts = pool_hosts
+        self._sessions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _host_stats(self, host: str):
+        stats = self._stats.get(host)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(host, HostStats())
+        return stats
+
+    def session_for(self, url_or_host: str):
+        """Return the pooled keep-alive session for a URL's host."""
+        host = urlsplit(url_or_host).netloc if "://" in url_or_host else url_or_host
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_hosts, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.hooks["response"].append(self._response_hook())
+                self._sessions[host] = session
+        return session
+
+    def _response_hook(self):
+        def _record(response, *args, **kwargs):
+            stats = self._host_stats(urlsplit(response.url).netloc)
+            seconds = response.elapsed.total_seconds()
+            with self._lock:
+                stats.requests += 1
+                stats.total_seconds += seconds
+                stats.max_seconds = max(stats.max_seconds, seconds)
+                stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+            return response
+        return _record
+
+    def _sleep_before_retry(self, attempt: int, response=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.backoff_max))
+        time.sleep(delay)
+
+    @staticmethod
+    def _replayable(kwargs):
+        data = kwargs.get("data")
+        return data is None or isinstance(data, (bytes, str, dict, list, tuple))
+
+    def request(self, method: str, url: str, retries: int = None, **kwargs):
+        """Send a request through the host's pool; raises requests exceptions like requests does.
+
+        Pass ``idempotent=True`` to allow retries of a POST whose body is replayable.
+        """
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        if retries is None:
+            retries = self.retries
+        # Callers may mark a POST as safe to repeat (e.g. a media upload)
+        idempotent = kwargs.pop("idempotent", method in IDEMPOTENT_METHODS)
+        if not idempotent or not self._replayable(kwargs):
+            retries = 0
+
+        session = self.session_for(url)
+        host = urlsplit(url).netloc
+        stats = self._host_stats(host)
+        attempt = 0
+        while True:
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                with self._lock:
+                    stats.errors += 1
+                if attempt >= retries:
+                    raise
+                logging.warning(f"{method} {host} failed ({e}); retry {attempt + 1}/{retries}")
+                self._sleep_before_retry(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                    return response
+                logging.warning(f"{method} {host} returned {response.status_code}; retry {attempt + 1}/{retries}")
+                self._sleep_before_retry(attempt, response)
+                response.close()
+            attempt += 1
+            with self._lock:
+                stats.retries += 1
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {host: s.snapshot() for host, s in self._stats.items()}
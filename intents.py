@@ -0,0 +1,99 @@
+import json
+import logging
+import re
+
+GREETING = "greeting"
+FAREWELL = "farewell"
+YES = "yes"
+NO = "no"
+
+GREETINGS = {"hi", "hello", "hey", "start", "menu", "good morning", "i need help"}
+CONTINUE_YES = {"y", "yes", "yeah", "yep"}
+CONTINUE_NO = {"n", "no", "nope"}
+FAREWELL_WORDS = {
+    "bye", "goodbye", "thanks", "thank you", "thx", "bye bye",
+    "see you", "see ya", "end", "stop", "exit", "good night",
+    "goodnight", "take care"
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s']+")
+
+
+def normalize_text(text: str):
+    """Lowercase, turn punctuation/emoji into spaces and collapse whitespace."""
+    return " ".join(_PUNCTUATION.sub(" ", (text or "").lower()).split())
+
+
+def _alternation(phrases):
+    # Longest first so "bye bye" wins over "bye"
+    words = sorted({normalize_text(p) for p in phrases if normalize_text(p)}, key=len, reverse=True)
+    return "|".join(re.escape(w) for w in words)
+
+
+class IntentMatcher:
+    """Classifies a message into a fixed intent without any I/O.
+
+    Greeting, yes/no and canned-reply phrases must match the whole
+    (normalized) message; farewell phrases match as whole words anywhere, so
+    "weekend" or "nonstop" no longer end the chat. All phrases are compiled
+    once into two regexes.
+
+    ``canned`` maps an intent name to ``{"phrases": [...], "reply": "..."}``;
+    those intents are answered with the fixed reply, skipping the LLM and TTS.
+    """
+
+    def __init__(self, greetings=GREETINGS, farewells=FAREWELL_WORDS, yes=CONTINUE_YES, no=CONTINUE_NO,
+                 canned=None):
+        self.replies = {}
+        groups = []
+        exact = [(GREETING, greetings), (YES, yes), (NO, no)]
+        for name, spec in (canned or {}).items():
+            exact.append((name, spec.get("phrases", [])))
+            self.replies[name] = spec.get("reply", "")
+        self._group_names = {}
+        for index, (name, phrases) in enumerate(exact):
+            pattern = _alternation(phrases)
+            if pattern:
+                group = f"i{index}"
+                self._group_names[group] = name
+                groups.append(f"(?P<{group}>{pattern})")
+        self._exact = re.compile(r"^(?:" + "|".join(groups) + r")$") if groups else None
+        farewell = _alternation(farewells)
+        self._farewell = re.compile(r"(?<!\w)(?:" + farewell + r")(?!\w)") if farewell else None
+
+    def classify(self, text: str):
+        """Return ``(intent, canned_reply)``; intent is None for free text."""
+        normalized = normalize_text(text)
+        if not normalized:
+            return None, None
+        if self._exact is not None:
+            match = self._exact.match(normalized)
+            if match:
+                name = self._group_names[match.lastgroup]
+                return name, self.replies.get(name)
+        if self._farewell is not None and self._farewell.search(normalized):
+            return FAREWELL, None
+        return None, None
+
+
+def load_canned_intents(path: str):
+    """Read canned-reply intents from a JSON file; missing or invalid files give none."""
+    if not path:
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            canned = json.load(f)
+    except FileNotFoundError:
+        logging.warning(f"Canned replies file not found: {path}")
+        return {}
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to load canned replies from {path}: {e}")
+        return {}
+    valid = {}
+    for name, spec in canned.items():
+        if isinstance(spec, dict) and spec.get("phrases") and spec.get("reply"):
+            valid[name] = spec
+        else:
+            logging.warning(f"Ignoring canned intent '{name}': needs 'phrases' and 'reply'")
+    logging.info(f"Loaded {len(valid)} canned reply intents from {path}")
+    return valid
@@ -0,0 +1,423 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+def percentile(samples, pct: float):
+    """Nearest-rank ``pct`` percentile of ``samples``; 0.0 when there are none."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class StageStats:
+    """Rolling latency samples for one named pipeline stage."""
+
+    def __init__(self, window: int = 500):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float):
+        return percentile(self.samples, pct)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "p50": round(self.percentile(50), 4),
+            "p95": round(self.percentile(95), 4),
+            "max": round(self.max, 4),
+        }
+
+
+class StageRecorder:
+    """Thread-safe ``StageStats`` per stage name; ``observer(stage, seconds)`` sees every sample."""
+
+    def __init__(self, observer=None, window: int = 500):
+        self.observer = observer
+        self.window = window
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats(self.window)
+            stats.add(seconds)
+        if self.observer:
+            self.observer(stage, seconds)
+
+    @contextmanager
+    def timed(self, stage: str):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, time.time() - t0)
+
+    def stage(self, stage: str):
+        """A copy of one stage's stats (empty if nothing was recorded)."""
+        with self._lock:
+            stats = self._stages.get(stage)
+            copy = StageStats(self.window)
+            if stats is not None:
+                copy.count, copy.total, copy.max = stats.count, stats.total, stats.max
+                copy.samples.extend(stats.samples)
+            return copy
+
+    def snapshot(self):
+        with self._lock:
+            return {name: s.snapshot() for name, s in self._stages.items()}
+
+
+class JobQueue:
+    """Bounded FIFO of callables drained by a fixed set of daemon worker threads.
+
+    ``submit`` never blocks: when the queue is full it returns False so the
+    caller can shed load instead of tying up the request thread. Jobs run in
+    a copy of the submitter's context, so context variables (trace ids)
+    follow the work. ``observer(stage, seconds)`` sees every stage timing.
+    """
+
+    def __init__(self, name: str, workers: int = 4, maxsize: int = 100, observer=None):
+        self.name = name
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stages = StageRecorder(observer)
+        self.submitted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.closed = False
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"{self.name}-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)``; return False if the queue is full or draining."""
+        if self.closed:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), contextvars.copy_context(), fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logging.warning(f"Job queue '{self.name}' full ({self.maxsize}); rejecting job")
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def drain(self, timeout: float = 20.0):
+        """Stop accepting jobs and wait up to ``timeout`` seconds for queued ones to finish."""
+        self.closed = True
+        deadline = time.time() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logging.warning(
+                        f"Job queue '{self.name}' drain timed out with {self._queue.unfinished_tasks} job(s) pending"
+                    )
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def record(self, stage: str, seconds: float):
+        self._stages.record(stage, seconds)
+
+    def timed(self, stage: str):
+        return self._stages.timed(stage)
+
+    def stats(self):
+        stages = self._stages.snapshot()
+        with self._lock:
+            return {
+                "name": self.name,
+                "workers": self.workers,
+                "depth": self._queue.qsize(),
+                "maxsize": self.maxsize,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "failed": self.failed,
+                "stages": stages,
+            }
+
+    def _worker(self):
+        while True:
+            enqueued_at, context, fn, args, kwargs = self._queue.get()
+            self.record("queue_wait", time.time() - enqueued_at)
+            try:
+                with self.timed("service"):
+                    context.run(fn, *args, **kwargs)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logging.error(f"Job in queue '{self.name}' failed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+class ProviderLimits:
+    """Per-provider concurrency caps shared by every worker thread.
+
+    ``slot(provider)`` blocks until the provider has a free slot, which gives
+    backpressure towards the queue instead of unbounded concurrent calls.
+    """
+
+    def __init__(self, limits: dict, default: int = 4, observer=None):
+        self.default = default
+        self._limits = dict(limits)
+        self._sems = {name: threading.BoundedSemaphore(max(1, n)) for name, n in self._limits.items()}
+        self._lock = threading.Lock()
+        self._stages = StageRecorder(observer)
+
+    def _semaphore(self, provider: str):
+        with self._lock:
+            sem = self._sems.get(provider)
+            if sem is None:
+                self._limits[provider] = self.default
+                sem = self._sems[provider] = threading.BoundedSemaphore(max(1, self.default))
+            return sem
+
+    @contextmanager
+    def slot(self, provider: str):
+        sem = self._semaphore(provider)
+        t0 = time.time()
+        sem.acquire()
+        t1 = time.time()
+        self._stages.record(f"{provider}_wait", t1 - t0)
+        try:
+            yield
+        finally:
+            sem.release()
+            self._stages.record(f"{provider}_service", time.time() - t1)
+
+    def stats(self):
+        with self._lock:
+            limits = dict(self._limits)
+        return {"limits": limits, "stages": self._stages.snapshot()}
+
+
+class _Box:
+    __slots__ = ("pending", "scheduled", "held_until", "last_arrival")
+
+    def __init__(self):
+        self.pending = deque()
+        self.scheduled = False
+        self.held_until = 0.0
+        self.last_arrival = 0.0
+
+
+class Mailbox:
+    """Per-key serialized processing on top of a JobQueue.
+
+    Messages for different keys (users) run in parallel on the queue's
+    workers; messages for one key are handled strictly one after another, in
+    arrival order. With ``coalesce_window`` > 0 a run of coalescible messages
+    is held until the key has been quiet for that long and handed to the
+    handler as one batch. A handler that finishes its work elsewhere (e.g. a
+    voice note waiting for its transcript) can ``hold`` the key; later
+    messages then wait until ``resume`` or the hold times out.
+    """
+
+    def __init__(self, jobs: JobQueue, handler, coalesce_window: float = 0.0, max_pending: int = 20):
+        self.jobs = jobs
+        self.handler = handler
+        self.coalesce_window = coalesce_window
+        self.max_pending = max_pending
+        self._boxes = {}
+        self._lock = threading.Lock()
+        self.posted = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def post(self, key: str, message, coalescible: bool = True):
+        """Queue ``message`` for ``key``; return False if the key's mailbox or the job queue is full."""
+        with self._lock:
+            box = self._boxes.get(key)
+            if box is None:
+                box = self._boxes[key] = _Box()
+            if len(box.pending) >= self.max_pending:
+                self.rejected += 1
+                return False
+            box.pending.append((message, coalescible))
+            box.last_arrival = time.time()
+            if not self._schedule(key, box):
+                box.pending.pop()
+                self.rejected += 1
+                return False
+            self.posted += 1
+            return True
+
+    def busy(self, key: str):
+        """True while ``key`` has messages queued, running or held."""
+        with self._lock:
+            return key in self._boxes
+
+    def hold(self, key: str, timeout: float):
+        """Keep later messages for ``key`` waiting until ``resume`` (or ``timeout`` seconds)."""
+        with self._lock:
+            box = self._boxes.get(key)
+            if box is None:
+                box = self._boxes[key] = _Box()
+            box.held_until = time.time() + timeout
+        timer = threading.Timer(timeout, self._hold_expired, (key,))
+        timer.daemon = True
+        timer.start()
+
+    def _hold_expired(self, key: str):
+        with self._lock:
+            box = self._boxes.get(key)
+            if box is not None and box.held_until and box.held_until <= time.time():
+                box.held_until = 0.0
+                logging.warning(f"Mailbox hold for {key} expired; continuing with queued messages")
+                self._schedule(key, box)
+
+    def resume(self, key: str, message=None):
+        """Release a hold; ``message`` (if given) is handled before anything queued meanwhile."""
+        with self._lock:
+            box = self._boxes.get(key)
+            if box is None:
+                box = self._boxes[key] = _Box()
+            box.held_until = 0.0
+            if message is not None:
+                box.pending.appendleft((message, False))
+            if not self._schedule(key, box):
+                logging.error(f"Job queue full; mailbox for {key} resumes with the next message")
+                return False
+            return True
+
+    def _schedule(self, key: str, box: _Box):
+        """Make sure a drain job runs for ``key``; caller holds ``self._lock``."""
+        if box.held_until > time.time():
+            return True  # resume() or the hold timer schedules it
+        if not box.pending:
+            if not box.scheduled:
+                del self._boxes[key]
+            return True
+        if box.scheduled:
+            return True
+        box.scheduled = True
+        if not self.jobs.submit(self._run, key):
+            box.scheduled = False
+            return False
+        return True
+
+    def _take(self, key: str):
+        """Pop the next batch for ``key``; None when the key is idle, held or still coalescing."""
+        with self._lock:
+            box = self._boxes[key]
+            if not box.pending or box.held_until > time.time():
+                box.scheduled = False
+                if not box.pending and box.held_until <= time.time():
+                    del self._boxes[key]
+                return None
+            first, coalescible = box.pending[0]
+            wait = box.last_arrival + self.coalesce_window - time.time()
+            if coalescible and wait > 0:
+                # Wait for the user to stop typing before starting the LLM turn, without
+                # keeping a worker: the drain stays scheduled and a timer picks it up again
+                timer = threading.Timer(wait, self._coalesce_due, (key,))
+                timer.daemon = True
+                timer.start()
+                return None
+            batch = [box.pending.popleft()[0]]
+            while coalescible and self.coalesce_window > 0 and box.pending and box.pending[0][1]:
+                batch.append(box.pending.popleft()[0])
+            if len(batch) > 1:
+                self.coalesced += len(batch) - 1
+            return batch
+
+    def _coalesce_due(self, key: str):
+        if not self.jobs.submit(self._run, key):
+            with self._lock:
+                box = self._boxes.get(key)
+                if box is not None:
+                    box.scheduled = False
+            logging.error(f"Job queue full; mailbox for {key} continues with the next message")
+
+    def _run(self, key: str):
+        while True:
+            batch = self._take(key)
+            if batch is None:
+                return
+            try:
+                self.handler(key, batch)
+            except Exception as e:
+                logging.error(f"Mailbox handler for {key} failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active_keys": len(self._boxes),
+                "pending": sum(len(b.pending) for b in self._boxes.values()),
+                "posted": self.posted,
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+            }
+
+
+class RecentKeys:
+    """Bounded set of recently seen ids with a TTL, for dropping duplicate deliveries."""
+
+    def __init__(self, ttl: float = 600.0, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def add(self, key: str):
+        """Record ``key``; return False if it was already seen within the TTL."""
+        now = time.time()
+        with self._lock:
+            while self._seen:
+                oldest, seen_at = next(iter(self._seen.items()))
+                if now - seen_at < self.ttl:
+                    break
+                del self._seen[oldest]
+            if key in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen[key] = now
+            if len(self._seen) > self.maxsize:
+                self._seen.popitem(last=False)
+            return True
+
+    def discard(self, key: str):
+        """Forget ``key`` so a retried delivery is processed (e.g. after shedding it)."""
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._seen), "duplicates": self.duplicates}
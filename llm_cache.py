@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " .!?¿¡,;:"
+
+
+def normalize_prompt(text: str):
+    """Semantic-free normalization: NFKC, casefold, collapse whitespace, trim edge punctuation."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _WHITESPACE.sub(" ", text).strip(_EDGE_PUNCTUATION)
+
+
+class _Flight:
+    __slots__ = ("done", "value")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class ResponseCache:
+    """TTL + LRU cache of LLM replies with an optional SQLite tier.
+
+    Concurrent misses on the same key are coalesced: the first caller
+    (the leader) computes the reply while the others wait for its result,
+    so N identical questions cost one upstream call. Failed computations
+    (``None``) are never cached, and waiters then compute for themselves.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS llm_cache_expires ON llm_cache(expires);
+    """
+
+    def __init__(self, ttl: float = 86400.0, max_entries: int = 1000, db_path: str = None,
+                 wait_timeout: float = 90.0, expire_interval: float = 300.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.wait_timeout = wait_timeout
+        self.expire_interval = expire_interval
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_expire = 0.0
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        if db_path:
+            self._connection().executescript(self.SCHEMA)
+
+    @staticmethod
+    def make_key(prompt: str, model: str, system: str = ""):
+        raw = "\x1f".join((model, system or "", normalize_prompt(prompt)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _db_get(self, key: str, now: float):
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND expires > ?", (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"LLM cache read failed: {e}")
+            return None
+        return row[0] if row else None
+
+    def _db_put(self, key: str, value: str, now: float):
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, now + self.ttl),
+            )
+            if now - self._last_expire >= self.expire_interval:
+                self._last_expire = now
+                conn.execute("DELETE FROM llm_cache WHERE expires <= ?", (now,))
+        except sqlite3.Error as e:
+            logging.error(f"LLM cache write failed: {e}")
+
+    def _remember(self, key: str, value: str, expires: float):
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+        if self.db_path:
+            value = self._db_get(key, now)
+            if value is not None:
+                with self._lock:
+                    self.db_hits += 1
+                    self._remember(key, value, now + self.ttl)
+                return value
+        return None
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now + self.ttl)
+        if self.db_path:
+            self._db_put(key, value, now)
+
+    def begin(self, key: str):
+        """Return ``(value, leader)``.
+
+        ``value`` is the cached (or concurrently computed) reply, if any.
+        Otherwise ``leader`` says whether the caller must compute it and then
+        call ``complete``; a non-leader without a value computes uncached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, False
+        with self._lock:
+            flight = self._inflight.get(key)
+            if flight is None:
+                self._inflight[key] = _Flight()
+                self.misses += 1
+                return None, True
+            self.coalesced += 1
+        flight.done.wait(self.wait_timeout)
+        return flight.value, False
+
+    def complete(self, key: str, value):
+        """Publish the leader's result (``None`` on failure) and release the waiters."""
+        if value is not None:
+            self.put(key, value)
+        with self._lock:
+            flight = self._inflight.pop(key, None)
+        if flight is not None:
+            flight.value = value
+            flight.done.set()
+
+    def get_or_compute(self, key: str, compute):
+        value, leader = self.begin(key)
+        if value is not None:
+            return value
+        if not leader:
+            return compute()
+        try:
+            value = compute()
+        except Exception:
+            self.complete(key, None)
+            raise
+        self.complete(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "inflight": len(self._inflight),
+                "persistent": bool(self.db_path),
+            }
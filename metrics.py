@@ -0,0 +1,197 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets (seconds) spanning a Twilio ack up to a slow transcription
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def current_trace():
+    return _trace_id.get()
+
+
+def set_trace(trace_id):
+    """Set the trace id for this context; returns a token for ``reset_trace``."""
+    return _trace_id.set(trace_id)
+
+
+def reset_trace(token):
+    _trace_id.reset(token)
+
+
+@contextmanager
+def trace(trace_id):
+    token = _trace_id.set(trace_id)
+    try:
+        yield
+    finally:
+        _trace_id.reset(token)
+
+
+class TraceFilter(logging.Filter):
+    """Adds ``%(trace)s`` (" [<id>]" or "") to log records."""
+
+    def filter(self, record):
+        trace_id = _trace_id.get()
+        record.trace = f" [{trace_id}]" if trace_id else ""
+        return True
+
+
+def _label_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, one series per label set."""
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        for key, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in values)
+        return lines
+
+
+class _Callback:
+    """Metric whose samples are read from existing stats at scrape time."""
+
+    def __init__(self, name: str, help_text: str, fn, kind: str):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            samples = self.fn()
+        except Exception as e:
+            logging.error(f"Metric {self.name} failed: {e}")
+            return lines
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+        return lines
+
+
+class Metrics:
+    """In-process metric registry rendered in the Prometheus text format.
+
+    Histograms and counters are created on first use; ``callback`` exposes
+    numbers already tracked elsewhere (queue depth, cache hits) without
+    double bookkeeping.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, factory):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = factory()
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets=None):
+        return self._get(name, lambda: Histogram(name, help_text, buckets or self.buckets))
+
+    def counter(self, name: str, help_text: str):
+        return self._get(name, lambda: Counter(name, help_text))
+
+    def callback(self, name: str, help_text: str, fn, kind: str = "gauge"):
+        """``fn()`` returns a number or a list of ``(labels_dict, value)``."""
+        with self._lock:
+            self._metrics[name] = _Callback(name, help_text, fn, kind)
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.histogram(name, name).observe(seconds, **labels)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        self.counter(name, name).inc(amount, **labels)
+
+    @contextmanager
+    def timed(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def render(self):
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+
+class ProviderUnavailable(Exception):
+    """A provider was used without its credentials configured."""
+
+
+class _Provider:
+    __slots__ = ("factory", "configured", "warm", "instance", "lock", "build_seconds", "warmed")
+
+    def __init__(self, factory, configured: bool, warm):
+        self.factory = factory
+        self.configured = configured
+        self.warm = warm
+        self.instance = None
+        self.lock = threading.Lock()
+        self.build_seconds = None
+        self.warmed = False
+
+
+class ProviderRegistry:
+    """External SDK clients, imported and constructed on first use.
+
+    Factories do their own imports, so a worker only pays for openai,
+    google.genai, murf or gtts once it actually calls them, and a provider
+    whose API key is not configured is never built at all (``get`` raises
+    ``ProviderUnavailable``). Each provider has its own lock: a slow import
+    of one SDK never blocks callers of another.
+
+    ``prewarm`` builds the configured clients and runs their optional warm-up
+    call (connection/TLS setup) on a background thread, so startup and
+    readiness are not delayed but the first real request usually finds the
+    client ready.
+    """
+
+    def __init__(self):
+        self._providers = {}
+        self._prewarm_thread = None
+
+    def register(self, name: str, factory, configured: bool = True, warm=None):
+        """``factory()`` returns the client; ``warm(client)`` is an optional cheap first call."""
+        self._providers[name] = _Provider(factory, configured, warm)
+
+    def override(self, name: str, instance):
+        """Use a ready-made client (e.g. a fake) instead of building one."""
+        provider = self._providers[name]
+        provider.instance = instance
+        provider.configured = True
+
+    def configured(self, name: str):
+        return self._providers[name].configured
+
+    def loaded(self, name: str):
+        return self._providers[name].instance is not None
+
+    def get(self, name: str):
+        provider = self._providers[name]
+        instance = provider.instance
+        if instance is not None:
+            return instance
+        if not provider.configured:
+            raise ProviderUnavailable(f"Provider {name} is not configured")
+        with provider.lock:
+            if provider.instance is None:
+                t0 = time.perf_counter()
+                provider.instance = provider.factory()
+                provider.build_seconds = time.perf_counter() - t0
+                logging.info(f"Provider {name} loaded in {provider.build_seconds:.2f}s")
+        return provider.instance
+
+    def prewarm(self, names=None):
+        """Load (and warm up) the configured providers in ``names`` on a background thread."""
+        if self._prewarm_thread is not None:
+            return self._prewarm_thread
+        names = [n for n in (names or list(self._providers)) if self._providers[n].configured]
+        self._prewarm_thread = threading.Thread(target=self._prewarm, args=(names,), name="provider-prewarm",
+                                                daemon=True)
+        self._prewarm_thread.start()
+        return self._prewarm_thread
+
+    def _prewarm(self, names):
+        t0 = time.perf_counter()
+        for name in names:
+            provider = self._providers[name]
+            try:
+                instance = self.get(name)
+                if provider.warm is not None and not provider.warmed:
+                    provider.warm(instance)
+                provider.warmed = True
+            except Exception as e:
+                # The first real call will retry; warming is best effort
+                logging.warning(f"Prewarming provider {name} failed: {e}")
+        logging.info(f"Prewarmed {len(names)} provider(s) in {time.perf_counter() - t0:.2f}s")
+
+    def stats(self):
+        return {
+            name: {
+                "configured": p.configured,
+                "loaded": p.instance is not None,
+                "build_seconds": round(p.build_seconds, 3) if p.build_seconds is not None else None,
+                "warmed": p.warmed,
+            }
+            for name, p in self._providers.items()
+        }
@@ -0,0 +1,320 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from jobs import StageRecorder, StageStats
+
+# How often ``generate`` checks whether a call queued on the executor has started
+QUEUED_POLL_SECONDS = 0.05
+
+
+class CircuitBreaker:
+    """Stops routing to a provider after repeated failures.
+
+    After ``failure_threshold`` consecutive failures the breaker opens for
+    ``cooldown`` seconds; the first call after that is a half-open trial and
+    a success closes the breaker again.
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        """Give back a half-open trial whose call was cancelled before it finished."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+
+class ProviderStats:
+    """Rolling latency and error-rate window for one provider."""
+
+    def __init__(self, window: int = 100):
+        self.latency = StageStats(window)
+        self.outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool):
+        with self._lock:
+            self.outcomes.append(ok)
+            if ok:
+                self.latency.add(seconds)
+
+    def percentile(self, pct: float):
+        """Latency percentile of successful calls; None before the first one."""
+        with self._lock:
+            if not self.latency.samples:
+                return None
+            return self.latency.percentile(pct)
+
+    def error_rate(self):
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+
+class ProviderRouter:
+    """Latency-aware, hedged router over interchangeable text providers.
+
+    Each provider is a callable ``fn(messages) -> str | None``; None or an
+    exception counts as a failure. ``generate`` calls the fastest healthy
+    provider first and, if it has not answered within its own
+    ``hedge_percentile`` latency, fires the next provider as a hedge. The
+    first good answer wins. Losing calls cannot be interrupted (the SDKs are
+    blocking), so they are cancelled if not yet started and otherwise left to
+    finish in the background with their result discarded (bounded by the
+    SDK clients' own timeout).
+
+    Calls run on a thread pool of ``max_workers``; size it at about twice the
+    number of threads that call ``generate`` at once. The hedge delay and the
+    timeout count from when a call starts running, so time spent queued on
+    the pool is never mistaken for a slow provider. Queue wait is reported
+    separately (``observer(stage, seconds)`` and ``snapshot``).
+    """
+
+    def __init__(self, providers, hedge_percentile: float = 95.0, hedge_min_delay: float = 0.5,
+                 hedge_max_delay: float = 10.0, default_delay: float = 4.0, timeout: float = 60.0,
+                 failure_threshold: int = 3, cooldown: float = 30.0, max_workers: int = 16, observer=None):
+        self.providers = list(providers)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.default_delay = default_delay
+        self.timeout = timeout
+        self.stats = {name: ProviderStats() for name, _ in self.providers}
+        self.breakers = {name: CircuitBreaker(failure_threshold, cooldown) for name, _ in self.providers}
+        self.hedges = 0
+        self.wins = {name: 0 for name, _ in self.providers}
+        self.max_workers = max_workers
+        self._waits = StageRecorder(observer)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-router")
+
+    def ranked(self, exclude=()):
+        """Providers ordered by health, then p50 latency (configured order breaks ties)."""
+        candidates = []
+        for index, (name, fn) in enumerate(self.providers):
+            if name in exclude:
+                continue
+            p50 = self.stats[name].percentile(50)
+            unhealthy = self.stats[name].error_rate() >= 0.5
+            candidates.append((unhealthy, p50 if p50 is not None else self.default_delay, index, name, fn))
+        return [(name, fn) for _, _, _, name, fn in sorted(candidates)]
+
+    def hedge_delay(self, name: str):
+        observed = self.stats[name].percentile(self.hedge_percentile)
+        if observed is None:
+            return self.default_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, observed))
+
+    def record(self, name: str, seconds: float, ok: bool):
+        """Feed one call's outcome into the provider's latency stats and circuit breaker."""
+        self.stats[name].record(seconds, ok)
+        if ok:
+            self.breakers[name].record_success()
+        else:
+            self.breakers[name].record_failure()
+
+    def claim(self, name: str, exclude=()):
+        """Claim ``name`` for a call made outside the router (e.g. a stream).
+
+        True only if it is the top-ranked provider and its breaker lets a call
+        through; the caller must then ``record`` the outcome, or ``release``
+        the claim if the call never completed.
+        """
+        ranked = self.ranked(exclude)
+        return bool(ranked) and ranked[0][0] == name and self.breakers[name].allow()
+
+    def release(self, name: str):
+        self.breakers[name].release()
+
+    def _call(self, name, fn, messages, submitted_at=None, started=None):
+        t0 = time.time()
+        if started is not None:
+            started[name] = t0
+            self._waits.record("queue_wait", t0 - submitted_at)
+        try:
+            result = fn(messages)
+        except Exception as e:
+            logging.error(f"Provider {name} raised: {e}")
+            result = None
+        self.record(name, time.time() - t0, bool(result))
+        return name, result
+
+    def generate(self, messages, exclude=()):
+        """Return the first good answer across providers, or None if all fail."""
+        queue_ = self.ranked(exclude)
+        running = {}
+        started = {}  # provider -> when its call began running on the executor
+
+        def _launch_next():
+            while queue_:
+                name, fn = queue_.pop(0)
+                if self.breakers[name].allow():
+                    # Run in the caller's context so log lines keep its trace id
+                    future = self._executor.submit(contextvars.copy_context().run, self._call, name, fn, messages,
+                                                   time.time(), started)
+                    running[future] = name
+                    return name
+                logging.info(f"Skipping provider {name}: circuit {self.breakers[name].state}")
+            return None
+
+        current = primary = _launch_next()
+        try:
+            while running:
+                now = time.time()
+                remaining = started.get(primary, now) + self.timeout - now
+                if remaining <= 0:
+                    logging.error("LLM router timed out waiting for providers")
+                    return None
+                # Only hedge while the most recently launched provider is still pending
+                can_hedge = bool(queue_) and current in running.values()
+                hedge_at = None
+                if can_hedge and current in started:
+                    hedge_at = started[current] + self.hedge_delay(current)
+                    wait_for = min(remaining, max(0.0, hedge_at - now))
+                elif can_hedge:
+                    # Still queued on the executor: a hedge now would only queue behind it
+                    wait_for = min(remaining, QUEUED_POLL_SECONDS)
+                else:
+                    wait_for = remaining
+                done, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+                if not done:
+                    if hedge_at is None or time.time() < hedge_at:
+                        continue
+                    logging.info(f"Provider {current} slower than p{self.hedge_percentile:g}; hedging")
+                    self.hedges += 1
+                    current = _launch_next() or current
+                    continue
+                for future in done:
+                    running.pop(future)
+                    name, result = future.result()
+                    if result:
+                        self.wins[name] += 1
+                        return result
+                if not running:
+                    current = _launch_next()
+            return None
+        finally:
+            for future, name in running.items():
+                # A call cancelled before it started never reaches _call: give back its breaker trial
+                if future.cancel():
+                    self.breakers[name].release()
+
+    async def _acall(self, name, fn, messages):
+        t0 = time.time()
+        try:
+            result = await fn(messages)
+        except Exception as e:
+            logging.error(f"Provider {name} raised: {e}")
+            result = None
+        self.record(name, time.time() - t0, bool(result))
+        return name, result
+
+    async def agenerate(self, messages, async_providers: dict, exclude=()):
+        """``generate`` for an event loop, over ``{name: async fn(messages)}``.
+
+        Shares ranking, latency stats, hedging and circuit breakers with the
+        threaded path; losing calls are actually cancelled.
+        """
+        queue_ = [(name, async_providers[name]) for name, _ in self.ranked(exclude) if name in async_providers]
+        running = {}
+        deadline = time.time() + self.timeout
+
+        def _launch_next():
+            while queue_:
+                name, fn = queue_.pop(0)
+                if self.breakers[name].allow():
+                    task = asyncio.ensure_future(self._acall(name, fn, messages))
+                    # Cancelled (whether or not it had started): give back its breaker trial
+                    task.add_done_callback(lambda t, n=name: t.cancelled() and self.breakers[n].release())
+                    running[task] = name
+                    return name
+                logging.info(f"Skipping provider {name}: circuit {self.breakers[name].state}")
+            return None
+
+        current = _launch_next()
+        try:
+            while running:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logging.error("LLM router timed out waiting for providers")
+                    return None
+                can_hedge = bool(queue_) and current in running.values()
+                wait_for = min(remaining, self.hedge_delay(current)) if can_hedge else remaining
+                done, _ = await asyncio.wait(list(running), timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if not can_hedge:
+                        continue
+                    logging.info(f"Provider {current} slower than p{self.hedge_percentile:g}; hedging")
+                    self.hedges += 1
+                    current = _launch_next() or current
+                    continue
+                for task in done:
+                    running.pop(task)
+                    name, result = task.result()
+                    if result:
+                        self.wins[name] += 1
+                        return result
+                if not running:
+                    current = _launch_next()
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+
+    def snapshot(self):
+        return {
+            "hedges": self.hedges,
+            "workers": self.max_workers,
+            "queue_wait": self._waits.snapshot().get("queue_wait"),
+            "providers": {
+                name: {
+                    "p50": self.stats[name].percentile(50),
+                    "p95": self.stats[name].percentile(95),
+                    "error_rate": round(self.stats[name].error_rate(), 3),
+                    "circuit": self.breakers[name].state,
+                    "wins": self.wins[name],
+                }
+                for name, _ in self.providers
+            },
+        }
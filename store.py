@@ -0,0 +1,295 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from context import ConversationContext, SUMMARY_MAX_TURNS, estimate_tokens
+
+IDLE_STATE = "idle"
+
+
+class ConversationStore(ABC):
+    """Per-user conversation history and state-machine state.
+
+    Backends must make ``append`` an atomic append-and-trim (history never
+    exceeds ``max_history`` messages), forget users idle for longer than
+    ``ttl`` seconds and report a state older than ``state_ttl`` seconds as
+    idle, so an abandoned "continue" prompt doesn't linger forever.
+    """
+
+    def __init__(self, max_history: int, ttl: float = 86400.0, state_ttl: float = 1800.0):
+        self.max_history = max_history
+        self.ttl = ttl
+        self.state_ttl = state_ttl
+
+    @abstractmethod
+    def append(self, user_id: str, message: dict):
+        pass
+
+    @abstractmethod
+    def history(self, user_id: str) -> ConversationContext:
+        pass
+
+    @abstractmethod
+    def clear_history(self, user_id: str):
+        pass
+
+    @abstractmethod
+    def get_state(self, user_id: str):
+        pass
+
+    @abstractmethod
+    def set_state(self, user_id: str, state: str):
+        pass
+
+    @abstractmethod
+    def clear_state(self, user_id: str):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class UserRecord:
+    __slots__ = ("context", "state", "state_at", "touched")
+
+    def __init__(self, max_history: int, now: float):
+        self.context = ConversationContext(maxlen=max_history)
+        self.state = None
+        self.state_at = 0.0
+        self.touched = now
+
+
+class MemoryStore(ConversationStore):
+    """In-process store: an LRU of slotted user records with idle TTL.
+
+    Records are kept in last-touched order, so expiry only ever looks at the
+    front of the map and LRU eviction (``max_users``) is O(1).
+    """
+
+    def __init__(self, max_history: int, ttl: float = 86400.0, state_ttl: float = 1800.0, max_users: int = 100000):
+        super().__init__(max_history, ttl, state_ttl)
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.RLock()
+        self.expired = 0
+        self.evicted = 0
+
+    def _expire(self, now: float):
+        while self._users:
+            user_id, record = next(iter(self._users.items()))
+            if now - record.touched < self.ttl:
+                break
+            del self._users[user_id]
+            self.expired += 1
+
+    def _record(self, user_id: str, create: bool = True):
+        now = time.time()
+        self._expire(now)
+        record = self._users.get(user_id)
+        if record is None:
+            if not create:
+                return None
+            record = self._users[user_id] = UserRecord(self.max_history, now)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evicted += 1
+        else:
+            record.touched = now
+            self._users.move_to_end(user_id)
+        return record
+
+    def append(self, user_id: str, message: dict):
+        with self._lock:
+            self._record(user_id).context.append(message)
+
+    def history(self, user_id: str):
+        with self._lock:
+            record = self._record(user_id, create=False)
+            if record is None:
+                return ConversationContext(maxlen=self.max_history)
+            return record.context
+
+    def clear_history(self, user_id: str):
+        with self._lock:
+            record = self._record(user_id, create=False)
+            if record is not None:
+                record.context.clear()
+
+    def get_state(self, user_id: str):
+        with self._lock:
+            record = self._record(user_id, create=False)
+            if record is None or record.state is None:
+                return IDLE_STATE
+            if time.time() - record.state_at >= self.state_ttl:
+                record.state = None
+                return IDLE_STATE
+            return record.state
+
+    def set_state(self, user_id: str, state: str):
+        with self._lock:
+            record = self._record(user_id)
+            record.state = state
+            record.state_at = time.time()
+
+    def clear_state(self, user_id: str):
+        with self._lock:
+            record = self._record(user_id, create=False)
+            if record is not None:
+                record.state = None
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "users": len(self._users), "expired": self.expired, "evicted": self.evicted}
+
+
+class SQLiteStore(ConversationStore):
+    """SQLite (WAL) store shared by every worker process on one host.
+
+    Each thread gets its own connection. Appends run in a single
+    ``BEGIN IMMEDIATE`` transaction that inserts the message and moves any
+    overflow to the evicted set (kept for summaries), so concurrent workers
+    can't interleave a half-trimmed history.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            state TEXT,
+            state_at REAL NOT NULL DEFAULT 0,
+            touched REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS users_touched ON users(touched);
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            tokens INTEGER NOT NULL,
+            evicted INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS messages_user ON messages(user_id, evicted, id);
+    """
+
+    def __init__(self, path: str, max_history: int, ttl: float = 86400.0, state_ttl: float = 1800.0,
+                 expire_interval: float = 60.0):
+        super().__init__(max_history, ttl, state_ttl)
+        self.path = path
+        self.expire_interval = expire_interval
+        self._local = threading.local()
+        self._last_expire = 0.0
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connection()
+        return _Transaction(conn)
+
+    def _maybe_expire(self, conn, now: float):
+        if now - self._last_expire < self.expire_interval:
+            return
+        self._last_expire = now
+        cutoff = now - self.ttl
+        conn.execute("DELETE FROM messages WHERE user_id IN (SELECT user_id FROM users WHERE touched < ?)", (cutoff,))
+        conn.execute("DELETE FROM users WHERE touched < ?", (cutoff,))
+
+    def _touch(self, conn, user_id: str, now: float):
+        conn.execute(
+            "INSERT INTO users (user_id, touched) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET touched = excluded.touched",
+            (user_id, now),
+        )
+
+    def append(self, user_id: str, message: dict):
+        now = time.time()
+        with self._transaction() as conn:
+            self._maybe_expire(conn, now)
+            self._touch(conn, user_id, now)
+            conn.execute(
+                "INSERT INTO messages (user_id, message, tokens) VALUES (?, ?, ?)",
+                (user_id, json.dumps(message), estimate_tokens(message.get("content"))),
+            )
+            # Trim: live history beyond max_history becomes evicted (kept for the summary)
+            conn.execute(
+                "UPDATE messages SET evicted = 1 WHERE user_id = ? AND evicted = 0 AND id NOT IN "
+                "(SELECT id FROM messages WHERE user_id = ? AND evicted = 0 ORDER BY id DESC LIMIT ?)",
+                (user_id, user_id, self.max_history),
+            )
+            conn.execute(
+                "DELETE FROM messages WHERE user_id = ? AND evicted = 1 AND id NOT IN "
+                "(SELECT id FROM messages WHERE user_id = ? AND evicted = 1 ORDER BY id DESC LIMIT ?)",
+                (user_id, user_id, SUMMARY_MAX_TURNS),
+            )
+
+    def history(self, user_id: str):
+        rows = self._connection().execute(
+            "SELECT message, tokens, evicted FROM messages WHERE user_id = ? ORDER BY id", (user_id,)
+        ).fetchall()
+        live = [(json.loads(m), tokens) for m, tokens, evicted in rows if not evicted]
+        evicted = [json.loads(m) for m, _, ev in rows if ev]
+        return ConversationContext.from_entries(self.max_history, live, evicted)
+
+    def clear_history(self, user_id: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+
+    def get_state(self, user_id: str):
+        row = self._connection().execute("SELECT state, state_at FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if not row or row[0] is None or time.time() - row[1] >= self.state_ttl:
+            return IDLE_STATE
+        return row[0]
+
+    def set_state(self, user_id: str, state: str):
+        now = time.time()
+        with self._transaction() as conn:
+            self._touch(conn, user_id, now)
+            conn.execute("UPDATE users SET state = ?, state_at = ? WHERE user_id = ?", (state, now, user_id))
+
+    def clear_state(self, user_id: str):
+        with self._transaction() as conn:
+            conn.execute("UPDATE users SET state = NULL WHERE user_id = ?", (user_id,))
+
+    def stats(self):
+        conn = self._connection()
+        users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "users": users}
+
+
+class _Transaction:
+    """``BEGIN IMMEDIATE`` ... ``COMMIT``/``ROLLBACK`` around an autocommit connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def create_store(backend: str, max_history: int, ttl: float, state_ttl: float, max_users: int, db_path: str):
+    """Build the configured ConversationStore backend."""
+    if backend == "sqlite":
+        logging.info(f"Using SQLite conversation store at {os.path.abspath(db_path)}")
+        return SQLiteStore(db_path, max_history, ttl=ttl, state_ttl=state_ttl)
+    if backend != "memory":
+        logging.warning(f"Unknown CONVERSATION_STORE '{backend}'; using in-memory store")
+    return MemoryStore(max_history, ttl=ttl, state_ttl=state_ttl, max_users=max_users)
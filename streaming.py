@@ -0,0 +1,137 @@
+import contextvars
+import logging
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# A sentence ends at ., ! or ? (optionally followed by closing quotes/brackets)
+# and is followed by whitespace.
+SENTENCE_BOUNDARY = re.compile(r"[.!?…]+[\"')\]]*\s+")
+
+
+def _split_long(sentence: str, max_chars: int):
+    """Break an over-long sentence at word boundaries into pieces of at most max_chars."""
+    while len(sentence) > max_chars:
+        cut = sentence.rfind(" ", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars
+        yield sentence[:cut].strip()
+        sentence = sentence[cut:].strip()
+    if sentence:
+        yield sentence
+
+
+def _pack(pending: str, sentence: str, min_chars: int, max_chars: int):
+    """Append a sentence to the pending text; return (ready pieces, new pending)."""
+    ready = []
+    candidate = f"{pending} {sentence}".strip() if pending else sentence
+    if pending and len(candidate) > max_chars:
+        ready.append(pending)
+        candidate = sentence
+    if len(candidate) >= min_chars:
+        ready.extend(_split_long(candidate, max_chars))
+        candidate = ""
+    return ready, candidate
+
+
+def iter_sentences(chunks, min_chars: int = 40, max_chars: int = 500):
+    """Turn a stream of text chunks (e.g. LLM token deltas) into sentences.
+
+    Sentences shorter than ``min_chars`` are merged with the next one so we
+    don't synthesize a clip per "Sure!"; nothing longer than ``max_chars``
+    is ever yielded (run-on sentences are split at word boundaries).
+    """
+    buffer = ""
+    pending = ""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer += chunk
+        while True:
+            match = SENTENCE_BOUNDARY.search(buffer)
+            if not match:
+                break
+            sentence = buffer[:match.end()].strip()
+            buffer = buffer[match.end():]
+            ready, pending = _pack(pending, sentence, min_chars, max_chars)
+            yield from ready
+        # Don't let a run-on sentence grow without bound while streaming
+        if len(buffer) > max_chars:
+            cut = buffer.rfind(" ", 0, max_chars)
+            if cut > 0:
+                head, buffer = buffer[:cut].strip(), buffer[cut:]
+                ready, pending = _pack(pending, head, max_chars, max_chars)
+                yield from ready
+    if buffer.strip():
+        ready, pending = _pack(pending, buffer.strip(), min_chars, max_chars)
+        yield from ready
+    if pending:
+        yield pending
+
+
+def split_text(text: str, max_chars: int = 500):
+    """Split a complete text into sentence-aligned chunks of at most max_chars."""
+    return list(iter_sentences([text], min_chars=max_chars, max_chars=max_chars))
+
+
+def synthesize_in_order(segments, synthesize, deliver, max_parallel: int = 3):
+    """Synthesize text segments concurrently and deliver the results in order.
+
+    ``segments`` may be a lazy generator (such as ``iter_sentences`` over an
+    LLM stream): each segment is submitted as soon as it is produced, and a
+    separate thread hands finished clips to ``deliver`` strictly in segment
+    order, so the first clip goes out as soon as the first sentence is ready.
+    Returns the number of clips delivered.
+    """
+    ordered = queue.Queue()
+    delivered = [0]
+
+    def _deliver_loop():
+        while True:
+            future = ordered.get()
+            if future is None:
+                return
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"Segment synthesis failed: {e}")
+                continue
+            if not result:
+                continue
+            try:
+                deliver(result)
+                delivered[0] += 1
+            except Exception as e:
+                logging.error(f"Segment delivery failed: {e}")
+
+    deliverer = threading.Thread(target=_deliver_loop, name="tts-deliver", daemon=True)
+    deliverer.start()
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix="tts-segment") as pool:
+        try:
+            for segment in segments:
+                ordered.put(pool.submit(contextvars.copy_context().run, synthesize, segment))
+        finally:
+            ordered.put(None)
+            deliverer.join()
+    return delivered[0]
+
+
+def _strip_id3(data: bytes, keep_header: bool):
+    """Drop ID3v2 header (unless keep_header) and trailing ID3v1 tag from mp3 bytes."""
+    if not keep_header and len(data) >= 10 and data[:3] == b"ID3":
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        data = data[10 + size + footer:]
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        data = data[:-128]
+    return data
+
+
+def concat_mp3(paths, target_path: str):
+    """Stitch mp3 files into one by concatenating their frames (no re-encoding)."""
+    with open(target_path, "wb") as out:
+        for i, path in enumerate(paths):
+            with open(path, "rb") as fh:
+                out.write(_strip_id3(fh.read(), keep_header=(i == 0)))
+    return target_path
@@ -0,0 +1,41 @@
+"""Import ``app`` once per test run, wired to the local fake providers."""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+TEST_ENV = {
+    "FAKE_PROVIDERS": "true",
+    "FAKE_LATENCY": "openrouter=0.2,gemini=0.2,murf=0.01,gtts=0.01,twilio=0.001,assemblyai=0.05,media=0.001",
+    "ASYNC_WEBHOOK": "true",
+    "LLM_CACHE": "true",
+    "OPENROUTER_API_KEY": "test",
+    "GEMINI_API_KEY": "test",
+    "TWILIO_ACCOUNT_SID": "ACtest",
+    "TWILIO_AUTH_TOKEN": "test",
+    "TWILIO_WHATSAPP_NUMBER": "whatsapp:+10000000000",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def load_app():
+    """The ``app`` module, imported with ``TEST_ENV`` from a scratch directory (audio files land there)."""
+    if "app" not in sys.modules:
+        os.environ.update(TEST_ENV)
+        os.chdir(tempfile.mkdtemp(prefix="whatsappbot-tests-"))
+    import app
+    return app
+
+
+def wait_for(predicate, timeout: float = 5.0):
+    """Poll ``predicate`` until it is true or ``timeout`` seconds pass; return its last value."""
+    deadline = time.time() + timeout
+    while True:
+        value = predicate()
+        if value or time.time() >= deadline:
+            return value
+        time.sleep(0.01)
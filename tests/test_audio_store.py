@@ -0,0 +1,90 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_store import AudioStore  # noqa: E402
+from tts_cache import AudioCache  # noqa: E402
+
+
+def write(directory, name, size):
+    path = os.path.join(str(directory), name)
+    with open(path, "wb") as f:
+        f.write(b"\x00" * size)
+    return path
+
+
+def make_pair(tmp_path, max_bytes=10_000, promote_after=2):
+    """An AudioStore and AudioCache wired together the way app.py does it."""
+    store = AudioStore(str(tmp_path), max_bytes=max_bytes, hot_max_bytes=0,
+                       is_pinned=lambda path: cache.owns(path),
+                       on_pinned_evicted=lambda path: cache.forget(path))
+    cache = AudioCache(str(tmp_path), promote_after=promote_after, on_evict=store.forget)
+    return store, cache
+
+
+def synthesize(store, cache, tmp_path, text, name, size=1000):
+    """What ``cache_tts_output`` does after a synthesis."""
+    key = AudioCache.make_key(text, "gtts", "en")
+    path = cache.put(key, write(tmp_path, name, size))
+    store.register(path)
+    return key, path
+
+
+def test_one_off_reply_is_not_cached_and_is_swept_after_fetch(tmp_path):
+    store, cache = make_pair(tmp_path)
+    store.fetched_grace = 0.0
+    key, path = synthesize(store, cache, tmp_path, "a personal answer", "u1_response_1_aaaaaa.mp3")
+    assert os.path.basename(path) == "u1_response_1_aaaaaa.mp3"
+    assert cache.get(key) is None
+    store.mark_served(os.path.basename(path), 1000)
+    assert store.sweep() == 1
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_repeated_text_is_promoted_into_the_cache(tmp_path):
+    store, cache = make_pair(tmp_path)
+    synthesize(store, cache, tmp_path, "Thanks for chatting!", "u1_response_1_aaaaaa.mp3")
+    key, path = synthesize(store, cache, tmp_path, "Thanks  for chatting!", "u2_response_2_bbbbbb.mp3")
+    assert os.path.basename(path) == f"tts_{key}.mp3"
+    assert cache.get(key) == path
+    assert cache.stats()["promotions"] == 1
+    # Pinned: fetching it does not get it deleted
+    store.fetched_grace = 0.0
+    store.mark_served(os.path.basename(path), 1000)
+    store.sweep()
+    assert os.path.exists(path)
+
+
+def test_promote_after_one_caches_every_synthesis(tmp_path):
+    store, cache = make_pair(tmp_path, promote_after=1)
+    key, path = synthesize(store, cache, tmp_path, "hello", "u1_response_1_aaaaaa.mp3")
+    assert cache.get(key) == path
+
+
+def test_quota_counts_pinned_files_and_evicts_them_last(tmp_path):
+    store, cache = make_pair(tmp_path, max_bytes=3500, promote_after=1)
+    pinned_keys = [synthesize(store, cache, tmp_path, f"cached {i}", f"x_response_{i}_aaaaaa.mp3")[0]
+                   for i in range(3)]
+    assert store.stats()["bytes"] == 3000
+    # Over quota with only pinned files besides the new one: the oldest pinned clip goes
+    store.is_pinned = lambda path: False
+    new = write(tmp_path, "u_response_9_cccccc.mp3", 1000)
+    store.register(new)
+    assert os.path.exists(new)
+    assert store.stats()["bytes"] <= 3500
+    assert cache.get(pinned_keys[0]) is None
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] == 2000
+
+
+def test_quota_evicts_unpinned_before_pinned(tmp_path):
+    store, cache = make_pair(tmp_path, max_bytes=2500, promote_after=1)
+    old = write(tmp_path, "u_response_1_aaaaaa.mp3", 1000)
+    store.register(old)
+    key, cached = synthesize(store, cache, tmp_path, "cached", "x_response_2_aaaaaa.mp3")
+    new = write(tmp_path, "u_response_3_bbbbbb.mp3", 1000)
+    store.register(new)
+    assert not os.path.exists(old)
+    assert os.path.exists(cached) and os.path.exists(new)
+    assert cache.get(key) == cached
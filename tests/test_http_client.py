@@ -0,0 +1,126 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client import HttpClient  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers from ``server.script``: a list of (status, headers, delay) per path, consumed in order."""
+
+    def _answer(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        with self.server.lock:
+            self.server.hits.append((self.command, self.path))
+            script = self.server.script.get(self.path) or [(200, {}, 0.0)]
+            status, headers, delay = script.pop(0) if len(script) > 1 else script[0]
+        time.sleep(delay)
+        body = b"ok"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.script = {}
+        self.server.hits = []
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_address[1]
+        self.base = f"http://127.0.0.1:{self.port}"
+        self.client = HttpClient(connect_timeout=1.0, read_timeout=0.3, retries=2, backoff=0.01, backoff_max=0.05)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def hits(self, path):
+        return [h for h in self.server.hits if h[1] == path]
+
+    def test_retries_retryable_status_then_succeeds(self):
+        self.server.script["/flaky"] = [(503, {}, 0.0), (200, {}, 0.0)]
+        response = self.client.get(f"{self.base}/flaky")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.hits("/flaky")), 2)
+        stats = self.client.stats()[f"127.0.0.1:{self.port}"]
+        self.assertEqual(stats["retries"], 1)
+        self.assertEqual(stats["statuses"], {503: 1, 200: 1})
+
+    def test_gives_up_after_bounded_retries(self):
+        self.server.script["/down"] = [(503, {}, 0.0)]
+        self.assertEqual(self.client.get(f"{self.base}/down").status_code, 503)
+        self.assertEqual(len(self.hits("/down")), 3)
+
+    def test_retry_after_is_capped_by_backoff_max(self):
+        self.server.script["/limited"] = [(429, {"Retry-After": "30"}, 0.0), (200, {}, 0.0)]
+        t0 = time.time()
+        self.assertEqual(self.client.get(f"{self.base}/limited").status_code, 200)
+        self.assertLess(time.time() - t0, 1.0)
+
+    def test_post_is_not_retried_by_default(self):
+        self.server.script["/create"] = [(503, {}, 0.0), (200, {}, 0.0)]
+        self.assertEqual(self.client.post(f"{self.base}/create", data=b"x").status_code, 503)
+        self.assertEqual(len(self.hits("/create")), 1)
+
+    def test_streamed_body_is_never_replayed(self):
+        self.server.script["/upload"] = [(503, {}, 0.0), (200, {}, 0.0)]
+        response = self.client.post(f"{self.base}/upload", data=iter([b"a", b"b"]), idempotent=True)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.hits("/upload")), 1)
+
+    def test_idempotent_post_with_replayable_body_is_retried(self):
+        self.server.script["/upload"] = [(503, {}, 0.0), (200, {}, 0.0)]
+        response = self.client.post(f"{self.base}/upload", data=b"abc", idempotent=True)
+        self.assertEqual(response.status_code, 200)
+
+    def test_read_timeout_is_retried_then_raised(self):
+        self.server.script["/slow"] = [(200, {}, 1.0)]
+        t0 = time.time()
+        with self.assertRaises(requests.Timeout):
+            self.client.get(f"{self.base}/slow")
+        self.assertLess(time.time() - t0, 2.0)
+        self.assertEqual(len(self.hits("/slow")), 3)
+        self.assertEqual(self.client.stats()[f"127.0.0.1:{self.port}"]["errors"], 3)
+
+    def test_connection_refused_raises(self):
+        self.tearDown()
+        self.tearDown = lambda: None
+        with self.assertRaises(requests.ConnectionError):
+            self.client.get(f"{self.base}/gone")
+        self.assertEqual(self.client.stats()[f"127.0.0.1:{self.port}"]["errors"], 3)
+
+    def test_redirect_keeps_home_pool_and_counts_target_host(self):
+        home = f"127.0.0.1:{self.port}"
+        target = f"localhost:{self.port}"
+        self.server.script["/media"] = [(302, {"Location": f"http://{target}/cdn"}, 0.0)]
+        session = self.client.session_for(home)
+        self.client.get(f"{self.base}/media")
+        pools = session.get_adapter(self.base).poolmanager.pools
+        self.assertEqual(len(pools), 2)
+        stats = self.client.stats()
+        self.assertEqual(stats[home]["statuses"], {302: 1})
+        self.assertEqual(stats[target]["statuses"], {200: 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intents import FAREWELL, GREETING, NO, YES, IntentMatcher  # noqa: E402
+
+# (message, expected intent); None means free text that must reach the LLM.
+# Also the accuracy set of ``python bench.py intents``.
+LABELED_INTENTS = [
+    ("hi", GREETING), ("Hello!", GREETING), ("  hey ", GREETING), ("Good morning 🌞", GREETING),
+    ("menu", GREETING), ("I need help", GREETING), ("start", GREETING),
+    ("yes", YES), ("Yeah!", YES), ("y", YES), ("yep.", YES),
+    ("no", NO), ("Nope", NO), ("n", NO),
+    ("bye", FAREWELL), ("Bye bye!", FAREWELL), ("ok thanks", FAREWELL), ("thank you so much", FAREWELL),
+    ("see you tomorrow", FAREWELL), ("good night", FAREWELL), ("please stop", FAREWELL),
+    ("exit", FAREWELL), ("take care!", FAREWELL), ("thx", FAREWELL), ("The END.", FAREWELL),
+    ("what should I do this weekend?", None), ("nonstop flights to Goa", None),
+    ("how do I extend my visa", None), ("tell me about the bystander effect", None),
+    ("hi, what's the weather in Mumbai?", None), ("is yesterday's match on tv", None),
+    ("know any good trends", None), ("exiting vim", None), ("stopwatch apps", None),
+    ("hello there, can you help me plan a trip", None), ("nobody knows", None),
+    ("", None), ("   ", None), ("👍", None),
+]
+
+MATCHER = IntentMatcher()
+
+
+@pytest.mark.parametrize("text,expected", LABELED_INTENTS)
+def test_labeled_intent(text, expected):
+    assert MATCHER.classify(text)[0] == expected
+
+
+def test_canned_reply_matches_whole_message_only():
+    matcher = IntentMatcher(canned={"hours": {"phrases": ["opening hours", "When are you open?"],
+                                              "reply": "We are open 9-5."}})
+    assert matcher.classify("When are you OPEN") == ("hours", "We are open 9-5.")
+    assert matcher.classify("opening hours!") == ("hours", "We are open 9-5.")
+    assert matcher.classify("what are your opening hours on sunday") == (None, None)
+    # Built-in intents still work next to canned ones
+    assert matcher.classify("hi") == (GREETING, None)
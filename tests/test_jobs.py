@@ -0,0 +1,154 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import JobQueue, Mailbox, StageRecorder, percentile  # noqa: E402
+from support import wait_for  # noqa: E402
+
+
+class Recorder:
+    """Mailbox handler that records ``(key, batch, start time)`` and optionally sleeps."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, key, batch):
+        self.calls.append((key, list(batch), time.time()))
+        time.sleep(self.delay)
+
+
+class StageRecorderTest(unittest.TestCase):
+    def test_percentile_is_nearest_rank(self):
+        samples = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(samples, 50), 51.0)
+        self.assertEqual(percentile(samples, 95), 95.0)
+        self.assertEqual(percentile(samples, 100), 100.0)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_record_feeds_stats_and_observer(self):
+        seen = []
+        recorder = StageRecorder(observer=lambda stage, seconds: seen.append((stage, seconds)))
+        for seconds in (0.1, 0.3, 0.2):
+            recorder.record("llm", seconds)
+        with recorder.timed("tts"):
+            pass
+        stats = recorder.stage("llm")
+        self.assertEqual((stats.count, stats.max, stats.percentile(50)), (3, 0.3, 0.2))
+        self.assertEqual(recorder.stage("missing").count, 0)
+        self.assertEqual(set(recorder.snapshot()), {"llm", "tts"})
+        self.assertEqual([stage for stage, _ in seen], ["llm", "llm", "llm", "tts"])
+
+
+class JobQueueTest(unittest.TestCase):
+    def test_full_queue_rejects_without_blocking(self):
+        release = threading.Event()
+        jobs = JobQueue("test", workers=1, maxsize=1)
+        self.assertTrue(jobs.submit(release.wait))
+        self.assertTrue(wait_for(lambda: jobs.depth() == 0))
+        self.assertTrue(jobs.submit(release.wait))
+        t0 = time.time()
+        self.assertFalse(jobs.submit(release.wait))
+        self.assertLess(time.time() - t0, 0.1)
+        self.assertEqual(jobs.stats()["rejected"], 1)
+        release.set()
+        self.assertTrue(jobs.drain(timeout=2))
+
+    def test_drain_waits_for_queued_jobs(self):
+        done = []
+        jobs = JobQueue("test", workers=2, maxsize=10)
+        for i in range(6):
+            self.assertTrue(jobs.submit(lambda i=i: (time.sleep(0.05), done.append(i))))
+        self.assertTrue(jobs.drain(timeout=5))
+        self.assertEqual(sorted(done), list(range(6)))
+        # Draining closes the queue to new work
+        self.assertFalse(jobs.submit(done.append, 99))
+
+    def test_drain_times_out_on_stuck_jobs(self):
+        release = threading.Event()
+        jobs = JobQueue("test", workers=1, maxsize=10)
+        jobs.submit(release.wait)
+        self.assertFalse(jobs.drain(timeout=0.1))
+        release.set()
+
+    def test_failed_job_is_counted_and_worker_survives(self):
+        done = []
+        jobs = JobQueue("test", workers=1, maxsize=10)
+        jobs.submit(lambda: 1 / 0)
+        jobs.submit(done.append, 1)
+        self.assertTrue(jobs.drain(timeout=2))
+        self.assertEqual(done, [1])
+        stats = jobs.stats()
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["stages"]["service"]["count"], 2)
+
+
+class MailboxTest(unittest.TestCase):
+    def setUp(self):
+        self.jobs = JobQueue("test", workers=1, maxsize=10)
+
+    def tearDown(self):
+        self.jobs.drain(timeout=2)
+
+    def test_messages_for_one_key_run_in_order(self):
+        handler = Recorder(delay=0.02)
+        mailbox = Mailbox(self.jobs, handler)
+        for i in range(3):
+            self.assertTrue(mailbox.post("a", i))
+        self.assertTrue(wait_for(lambda: len(handler.calls) == 3))
+        self.assertEqual([batch for _, batch, _ in handler.calls], [[0], [1], [2]])
+        self.assertTrue(wait_for(lambda: not mailbox.busy("a")))
+
+    def test_coalesce_window_does_not_hold_a_worker(self):
+        handler = Recorder()
+        mailbox = Mailbox(self.jobs, handler, coalesce_window=0.3)
+        t0 = time.time()
+        mailbox.post("a", "one")
+        mailbox.post("a", "two")
+        # The only worker must be free for another key while "a" is coalescing
+        mailbox.post("b", "now", coalescible=False)
+        self.assertTrue(wait_for(lambda: len(handler.calls) == 2))
+        (first_key, _, first_at), (second_key, batch, second_at) = handler.calls
+        self.assertEqual(first_key, "b")
+        self.assertLess(first_at - t0, 0.2)
+        self.assertEqual((second_key, batch), ("a", ["one", "two"]))
+        self.assertGreaterEqual(second_at - t0, 0.3)
+        self.assertEqual(mailbox.stats()["coalesced"], 1)
+
+    def test_non_coalescible_message_is_its_own_batch(self):
+        handler = Recorder()
+        mailbox = Mailbox(self.jobs, handler, coalesce_window=0.1)
+        mailbox.post("a", "one")
+        mailbox.post("a", "hi", coalescible=False)
+        mailbox.post("a", "two")
+        self.assertTrue(wait_for(lambda: len(handler.calls) == 3))
+        self.assertEqual([batch for _, batch, _ in handler.calls], [["one"], ["hi"], ["two"]])
+
+    def test_busy_while_held_until_resumed(self):
+        handler = Recorder()
+        mailbox = Mailbox(self.jobs, handler)
+        mailbox.hold("a", timeout=5)
+        mailbox.post("a", "later")
+        time.sleep(0.1)
+        self.assertTrue(mailbox.busy("a"))
+        self.assertEqual(handler.calls, [])
+        mailbox.resume("a", "transcript")
+        self.assertTrue(wait_for(lambda: len(handler.calls) == 2))
+        self.assertEqual([batch for _, batch, _ in handler.calls], [["transcript"], ["later"]])
+        self.assertTrue(wait_for(lambda: not mailbox.busy("a")))
+
+    def test_post_rejected_when_mailbox_full(self):
+        mailbox = Mailbox(self.jobs, Recorder(), max_pending=1)
+        mailbox.hold("a", timeout=5)
+        self.assertTrue(mailbox.post("a", 1))
+        self.assertFalse(mailbox.post("a", 2))
+        self.assertEqual(mailbox.stats()["rejected"], 1)
+        mailbox.resume("a")
+
+
+if __name__ == "__main__":
+    unittest.main()
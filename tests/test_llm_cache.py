@@ -0,0 +1,133 @@
+import os
+import sys
+import threading
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_cache import ResponseCache  # noqa: E402
+from support import load_app  # noqa: E402
+
+bot = load_app()
+
+
+class CountingProvider:
+    """Fake LLM: counts calls, sleeps ``delay``, then returns the next scripted reply (the last one repeats)."""
+
+    def __init__(self, *replies, delay=0.2):
+        self.replies = list(replies)
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            index = min(self.calls, len(self.replies) - 1)
+            self.calls += 1
+        time.sleep(self.delay)
+        return self.replies[index]
+
+
+def run_concurrently(n, fn):
+    """Start ``fn()`` on ``n`` threads released together by a barrier; return the results."""
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def _run(i):
+        barrier.wait()
+        results[i] = fn()
+
+    threads = [threading.Thread(target=_run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def prompt(question, *history):
+    return [{"role": "system", "content": bot.BOT_PERSONA}, *history, {"role": "user", "content": question}]
+
+
+def test_identical_concurrent_misses_make_one_upstream_call():
+    cache = ResponseCache()
+    provider = CountingProvider("the answer")
+    results = run_concurrently(20, lambda: cache.get_or_compute("k", provider))
+    assert results == ["the answer"] * 20
+    assert provider.calls == 1
+    assert cache.stats()["coalesced"] == 19
+    assert cache.get("k") == "the answer"
+
+
+def test_generate_reply_shares_one_router_call():
+    provider = CountingProvider("shared reply")
+    question = prompt(f"what is single flight {time.time()}")
+    with mock.patch.object(bot.LLM_ROUTER, "generate", provider):
+        results = run_concurrently(10, lambda: bot.generate_reply(question))
+    assert results == ["shared reply"] * 10
+    assert provider.calls == 1
+
+
+def test_failed_result_is_not_cached_and_waiters_retry():
+    cache = ResponseCache()
+    provider = CountingProvider(None, "second try")
+    results = run_concurrently(3, lambda: cache.get_or_compute("k", provider))
+    # The leader's failure is handed to nobody: each waiter computes for itself
+    assert results.count(None) == 1
+    assert results.count("second try") == 2
+    assert provider.calls == 3
+    assert cache.get("k") is None
+    # The next request leads a fresh flight and caches its answer
+    assert cache.get_or_compute("k", provider) == "second try"
+    assert cache.get("k") == "second try"
+
+
+def test_leader_exception_releases_waiters():
+    cache = ResponseCache()
+
+    def boom():
+        time.sleep(0.1)
+        raise RuntimeError("provider down")
+
+    try:
+        cache.get_or_compute("k", boom)
+    except RuntimeError:
+        pass
+    assert cache.get("k") is None
+    assert cache.get_or_compute("k", lambda: "ok") == "ok"
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = ResponseCache(ttl=0.1, db_path=str(tmp_path / "llm.db"))
+    cache.put("k", "v")
+    assert cache.get("k") == "v"
+    # The SQLite tier survives a restart
+    assert ResponseCache(ttl=0.1, db_path=str(tmp_path / "llm.db")).get("k") == "v"
+    time.sleep(0.15)
+    assert cache.get("k") is None
+    assert ResponseCache(ttl=0.1, db_path=str(tmp_path / "llm.db")).get("k") is None
+
+
+def test_lru_bound():
+    cache = ResponseCache(max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, key.upper())
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
+
+
+def test_cache_key_is_for_first_questions_only():
+    greeting = {"role": "assistant", "content": bot.GREETING_REPLY}
+    key = bot.llm_cache_key(prompt("What is a llama?"))
+    assert key
+    # Normalized question; the greeting isn't real history
+    assert bot.llm_cache_key(prompt("  what is a LLAMA ")) == key
+    assert bot.llm_cache_key(prompt("What is a llama?", greeting)) == key
+    # Anything that makes the answer depend on more than the question
+    earlier = [{"role": "user", "content": "hi there"}, {"role": "assistant", "content": "Hello! Ask away."}]
+    assert bot.llm_cache_key(prompt("What is a llama?", *earlier)) is None
+    assert bot.llm_cache_key(prompt("What is a llama?", {"role": "user", "content": "and also"})) is None
+    summary = {"role": "system", "content": "Summary of earlier conversation: llamas"}
+    assert bot.llm_cache_key(prompt("What is a llama?", summary)) is None
+    assert bot.llm_cache_key(prompt("")) is None
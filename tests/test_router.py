@@ -0,0 +1,148 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from router import ProviderRouter  # noqa: E402
+
+
+def scripted(reply, delay=0.0, calls=None):
+    """Fake provider: sleeps ``delay`` then returns ``reply`` (an Exception instance is raised)."""
+    def _fn(messages):
+        if calls is not None:
+            calls.append(time.time())
+        time.sleep(delay)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+    return _fn
+
+
+def ascripted(reply, delay=0.0, cancelled=None):
+    async def _fn(messages):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.append(True)
+            raise
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+    return _fn
+
+
+def open_breaker(router, name):
+    breaker = router.breakers[name]
+    breaker.opened_at = time.time()
+
+
+def half_open_breaker(router, name):
+    breaker = router.breakers[name]
+    breaker.opened_at = time.time() - breaker.cooldown - 1
+
+
+class GenerateTest(unittest.TestCase):
+    def test_first_provider_answers(self):
+        router = ProviderRouter([("a", scripted("from a")), ("b", scripted("from b"))], default_delay=1.0)
+        self.assertEqual(router.generate([]), "from a")
+        self.assertEqual(router.hedges, 0)
+
+    def test_slow_provider_is_hedged(self):
+        router = ProviderRouter([("a", scripted("from a", delay=1.0)), ("b", scripted("from b", delay=0.05))],
+                                default_delay=0.1, hedge_min_delay=0.05)
+        t0 = time.time()
+        self.assertEqual(router.generate([]), "from b")
+        self.assertLess(time.time() - t0, 0.5)
+        self.assertEqual(router.hedges, 1)
+        self.assertEqual(router.wins["b"], 1)
+
+    def test_failure_falls_through(self):
+        router = ProviderRouter([("a", scripted(RuntimeError("boom"))), ("b", scripted("from b"))], default_delay=5.0)
+        self.assertEqual(router.generate([]), "from b")
+
+    def test_open_breaker_is_skipped(self):
+        a_calls = []
+        router = ProviderRouter([("a", scripted("from a", calls=a_calls)), ("b", scripted("from b"))],
+                                failure_threshold=1)
+        open_breaker(router, "a")
+        self.assertEqual(router.generate([]), "from b")
+        self.assertEqual(a_calls, [])
+
+    def test_breaker_opens_after_failures(self):
+        router = ProviderRouter([("a", scripted(None))], failure_threshold=2)
+        self.assertIsNone(router.generate([]))
+        self.assertEqual(router.breakers["a"].state, "closed")
+        router.generate([])
+        self.assertEqual(router.breakers["a"].state, "open")
+
+    def test_cancelled_trial_is_released(self):
+        # One worker, busy with a: b's hedged half-open trial is queued, then cancelled at the timeout
+        gate = threading.Event()
+        router = ProviderRouter([("a", lambda m: gate.wait(2.0) and None), ("b", scripted("from b"))],
+                                default_delay=0.05, hedge_min_delay=0.05, timeout=0.3, max_workers=1)
+        half_open_breaker(router, "b")
+        router.stats["b"].record(10.0, True)  # rank b second
+        self.assertIsNone(router.generate([]))
+        gate.set()
+        self.assertFalse(router.breakers["b"]._trial_in_flight)
+        self.assertTrue(router.breakers["b"].allow())
+
+    def test_queued_calls_are_not_hedged_or_timed_out(self):
+        # 8 callers on 2 threads: the last ones wait ~0.9s for a thread, longer than
+        # the hedge delay and close to the timeout, but neither counts queue time
+        b_calls = []
+        router = ProviderRouter([("a", scripted("from a", delay=0.3)), ("b", scripted("from b", calls=b_calls))],
+                                default_delay=0.6, hedge_min_delay=0.6, timeout=1.0, max_workers=2)
+        results = []
+        callers = [threading.Thread(target=lambda: results.append(router.generate([]))) for _ in range(8)]
+        for t in callers:
+            t.start()
+        for t in callers:
+            t.join()
+        self.assertEqual(results, ["from a"] * 8)
+        self.assertEqual(router.hedges, 0)
+        self.assertEqual(b_calls, [])
+        snapshot = router.snapshot()
+        self.assertEqual(snapshot["queue_wait"]["count"], 8)
+        self.assertGreater(snapshot["queue_wait"]["max"], 0.6)
+        # Provider latency excludes the queue wait
+        self.assertLess(snapshot["providers"]["a"]["p95"], 0.5)
+
+    def test_claim_and_record(self):
+        router = ProviderRouter([("a", scripted("x")), ("b", scripted("y"))], failure_threshold=1)
+        self.assertFalse(router.claim("b"))
+        self.assertTrue(router.claim("a"))
+        router.record("a", 0.1, False)
+        self.assertFalse(router.claim("a"))
+        self.assertFalse(router.claim("unknown"))
+
+
+class AsyncGenerateTest(unittest.TestCase):
+    def test_hedge_cancels_loser(self):
+        cancelled = []
+        router = ProviderRouter([("a", None), ("b", None)], default_delay=0.05, hedge_min_delay=0.05)
+        providers = {"a": ascripted("from a", delay=1.0, cancelled=cancelled), "b": ascripted("from b", delay=0.05)}
+
+        async def _run():
+            result = await router.agenerate([], providers)
+            await asyncio.sleep(0)  # let the cancellation land
+            return result
+
+        self.assertEqual(asyncio.run(_run()), "from b")
+        self.assertEqual(cancelled, [True])
+        self.assertFalse(router.breakers["a"]._trial_in_flight)
+
+    def test_cancelled_trial_is_released(self):
+        router = ProviderRouter([("a", None)], timeout=0.1)
+        half_open_breaker(router, "a")
+        self.assertIsNone(asyncio.run(router.agenerate([], {"a": ascripted("late", delay=1.0)})))
+        self.assertTrue(router.breakers["a"].allow())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context import SUMMARY_MAX_TURNS  # noqa: E402
+from store import IDLE_STATE, ConversationStore, MemoryStore, SQLiteStore  # noqa: E402
+
+MAX_HISTORY = 6
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    """Factory for the backend under test; SQLite stores share one file in ``tmp_path``."""
+    def _make(**kwargs):
+        if request.param == "sqlite":
+            kwargs.setdefault("expire_interval", 0.0)
+            kwargs.pop("max_users", None)
+            return SQLiteStore(str(tmp_path / "conversations.db"), MAX_HISTORY, **kwargs)
+        return MemoryStore(MAX_HISTORY, **kwargs)
+    return _make
+
+
+def message(text):
+    return {"role": "user", "content": text}
+
+
+def test_store_is_abstract():
+    with pytest.raises(TypeError):
+        ConversationStore(MAX_HISTORY)
+
+
+def test_append_trims_to_max_history(make_store):
+    store = make_store()
+    for i in range(10):
+        store.append("alice", message(f"m{i}"))
+    history = store.history("alice")
+    assert [m["content"] for m in history] == [f"m{i}" for i in range(4, 10)]
+    assert history.tokens == sum(tokens for _, tokens in history.entries())
+
+
+def test_state_expires_when_idle(make_store):
+    store = make_store(state_ttl=0.1)
+    assert store.get_state("alice") == IDLE_STATE
+    store.set_state("alice", "continue")
+    assert store.get_state("alice") == "continue"
+    time.sleep(0.15)
+    assert store.get_state("alice") == IDLE_STATE
+    store.set_state("alice", "continue")
+    store.clear_state("alice")
+    assert store.get_state("alice") == IDLE_STATE
+
+
+def test_idle_users_are_forgotten(make_store):
+    store = make_store(ttl=0.1)
+    store.append("alice", message("hello"))
+    time.sleep(0.15)
+    store.append("bob", message("hi"))  # expiry runs on writes
+    assert len(store.history("alice")) == 0
+    assert len(store.history("bob")) == 1
+
+
+def test_clear_history(make_store):
+    store = make_store()
+    store.append("alice", message("hello"))
+    store.clear_history("alice")
+    assert len(store.history("alice")) == 0
+
+
+def test_sqlite_append_and_trim_is_atomic_across_writers(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    # Two stores stand in for two worker processes sharing the file
+    stores = [SQLiteStore(path, MAX_HISTORY), SQLiteStore(path, MAX_HISTORY)]
+    writers, per_writer = 8, 25
+    seen_lengths = []
+    done = threading.Event()
+
+    def _write(index):
+        store = stores[index % 2]
+        for i in range(per_writer):
+            store.append("alice", message(f"w{index}-{i}"))
+
+    def _read():
+        while not done.is_set():
+            seen_lengths.append(len(stores[0].history("alice")))
+
+    reader = threading.Thread(target=_read)
+    reader.start()
+    threads = [threading.Thread(target=_write, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    done.set()
+    reader.join()
+
+    # Readers never see a half-trimmed history
+    assert max(seen_lengths) <= MAX_HISTORY
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT id, evicted FROM messages WHERE user_id = 'alice' ORDER BY id").fetchall()
+    live = [row_id for row_id, evicted in rows if not evicted]
+    evicted = [row_id for row_id, evicted in rows if evicted]
+    assert len(live) == MAX_HISTORY
+    assert len(evicted) == SUMMARY_MAX_TURNS
+    # The live window is the newest messages, the evicted ones directly precede it
+    assert live == [row_id for row_id, _ in rows[-MAX_HISTORY:]]
+    assert max(evicted) < min(live)
+    total = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()[0]
+    assert total == writers * per_writer
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryStore(MAX_HISTORY, max_users=2)
+    store.append("alice", message("a"))
+    store.append("bob", message("b"))
+    store.history("alice")  # any access makes alice the most recently used
+    store.append("carol", message("c"))
+    assert len(store.history("bob")) == 0
+    assert len(store.history("alice")) == 1
+    assert len(store.history("carol")) == 1
+    assert store.stats()["evicted"] == 1
+
+
+def test_memory_store_ttl_expiry_is_counted():
+    store = MemoryStore(MAX_HISTORY, ttl=0.1)
+    store.append("alice", message("a"))
+    store.append("bob", message("b"))
+    time.sleep(0.15)
+    store.append("carol", message("c"))
+    assert store.stats()["users"] == 1
+    assert store.stats()["expired"] == 2
@@ -0,0 +1,34 @@
+import time
+import unittest
+from unittest import mock
+
+from support import load_app, wait_for
+
+bot = load_app()
+
+
+class StreamReplyWithAudioTest(unittest.TestCase):
+    def test_thank_you_suffix_is_spoken_with_the_last_sentence(self):
+        user = "whatsapp:+2001"
+        sent = []
+        bot.FAKES.twilio.on_send = lambda to, message: sent.append(message) if to == user else None
+        self.addCleanup(setattr, bot.FAKES.twilio, "on_send", None)
+        messages = [{"role": "system", "content": bot.BOT_PERSONA}, {"role": "user", "content": "tell me a story"}]
+
+        with mock.patch.object(bot, "text_to_speech_murf", wraps=bot.text_to_speech_murf) as tts:
+            bot.stream_reply_with_audio(user, messages, "https://bot.test/")
+
+        spoken = [c.args[0] for c in tts.call_args_list]
+        # The fake model answers in two sentences: two clips, no clip for the suffix alone
+        self.assertEqual(len(spoken), 2)
+        self.assertTrue(spoken[-1].endswith(bot.THANK_YOU_SUFFIX))
+        self.assertNotIn(bot.THANK_YOU_SUFFIX, spoken[0])
+        self.assertTrue(wait_for(lambda: len(sent) >= 2))
+        time.sleep(0.2)
+        self.assertEqual(len(sent), 2)
+        history = list(bot.STORE.history(user))
+        self.assertTrue(history[-1]["content"].endswith(bot.THANK_YOU_SUFFIX + bot.CONTINUE_PROMPT))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import time
+import unittest
+from unittest import mock
+
+from support import load_app, wait_for
+
+bot = load_app()
+
+EMPTY_TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response />'
+
+
+class AsyncWebhookTest(unittest.TestCase):
+    """``ASYNC_WEBHOOK=true`` against ``FakeProviders``: acknowledge first, reply over the REST API."""
+
+    def setUp(self):
+        self.client = bot.app.test_client()
+        self.sent = []
+        bot.FAKES.twilio.on_send = lambda to, message: self.sent.append((to, message, time.time()))
+        self.addCleanup(setattr, bot.FAKES.twilio, "on_send", None)
+
+    def post(self, sid, user, body="what is the capital of peru"):
+        return self.client.post("/webhook", data={"Body": body, "From": user, "MessageSid": sid})
+
+    def sent_to(self, user):
+        return [entry for entry in self.sent if entry[0] == user]
+
+    def test_webhook_acknowledges_with_empty_twiml_before_the_reply(self):
+        t0 = time.time()
+        response = self.post("SMack", "whatsapp:+1001")
+        acked_at = time.time()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.decode(), EMPTY_TWIML)
+        # The fake LLM alone takes 0.2s; the acknowledgement must not wait for it
+        self.assertLess(acked_at - t0, 0.15)
+        self.assertTrue(wait_for(lambda: self.sent_to("whatsapp:+1001")))
+        self.assertGreater(self.sent_to("whatsapp:+1001")[0][2], acked_at)
+
+    def test_reply_is_delivered_through_the_fake_twilio_client(self):
+        sent_before = bot.FAKES.twilio.sent
+        self.post("SMreply", "whatsapp:+1002")
+        self.assertTrue(wait_for(lambda: self.sent_to("whatsapp:+1002")))
+        _, message, _ = self.sent_to("whatsapp:+1002")[0]
+        self.assertEqual(message.body, None)
+        self.assertTrue(message.media_url)
+        self.assertIn("/audio/", message.media_url[0])
+        self.assertGreater(bot.FAKES.twilio.sent, sent_before)
+
+    def test_full_queue_sends_busy_reply_and_forgets_the_sid(self):
+        with mock.patch.object(bot.JOB_QUEUE, "submit", return_value=False), \
+                mock.patch.object(bot.DEDUPE, "discard", wraps=bot.DEDUPE.discard) as discard:
+            response = self.post("SMfull", "whatsapp:+1003")
+        self.assertIn("busy", response.data.decode())
+        discard.assert_called_once_with("SMfull")
+        # Twilio's retry of the shed message is processed, not dropped as a duplicate
+        response = self.post("SMfull", "whatsapp:+1003")
+        self.assertEqual(response.data.decode(), EMPTY_TWIML)
+        self.assertTrue(wait_for(lambda: self.sent_to("whatsapp:+1003")))
+
+    def test_duplicate_sid_is_acknowledged_without_processing(self):
+        self.post("SMdup", "whatsapp:+1004")
+        self.assertTrue(wait_for(lambda: self.sent_to("whatsapp:+1004")))
+        response = self.post("SMdup", "whatsapp:+1004")
+        self.assertEqual(response.data.decode(), EMPTY_TWIML)
+        time.sleep(0.4)
+        self.assertEqual(len(self.sent_to("whatsapp:+1004")), 1)
+
+    def test_failed_transcript_error_comes_before_later_messages(self):
+        user = "whatsapp:+1005"
+        events = []
+
+        def on_send(to, message):
+            if message.body == bot.VOICE_NOTE_ERROR:
+                time.sleep(0.1)  # a slow send must still finish before the next turn starts
+            events.append(("sent", message.body))
+
+        bot.FAKES.twilio.on_send = on_send
+        # A voice note is waiting for its transcript; the user keeps typing meanwhile
+        bot.MAILBOX.hold(user, 5)
+        with mock.patch.object(bot, "process_message_job",
+                               side_effect=lambda *args: events.append(("turn", args[1]))):
+            self.post("SMlater", user)
+            time.sleep(0.1)
+            self.assertEqual(events, [])
+            bot.resume_after_transcript(user, None, "http://localhost/")
+            self.assertTrue(wait_for(lambda: len(events) >= 2))
+        self.assertEqual(events, [("sent", bot.VOICE_NOTE_ERROR), ("turn", "what is the capital of peru")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class _Pending:
+    __slots__ = ("callbacks", "started", "deadline", "interval")
+
+    def __init__(self, started: float, deadline: float, interval: float):
+        self.callbacks = []
+        self.started = started
+        self.deadline = deadline
+        self.interval = interval
+
+
+class TranscriptPoller:
+    """Polls every pending AssemblyAI transcript from a single background thread.
+
+    Instead of one request thread sleeping 2 s between polls per voice note,
+    callers ``watch`` a transcript id with a completion callback (or block in
+    ``wait``). Polling starts at ``initial_interval`` and backs off
+    geometrically; when the clip length is known the interval scales with it,
+    since processing time grows with audio duration. ``resolve`` completes a
+    transcript early, e.g. from the AssemblyAI webhook.
+    """
+
+    def __init__(self, fetch, initial_interval: float = 0.5, max_interval: float = 5.0, backoff: float = 1.5,
+                 duration_factor: float = 0.05, timeout: float = 120.0):
+        self.fetch = fetch
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.duration_factor = duration_factor
+        self.timeout = timeout
+        self._pending = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.polls = 0
+        self.completed = 0
+        self.timed_out = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="transcript-poller", daemon=True)
+            self._thread.start()
+
+    def first_interval(self, audio_seconds):
+        if audio_seconds:
+            return min(self.max_interval, max(self.initial_interval, audio_seconds * self.duration_factor))
+        return self.initial_interval
+
+    def watch(self, transcript_id: str, on_done, audio_seconds: float = None, timeout: float = None,
+              interval: float = None):
+        """Call ``on_done(result)`` once the transcript completes (result dict) or fails/times out (None).
+
+        ``interval`` overrides the first poll interval; one longer than
+        ``max_interval`` is kept, e.g. for a slow safety-net poll behind a webhook.
+        """
+        now = time.time()
+        with self._cond:
+            self._ensure_started()
+            pending = self._pending.get(transcript_id)
+            if pending is None:
+                interval = interval or self.first_interval(audio_seconds)
+                pending = _Pending(now, now + (timeout or self.timeout), interval)
+                self._pending[transcript_id] = pending
+                heapq.heappush(self._heap, (now + interval, next(self._seq), transcript_id))
+                self._cond.notify()
+            pending.callbacks.append(on_done)
+
+    def wait(self, transcript_id: str, audio_seconds: float = None, timeout: float = None):
+        """Block until the transcript resolves; return the result dict or None."""
+        done = threading.Event()
+        box = {}
+
+        def _on_done(result):
+            box["result"] = result
+            done.set()
+
+        self.watch(transcript_id, _on_done, audio_seconds=audio_seconds, timeout=timeout)
+        done.wait((timeout or self.timeout) + self.max_interval)
+        return box.get("result")
+
+    def resolve(self, transcript_id: str, result):
+        """Complete a watched transcript with ``result`` (None for failure). Returns False if unknown."""
+        with self._cond:
+            pending = self._pending.pop(transcript_id, None)
+        if pending is None:
+            return False
+        if result is not None:
+            self.completed += 1
+        for callback in pending.callbacks:
+            try:
+                callback(result)
+            except Exception as e:
+                logging.error(f"Transcript {transcript_id} callback failed: {e}")
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due_at, _, transcript_id = self._heap[0]
+                delay = due_at - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                pending = self._pending.get(transcript_id)
+            if pending is None:
+                continue  # resolved elsewhere (e.g. by the webhook)
+            self._poll(transcript_id, pending)
+
+    def _poll(self, transcript_id: str, pending: _Pending):
+        self.polls += 1
+        try:
+            result = self.fetch(transcript_id)
+        except Exception as e:
+            logging.warning(f"Polling transcript {transcript_id} failed: {e}")
+            result = {}
+        status = result.get("status")
+        if status == "completed":
+            self.resolve(transcript_id, result)
+            return
+        if status == "error":
+            logging.error(f"AssemblyAI transcription error: {result.get('error')}")
+            self.resolve(transcript_id, None)
+            return
+        now = time.time()
+        if now >= pending.deadline:
+            logging.error(f"AssemblyAI transcription {transcript_id} timed out")
+            self.timed_out += 1
+            self.resolve(transcript_id, None)
+            return
+        pending.interval = min(max(self.max_interval, pending.interval), pending.interval * self.backoff)
+        with self._cond:
+            heapq.heappush(self._heap, (min(now + pending.interval, pending.deadline), next(self._seq), transcript_id))
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "polls": self.polls,
+                "completed": self.completed,
+                "timed_out": self.timed_out,
+            }
@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+class AudioCache:
+    """Content-addressed cache of synthesized mp3 files.
+
+    Entries live next to the other replies in the audio directory as
+    ``<prefix><sha256>.mp3``; the key covers everything that changes the
+    audio (normalized text, engine and voice settings). The in-memory index
+    is rebuilt from disk on startup and evicted in LRU order once either the
+    entry count or the total size exceeds its bound.
+
+    Only text that repeats is cached: the first ``promote_after - 1``
+    syntheses of a key are just remembered and their files stay ordinary
+    (per-user) replies, so one-off answers are cleaned up with the rest of
+    the audio instead of being pinned here.
+    """
+
+    def __init__(self, directory: str, max_entries: int = 500, max_bytes: int = 200 * 1024 * 1024, prefix: str = "tts_",
+                 on_evict=None, promote_after: int = 2):
+        self.directory = directory
+        self.on_evict = on_evict
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.promote_after = max(1, promote_after)
+        self._index = OrderedDict()  # key -> size in bytes
+        self._seen = OrderedDict()  # uncached key -> syntheses so far (bounded)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.promotions = 0
+        self._load()
+
+    @staticmethod
+    def make_key(text: str, engine: str, voice_id: str = "", style: str = "", sample_rate=""):
+        normalized = " ".join(unicodedata.normalize("NFC", text or "").split())
+        raw = "\x1f".join([normalized, engine, voice_id or "", style or "", str(sample_rate or "")])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str):
+        return os.path.join(self.directory, f"{self.prefix}{key}.mp3")
+
+    def owns(self, path: str):
+        """True if ``path`` is a cache entry file (and must not be deleted by callers)."""
+        name = os.path.basename(path or "")
+        return (
+            os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.directory)
+            and name.startswith(self.prefix)
+            and name.endswith(".mp3")
+        )
+
+    def _load(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        entries = []
+        for name in names:
+            if not (name.startswith(self.prefix) and name.endswith(".mp3")):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[len(self.prefix):-4], st.st_size))
+        # Oldest first so the most recently written clips are evicted last
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+        self._evict()
+
+    def get(self, key: str):
+        """Return the cached file path for ``key`` or None on a miss."""
+        path = self.path_for(key)
+        with self._lock:
+            if key in self._index and os.path.exists(path):
+                self._index.move_to_end(key)
+                self.hits += 1
+                return path
+            if key in self._index:
+                self._bytes -= self._index.pop(key)
+            self.misses += 1
+        return None
+
+    def put(self, key: str, source_path: str):
+        """Offer a freshly synthesized file; return the path to deliver.
+
+        The file is moved into the cache once its key has been synthesized
+        ``promote_after`` times, and otherwise left where it is.
+        """
+        with self._lock:
+            count = self._seen.pop(key, 0) + 1
+            if count < self.promote_after:
+                self._seen[key] = count
+                while len(self._seen) > self.max_entries * 4:
+                    self._seen.popitem(last=False)
+                return source_path
+        path = self.path_for(key)
+        try:
+            os.replace(source_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logging.error(f"Failed to add {source_path} to TTS cache: {e}")
+            return source_path
+        with self._lock:
+            if key in self._index:
+                self._bytes -= self._index.pop(key)
+            self._index[key] = size
+            self._bytes += size
+            self.promotions += 1
+            self._evict()
+        return path
+
+    def forget(self, path: str):
+        """Drop an entry whose file was deleted by someone else (e.g. the audio quota)."""
+        name = os.path.basename(path)
+        key = name[len(self.prefix):-4]
+        with self._lock:
+            size = self._index.pop(key, None)
+            if size is not None:
+                self._bytes -= size
+
+    def _evict(self):
+        while self._index and (len(self._index) > self.max_entries or self._bytes > self.max_bytes):
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            path = self.path_for(key)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            if self.on_evict:
+                self.on_evict(path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "promotions": self.promotions,
+            }